@@ -0,0 +1,238 @@
+"""
+A/B experiment analysis of the per-query metrics in `ecs-search-metrics_transform_queryid`. Every variant of an
+experiment is compared with its control on click-through rate, mean reciprocal rank and time to first click, with
+confidence intervals for the differences from a Poisson bootstrap.
+
+Per-query metrics are streamed from a point in time with `search_after`, a page at a time, as columnar NumPy arrays
+(see `COLUMNS`) split by experiment and variant. Every metric is a ratio of two column sums, so a bootstrap replicate
+only needs the column sums weighted by Poisson(1) draws, one weight per query and replicate. Weighted sums are a
+matrix product per page, done on a pool of worker processes, and only the sums are kept: memory is bounded by the
+pages in flight, not by the number of queries. Every page has its own random generator derived from the seed, so the
+same seed gives the same intervals regardless of the number of workers.
+
+Queries are resampled independently, so the intervals do not account for correlation between queries of the same
+user, and are narrower than intervals from resampling users would be.
+"""
+
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+from metrics.resources import QUERYID_TRANSFORM
+
+CONTROL = 'control'
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_KEEP_ALIVE = '1m'
+DEFAULT_MAX_PENDING = 16
+DEFAULT_NUM_REPLICATES = 1000
+DEFAULT_PAGE_SIZE = 10000
+DEFAULT_WORKERS = os.cpu_count()
+NO_EXPERIMENT = 'none'
+
+# queries per matrix product of a bootstrap, which bounds the memory of Poisson weights
+BOOTSTRAP_CHUNK_SIZE = 1024
+
+# Poisson(1) weights by 16-bit random integer, i.e. the inverse CDF at 65536 quantiles, which is several times faster
+# to sample than `Generator.poisson` (with an error in probabilities below 1 / 65536)
+POISSON_CDF = np.cumsum([math.exp(-1) / math.factorial(k) for k in range(20)])
+POISSON_WEIGHTS = np.searchsorted(POISSON_CDF, (np.arange(2 ** 16) + 0.5) / 2 ** 16).astype(np.float32)
+
+EXPERIMENT_FIELD = 'query_event.SearchMetricsSimulation.ab.experiment.keyword'
+VARIANT_FIELD = 'query_event.SearchMetricsSimulation.ab.variant.keyword'
+RESULTS_FIELD = 'query_event.SearchMetrics.results.size'
+CLICKS_FIELD = 'metrics.clicks.count'
+RECIPROCAL_RANK_FIELD = 'metrics.clicks.max_reciprocal_rank'
+TIME_TO_FIRST_CLICK_FIELD = 'metrics.clicks.time_to_first_click'
+
+# per-query columns, and metrics as ratios of column sums: (numerator, denominator)
+COLUMNS = ['has_results', 'clicked_with_results', 'clicked', 'reciprocal_rank', 'time_to_first_click']
+METRICS = {
+    'ctr': ('clicked_with_results', 'has_results'),
+    'mrr': ('reciprocal_rank', 'clicked'),
+    'time_to_first_click': ('time_to_first_click', 'clicked'),
+}
+
+
+def _field(hit, name, default=None):
+    values = hit.get('fields', {}).get(name)
+    return values[0] if values else default
+
+
+def page_columns(hits):
+    """The experiments, variants and columns (a float32 array of queries by `COLUMNS`) of a page of hits."""
+    experiments = np.array([_field(x, EXPERIMENT_FIELD, NO_EXPERIMENT) for x in hits], dtype=object)
+    variants = np.array([_field(x, VARIANT_FIELD, NO_EXPERIMENT) for x in hits], dtype=object)
+
+    has_results = np.array([_field(x, RESULTS_FIELD, 0) > 0 for x in hits], dtype=np.float32)
+    clicked = np.array([_field(x, CLICKS_FIELD, 0) > 0 for x in hits], dtype=np.float32)
+    columns = np.empty((len(hits), len(COLUMNS)), dtype=np.float32)
+    columns[:, 0] = has_results
+    columns[:, 1] = has_results * clicked
+    columns[:, 2] = clicked
+    columns[:, 3] = [_field(x, RECIPROCAL_RANK_FIELD, 0.0) for x in hits]
+    columns[:, 4] = [_field(x, TIME_TO_FIRST_CLICK_FIELD, 0.0) for x in hits]
+    return experiments, variants, columns
+
+
+def split_by_variant(experiments, variants, columns):
+    """Splits the columns of a page by experiment and variant, skipping queries that are in no experiment."""
+    keys = np.array([f'{e}\0{v}' for e, v in zip(experiments, variants)], dtype=object)
+    for key in sorted(set(keys)):
+        experiment, variant = key.split('\0')
+        if experiment != NO_EXPERIMENT:
+            yield (experiment, variant), columns[keys == key]
+
+
+def iter_pages(es, index=QUERYID_TRANSFORM, page_size=DEFAULT_PAGE_SIZE, keep_alive=DEFAULT_KEEP_ALIVE,
+               experiment=None):
+    """
+    Streams per-query metrics from a point in time of the index, with `search_after`. Yields the experiments, variants
+    and columns of a page at a time (see `page_columns`).
+    """
+    pit = es.open_point_in_time(index=index, keep_alive=keep_alive)['id']
+    body = {
+        'size': page_size,
+        '_source': False,
+        'docvalue_fields': [EXPERIMENT_FIELD, VARIANT_FIELD, RESULTS_FIELD, CLICKS_FIELD, RECIPROCAL_RANK_FIELD,
+                            TIME_TO_FIRST_CLICK_FIELD],
+        'sort': [{'_shard_doc': 'asc'}],
+        'track_total_hits': False,
+    }
+    if experiment:
+        body['query'] = {'term': {EXPERIMENT_FIELD: experiment}}
+
+    try:
+        while True:
+            response = es.search(body=dict(body, pit={'id': pit, 'keep_alive': keep_alive}))
+            pit = response.get('pit_id', pit)
+            hits = response['hits']['hits']
+            if not hits:
+                break
+            yield page_columns(hits)
+            body['search_after'] = hits[-1]['sort']
+    finally:
+        es.close_point_in_time(body={'id': pit})
+
+
+def bootstrap_sums(columns, num_replicates, seed):
+    """
+    The column sums of every bootstrap replicate (an array of replicates by columns), with a Poisson(1) weight per
+    query and replicate (see `POISSON_WEIGHTS`). Weights are drawn for a chunk of queries at a time.
+    """
+    rng = np.random.default_rng(seed)
+    sums = np.zeros((num_replicates, columns.shape[1]))
+    for start in range(0, len(columns), BOOTSTRAP_CHUNK_SIZE):
+        chunk = columns[start:start + BOOTSTRAP_CHUNK_SIZE]
+        weights = POISSON_WEIGHTS[rng.integers(0, 2 ** 16, (num_replicates, len(chunk)), dtype=np.uint16)]
+        sums += weights @ chunk
+    return sums
+
+
+def _bootstrap_task(task):
+    key, columns, num_replicates, seed = task
+    return key, len(columns), columns.sum(axis=0, dtype=np.float64), bootstrap_sums(columns, num_replicates, seed)
+
+
+class VariantSums:
+    """The number of queries, column sums and column sums per bootstrap replicate of a variant."""
+
+    def __init__(self, num_replicates):
+        self.num_queries = 0
+        self.sums = np.zeros(len(COLUMNS))
+        self.replicates = np.zeros((num_replicates, len(COLUMNS)))
+
+    def add(self, num_queries, sums, replicates):
+        self.num_queries += num_queries
+        self.sums += sums
+        self.replicates += replicates
+
+    def metric(self, name):
+        """The value of a metric, and its value per bootstrap replicate (NaN without a denominator)."""
+        numerator, denominator = (COLUMNS.index(x) for x in METRICS[name])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = self.sums[numerator] / self.sums[denominator] if self.sums[denominator] else np.nan
+            replicates = self.replicates[:, numerator] / self.replicates[:, denominator]
+        return value, replicates
+
+
+def bootstrap(pages, num_replicates=DEFAULT_NUM_REPLICATES, seed=None, workers=DEFAULT_WORKERS,
+              max_pending=DEFAULT_MAX_PENDING):
+    """
+    Bootstraps the column sums of every experiment and variant from pages (see `iter_pages`), on a pool of worker
+    processes with at most `max_pending` pages in flight. Returns `VariantSums` by experiment and variant.
+    """
+    entropy = np.random.SeedSequence(seed).entropy
+    results = {}
+
+    def collect(result):
+        key, num_queries, sums, replicates = result
+        results.setdefault(key, VariantSums(num_replicates)).add(num_queries, sums, replicates)
+
+    def tasks():
+        for i, page in enumerate(pages):
+            for j, (key, columns) in enumerate(split_by_variant(*page)):
+                yield key, columns, num_replicates, np.random.SeedSequence(entropy, spawn_key=(i, j))
+
+    if workers <= 1:
+        for task in tasks():
+            collect(_bootstrap_task(task))
+        return results
+
+    with multiprocessing.Pool(workers) as pool:
+        pending = []
+        for task in tasks():
+            pending.append(pool.apply_async(_bootstrap_task, (task,)))
+            if len(pending) >= max_pending:
+                collect(pending.pop(0).get())
+        for result in pending:
+            collect(result.get())
+    return results
+
+
+def compare(results, confidence=DEFAULT_CONFIDENCE, control=CONTROL):
+    """
+    Compares every variant with the control of its experiment on all metrics. Returns rows with the values of both,
+    the difference and its confidence interval (from bootstrap percentiles), and whether the interval excludes 0.
+    """
+    alpha = (1 - confidence) / 2
+    rows = []
+    for (experiment, variant) in sorted(results):
+        if variant == control or (experiment, control) not in results:
+            continue
+        treatment_sums = results[(experiment, variant)]
+        control_sums = results[(experiment, control)]
+        for name in METRICS:
+            control_value, control_replicates = control_sums.metric(name)
+            value, replicates = treatment_sums.metric(name)
+            differences = replicates - control_replicates
+            differences = differences[~np.isnan(differences)]
+            low, high = np.quantile(differences, [alpha, 1 - alpha]) if len(differences) else (np.nan, np.nan)
+            rows.append({
+                'experiment': experiment,
+                'variant': variant,
+                'metric': name,
+                'num_queries': treatment_sums.num_queries,
+                'num_control_queries': control_sums.num_queries,
+                'control': float(control_value),
+                'value': float(value),
+                'difference': float(value - control_value),
+                'relative_difference': float((value - control_value) / control_value) if control_value else None,
+                'ci_low': float(low),
+                'ci_high': float(high),
+                'significant': bool(low > 0 or high < 0),
+            })
+    return rows
+
+
+def print_comparison(rows, confidence=DEFAULT_CONFIDENCE):
+    """Prints a comparison as a table, marking significant differences with `*`."""
+    ci = f'{confidence:.0%} CI'
+    print(f"{'experiment':<12}{'variant':<10}{'metric':<22}{'queries':>10}{'control':>12}{'variant':>12}"
+          f"{'difference':>12}{'relative':>10}  {ci}")
+    for x in rows:
+        relative = '-' if x['relative_difference'] is None else f"{x['relative_difference']:+.1%}"
+        print(f"{x['experiment']:<12}{x['variant']:<10}{x['metric']:<22}{x['num_queries']:>10}{x['control']:>12.4f}"
+              f"{x['value']:>12.4f}{x['difference']:>+12.4f}{relative:>10}  "
+              f"[{x['ci_low']:+.4f}, {x['ci_high']:+.4f}]{' *' if x['significant'] else ''}")
@@ -0,0 +1,626 @@
+"""
+A vectorized variant of the simulation in `metrics.simulate`. Instead of building events one at a time, all random
+draws for a batch of users (timestamps, result sets, clicks, ranks, durations) are made at once as NumPy arrays.
+Events are only turned into ECS dictionaries at the output edge, and have the same schema as the events from
+`simulate.query`, `simulate.query_second_page` and `simulate.result_clicks`.
+"""
+
+import faker
+import numpy as np
+
+from tqdm import tqdm
+
+from metrics import clicks, ndjson
+from metrics.profiles import EXPERIMENT_NAMES, VARIANT_NAMES, UserProfiles, build_profiles
+from metrics.queries import DEFAULT_POOL_SIZE, DEFAULT_SKEW, build_query_pool, random_queries
+from metrics.timeline import TimeModel, millis_to_timestamps
+
+from metrics.simulate import COUNTRIES_ALL, DATE, ECS_VERSION, MAX_NUM_RESULTS, MAX_TOOK_MS, MIN_TOOK_MS, MS_TO_NANOS, \
+    NUM_STATIC_QUERIES, PAGE_NAMES, PAGE_SIZE, SECOND_PAGE_PROBABILITY, STATIC_QUERY_PROBABILITY, string_ids
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BLOCK_SIZE = 100
+DEFAULT_SHARD_SIZE = 10000
+
+# kinds of events in a batch
+QUERY = 0
+PAGE = 1
+CLICK = 2
+
+
+def random_uuids(rng, n):
+    """Generate `n` random (version 4) UUIDs as rows of 16 bytes."""
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0f) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3f) | 0x80
+    return raw
+
+
+def uuid_strings(raw):
+    """Formats rows of 16 bytes as UUID strings."""
+    h = raw.tobytes().hex()
+    return [f'{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}'
+            for i in range(0, len(h), 32)]
+
+
+def ragged_offsets(counts):
+    """Start offsets of each row in a flat array holding rows of the given lengths, with a final end offset."""
+    return np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+
+def ragged_rows(counts):
+    """The row index of every element in a flat array holding rows of the given lengths."""
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def ragged_positions(counts):
+    """The position within its row of every element in a flat array holding rows of the given lengths."""
+    offsets = ragged_offsets(counts)
+    return np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+
+
+def random_results(rng, num_documents, counts):
+    """
+    Generate a random result set per row, as one flat array of document IDs (integers) holding rows of the given
+    lengths. Results within a row are distinct.
+    """
+    offsets = ragged_offsets(counts)
+    rows = ragged_rows(counts)
+    results = rng.integers(0, num_documents, size=offsets[-1])
+
+    # sampling is done with replacement, so redraw (rare) rows with duplicate results
+    order = np.lexsort((results, rows))
+    sorted_results = results[order]
+    sorted_rows = rows[order]
+    duplicate = (sorted_results[1:] == sorted_results[:-1]) & (sorted_rows[1:] == sorted_rows[:-1])
+    for row in np.unique(sorted_rows[1:][duplicate]):
+        results[offsets[row]:offsets[row + 1]] = rng.choice(num_documents, counts[row], replace=False)
+
+    return results
+
+
+class Simulation:
+    """
+    The fixed parts of a simulation that are shared by all batches: the corpus size, the static queries, the pool of
+    other queries, the geographic coordinates to sample user locations from and the table of user profiles.
+
+    Query times are sampled from the `time_model` (see `metrics.timeline`), by default uniformly over a single day.
+    Clicks are sampled from the `click_model` (see `metrics.clicks`), by default uniformly over the results.
+
+    Queries that are not static are sampled from a pool of `query_pool_size` queries with Zipf-like popularity
+    (see `metrics.queries`). Without a pool, every such query is a new random query.
+
+    Everything is drawn from the given seed (or fresh entropy when there is no seed). Users are split into fixed-size
+    shards, and shards into fixed-size blocks, each with its own random generator derived from the same seed, so that
+    the events of a shard do not depend on which process generates it or in what order, nor on the batch size.
+    """
+
+    def __init__(self, num_documents, max_queries, seed=None, countries=None, maximize_num_results=False,
+                 shard_size=DEFAULT_SHARD_SIZE, query_pool_size=DEFAULT_POOL_SIZE, query_skew=DEFAULT_SKEW,
+                 time_model=None, click_model=None, block_size=DEFAULT_BLOCK_SIZE):
+        self.seed = seed
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.shard_size = shard_size
+        self.block_size = block_size
+        rng = np.random.default_rng(np.random.SeedSequence(self.entropy))
+
+        self.num_documents = num_documents
+        self.max_queries = max_queries
+        self.time_model = time_model or TimeModel(DATE)
+        self.click_model = click_model or clicks.UniformClickModel()
+        self.maximize_num_results = maximize_num_results
+
+        # results are never more than the size of the corpus
+        self.max_num_results = min(MAX_NUM_RESULTS, num_documents)
+
+        # the static queries come first in the query values, those with results before those without
+        self.query_values = random_queries(rng, 2 * NUM_STATIC_QUERIES)
+        if maximize_num_results:
+            counts = np.full(NUM_STATIC_QUERIES, self.max_num_results)
+        else:
+            counts = rng.integers(0, self.max_num_results + 1, size=NUM_STATIC_QUERIES)
+        self.static_results = random_results(rng, num_documents, counts)
+        self.static_offsets = ragged_offsets(counts)
+
+        # the pool of queries follows the static queries
+        if query_pool_size:
+            self.query_pool = build_query_pool(rng, query_pool_size, query_skew, exclude=self.query_values)
+            self.query_values = np.concatenate((self.query_values, self.query_pool.values))
+        else:
+            self.query_pool = None
+
+        # coordinates of each country, grouped by country
+        if countries is None:
+            countries = sorted(str(x) for x in rng.choice(COUNTRIES_ALL, 5, replace=False))
+        coords = [x for x in faker.providers.geo.Provider.land_coords if x[3] in countries]
+        coords.sort(key=lambda x: countries.index(x[3]))
+        self.countries = countries
+        self.country_codes = np.array([x[3] for x in coords], dtype=object)
+        self.cities = np.array([x[2] for x in coords], dtype=object)
+        self.locations = np.array([f'{x[0]},{x[1]}' for x in coords], dtype=object)
+        self.country_counts = np.array([sum(1 for x in coords if x[3] == c) for c in countries])
+        self.country_offsets = ragged_offsets(self.country_counts)
+
+        # built for the whole user population with `prepare_profiles`, otherwise per batch
+        self.profiles_key = f'{self.entropy}/{",".join(countries)}'
+        self.profiles = None
+
+    def prepare_profiles(self, num_users, filename=None):
+        """
+        Builds the user profiles table for all users, or loads it from a file saved by a previous run with the same
+        seed (and at least as many users). A newly built table is saved to the file. Without an explicit seed, no run
+        could ever load the table again, so the file is neither read nor written.
+        """
+        if self.seed is None:
+            filename = None
+        if filename:
+            self.profiles = UserProfiles.load(filename, self.profiles_key)
+            if self.profiles is not None and len(self.profiles) >= num_users:
+                return
+
+        self.profiles = build_profiles(self.profiles_key, range(0, num_users), self.country_offsets,
+                                       self.country_counts, self.entropy % 2 ** 32)
+        if filename:
+            self.profiles.save(filename)
+
+    def user_profiles(self, user_ids):
+        """The profiles of the given users, as an index lookup when the table has been prepared."""
+        if self.profiles is not None and len(user_ids) and user_ids.max() < len(self.profiles):
+            return UserProfiles(self.profiles_key, self.profiles.countries[user_ids], self.profiles.coords[user_ids],
+                                self.profiles.experiments[user_ids], self.profiles.variants[user_ids])
+
+        return build_profiles(self.profiles_key, user_ids, self.country_offsets, self.country_counts,
+                              self.entropy % 2 ** 32)
+
+    def block_rng(self, shard, block):
+        """A random generator for the given block number of a shard."""
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=(shard, block)))
+
+    def shards(self, num_users):
+        """Splits the user IDs into shards, as tuples of the shard number and the user IDs in the shard."""
+        return [(shard, np.arange(start, min(start + self.shard_size, num_users)))
+                for (shard, start) in enumerate(range(0, num_users, self.shard_size))]
+
+    def generate_shard(self, shard, user_ids, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Generates all events for the users in a shard as a sequence of `EventBatch`, of `batch_size` users rounded
+        down to whole blocks (of at least one block). Every block of `block_size` users is drawn with its own random
+        generator (see `block_rng`), so the events are the same for any batch size.
+        """
+        for (block, batch_user_ids) in self.batches(user_ids, batch_size):
+            yield self.generate_batch(shard, block, batch_user_ids)
+
+    def batches(self, user_ids, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Splits the user IDs of a shard into batches of `batch_size` users rounded down to whole blocks (of at least
+        one block), as tuples of the number of the first block and the user IDs in the batch.
+        """
+        size = max(1, batch_size // self.block_size) * self.block_size
+        return [(start // self.block_size, user_ids[start:start + size]) for start in range(0, len(user_ids), size)]
+
+    def generate_batch(self, shard, block, user_ids):
+        """Generates all events for a batch of users of a shard, starting at the given block, as an `EventBatch`."""
+        return EventBatch.concatenate([
+            self.generate(self.block_rng(shard, block + i), user_ids[start:start + self.block_size])
+            for (i, start) in enumerate(range(0, len(user_ids), self.block_size))])
+
+    def generate(self, rng, user_ids, maximize_num_clicks=False):
+        """Generates all queries, pages and clicks for the given users as an `EventBatch`."""
+        return EventBatch(self, rng, np.asarray(user_ids), maximize_num_clicks)
+
+
+class EventBatch:
+    """
+    Queries, second pages and clicks for a batch of users, as arrays. Use `events` to turn them into ECS event
+    dictionaries.
+
+    Pages are indexed by row, with the first page of each query in the same row as the query and any second pages
+    following after. Clicks are grouped by page row.
+    """
+
+    def __init__(self, simulation, rng, user_ids, maximize_num_clicks=False):
+        self.simulation = simulation
+        self.user_ids = user_ids
+
+        # per user
+        num_queries = rng.integers(1, simulation.max_queries + 1, size=len(user_ids))
+        users = ragged_rows(num_queries)
+        profiles = simulation.user_profiles(user_ids)
+
+        # per query
+        n = len(users)
+        self.num_queries = n
+        self.users = users
+        self.query_times = simulation.time_model.sample(rng, n)
+        self.query_ids = random_uuids(rng, n)
+        self.durations = rng.integers(MIN_TOOK_MS, MAX_TOOK_MS + 1, size=n) * MS_TO_NANOS
+        self.page_names = rng.integers(0, len(PAGE_NAMES), size=n)
+        self.experiments = profiles.experiments[users]
+        self.variants = profiles.variants[users]
+        self.coords = profiles.coords[users]
+
+        self._generate_results(rng)
+        self._generate_pages(rng, maximize_num_clicks)
+
+    def _generate_results(self, rng):
+        simulation = self.simulation
+        n = self.num_queries
+
+        # static queries: 50/50 probability with or without results (unless we are maximizing num results)
+        is_static = rng.random(n) < STATIC_QUERY_PROBABILITY
+        static_idx = rng.integers(0, NUM_STATIC_QUERIES, size=n)
+        if not simulation.maximize_num_results:
+            static_idx += (rng.random(n) < 0.5) * NUM_STATIC_QUERIES
+
+        # other queries are sampled from the pool, or are new random queries appended after the static queries
+        num_random = n - is_static.sum()
+        self.query_index = np.where(is_static, static_idx, 0)
+        if simulation.query_pool:
+            self.query_values = simulation.query_values
+            self.query_index[~is_static] = 2 * NUM_STATIC_QUERIES + simulation.query_pool.sample(rng, num_random)
+        else:
+            self.query_values = np.concatenate((simulation.query_values, random_queries(rng, num_random)))
+            self.query_index[~is_static] = 2 * NUM_STATIC_QUERIES + np.arange(num_random)
+
+        # total number of results per query
+        static_totals = np.concatenate((np.diff(simulation.static_offsets), np.zeros(NUM_STATIC_QUERIES)))
+        if simulation.maximize_num_results:
+            random_totals = np.full(n, simulation.max_num_results)
+        else:
+            random_totals = rng.integers(0, simulation.max_num_results + 1, size=n)
+        self.totals = np.where(is_static, static_totals[static_idx], random_totals).astype(np.int64)
+
+        # only the results that can be shown on the first two pages are kept
+        counts = np.minimum(self.totals, 2 * PAGE_SIZE)
+        self.result_offsets = ragged_offsets(counts)
+        results = random_results(rng, simulation.num_documents, counts)
+
+        # copy results of static queries from the static result sets
+        static_items = is_static[ragged_rows(counts)]
+        static_rows = ragged_rows(counts)[static_items]
+        static_positions = ragged_positions(counts)[static_items]
+        results[static_items] = simulation.static_results[
+            simulation.static_offsets[static_idx[static_rows]] + static_positions]
+        self.results = results
+
+    def _generate_pages(self, rng, maximize_num_clicks):
+        simulation = self.simulation
+        n = self.num_queries
+
+        # first pages
+        first_sizes = np.minimum(self.totals, PAGE_SIZE)
+        first_counts, first_positions, first_offsets = simulation.click_model.sample(
+            rng, first_sizes, 1, maximize_num_clicks)
+        first_click_times = self.query_times[ragged_rows(first_counts)] + first_offsets
+
+        # second pages follow the last click of the first page, or the query if there were no clicks
+        is_pageable = self.totals > PAGE_SIZE
+        has_second_page = is_pageable & (rng.random(n) >= SECOND_PAGE_PROBABILITY)
+        second_queries = np.flatnonzero(has_second_page)
+        last_clicks = ragged_offsets(first_counts)[1:] - 1
+        last_times = self.query_times.copy()
+        last_times[first_counts > 0] = first_click_times[last_clicks[first_counts > 0]]
+        second_times = last_times[second_queries]
+        second_sizes = np.minimum(self.totals[second_queries] - PAGE_SIZE, PAGE_SIZE)
+        second_counts, second_positions, second_offsets = simulation.click_model.sample(
+            rng, second_sizes, PAGE_SIZE + 1, maximize_num_clicks)
+        second_click_times = second_times[ragged_rows(second_counts)] + second_offsets
+
+        # pages, by row
+        self.page_queries = np.concatenate((np.arange(n), second_queries))
+        self.page_numbers = np.concatenate((np.ones(n, dtype=np.int64), np.full(len(second_queries), 2)))
+        self.page_times = np.concatenate((self.query_times, second_times))
+        self.page_sizes = np.concatenate((first_sizes, second_sizes))
+        self.second_pages = np.full(n, -1)
+        self.second_pages[second_queries] = n + np.arange(len(second_queries))
+        self.second_page_ids = random_uuids(rng, len(second_queries))
+        self.second_page_durations = rng.integers(MIN_TOOK_MS, MAX_TOOK_MS + 1, size=len(second_queries))
+
+        # clicks, grouped by page row
+        click_counts = np.concatenate((first_counts, second_counts))
+        click_pages = ragged_rows(click_counts)
+        self.click_offsets = ragged_offsets(click_counts)
+        self.click_times = np.concatenate((first_click_times, second_click_times))
+        self.click_ids = random_uuids(rng, len(click_pages))
+        positions = np.concatenate((first_positions, second_positions))
+        page_starts = (self.page_numbers[click_pages] - 1) * PAGE_SIZE
+        self.click_ranks = page_starts + positions + 1
+        self.click_results = self.results[self.result_offsets[self.page_queries[click_pages]] + page_starts + positions]
+
+    @classmethod
+    def concatenate(cls, batches):
+        """
+        Concatenates batches (of the same simulation) into one, with the same events in the same order. Pages are
+        laid out with the first pages of all queries before all second pages, with clicks grouped by page row.
+        """
+        if len(batches) == 1:
+            return batches[0]
+
+        simulation = batches[0].simulation
+        batch = cls.__new__(cls)
+        batch.simulation = simulation
+        n = sum(x.num_queries for x in batches)
+        batch.num_queries = n
+
+        # offsets of the users, queries, new random query values, results and second pages of every batch
+        base = len(simulation.query_values)
+        user_offsets = ragged_offsets([len(x.user_ids) for x in batches])
+        query_offsets = ragged_offsets([x.num_queries for x in batches])
+        value_offsets = ragged_offsets([len(x.query_values) - base for x in batches])
+        result_offsets = ragged_offsets([len(x.results) for x in batches])
+        second_offsets = ragged_offsets([len(x.second_page_ids) for x in batches])
+
+        # per user and per query
+        batch.user_ids = np.concatenate([x.user_ids for x in batches])
+        batch.users = np.concatenate([x.users + user_offsets[i] for i, x in enumerate(batches)])
+        for name in ['query_times', 'query_ids', 'durations', 'page_names', 'experiments', 'variants', 'coords',
+                     'totals', 'results']:
+            setattr(batch, name, np.concatenate([getattr(x, name) for x in batches]))
+        batch.query_values = np.concatenate([simulation.query_values] + [x.query_values[base:] for x in batches])
+        batch.query_index = np.concatenate([np.where(x.query_index >= base, x.query_index + value_offsets[i],
+                                                     x.query_index) for i, x in enumerate(batches)])
+        batch.result_offsets = np.concatenate([x.result_offsets[:-1] + result_offsets[i] for i, x in enumerate(batches)]
+                                              + [result_offsets[-1:]])
+
+        # pages: first pages, then second pages
+        def pages(name):
+            return np.concatenate([getattr(x, name)[:x.num_queries] for x in batches] +
+                                  [getattr(x, name)[x.num_queries:] for x in batches])
+
+        batch.page_queries = np.concatenate([np.arange(n)] + [x.page_queries[x.num_queries:] + query_offsets[i]
+                                                              for i, x in enumerate(batches)])
+        batch.page_numbers = pages('page_numbers')
+        batch.page_times = pages('page_times')
+        batch.page_sizes = pages('page_sizes')
+        batch.second_pages = np.concatenate([np.where(x.second_pages >= 0,
+                                                      x.second_pages - x.num_queries + n + second_offsets[i], -1)
+                                             for i, x in enumerate(batches)])
+        batch.second_page_ids = np.concatenate([x.second_page_ids for x in batches])
+        batch.second_page_durations = np.concatenate([x.second_page_durations for x in batches])
+
+        # clicks, grouped by page row: clicks of first pages, then of second pages
+        def clicks(name):
+            return np.concatenate([getattr(x, name)[:x.click_offsets[x.num_queries]] for x in batches] +
+                                  [getattr(x, name)[x.click_offsets[x.num_queries]:] for x in batches])
+
+        counts = [np.diff(x.click_offsets) for x in batches]
+        batch.click_offsets = ragged_offsets(np.concatenate([c[:x.num_queries] for c, x in zip(counts, batches)] +
+                                                            [c[x.num_queries:] for c, x in zip(counts, batches)]))
+        batch.click_times = clicks('click_times')
+        batch.click_ids = clicks('click_ids')
+        batch.click_ranks = clicks('click_ranks')
+        batch.click_results = clicks('click_results')
+        return batch
+
+    def __len__(self):
+        """The number of events in the batch."""
+        return len(self.page_queries) + len(self.click_times)
+
+    def sequence(self):
+        """
+        The order of events, as tuples of the event kind (`QUERY`, `PAGE` or `CLICK`) and its row. This is the same
+        order as `simulate.user_behaviour`: each query is followed by its clicks, then any second page and its clicks.
+        """
+        for i in range(self.num_queries):
+            yield QUERY, i
+            for click in range(self.click_offsets[i], self.click_offsets[i + 1]):
+                yield CLICK, click
+
+            page = self.second_pages[i]
+            if page >= 0:
+                yield PAGE, page
+                for click in range(self.click_offsets[page], self.click_offsets[page + 1]):
+                    yield CLICK, click
+
+    def _formatted(self):
+        """
+        Formats IDs and timestamps of all events (vectorized where possible) and converts arrays to plain lists,
+        which are faster to index one element at a time.
+        """
+        simulation = self.simulation
+        return {
+            'user_ids': string_ids(self.user_ids[self.users]),
+            'query_ids': uuid_strings(self.query_ids),
+            'query_values': self.query_values[self.query_index].tolist(),
+            'durations': self.durations.tolist(),
+            'totals': self.totals.tolist(),
+            'experiments': EXPERIMENT_NAMES[self.experiments].tolist(),
+            'variants': VARIANT_NAMES[self.variants].tolist(),
+            'page_names': np.array(PAGE_NAMES, dtype=object)[self.page_names].tolist(),
+            'country_codes': simulation.country_codes[self.coords].tolist(),
+            'cities': simulation.cities[self.coords].tolist(),
+            'locations': simulation.locations[self.coords].tolist(),
+            'results': self.results.tolist(),
+            'result_offsets': self.result_offsets.tolist(),
+            'page_queries': self.page_queries.tolist(),
+            'page_numbers': self.page_numbers.tolist(),
+            'page_sizes': self.page_sizes.tolist(),
+            'page_timestamps': millis_to_timestamps(self.page_times).tolist(),
+            'second_page_ids': uuid_strings(self.second_page_ids),
+            'second_page_durations': self.second_page_durations.tolist(),
+            'click_ids': uuid_strings(self.click_ids),
+            'click_pages': ragged_rows(np.diff(self.click_offsets)).tolist(),
+            'click_results': self.click_results.tolist(),
+            'click_ranks': self.click_ranks.tolist(),
+            'click_timestamps': millis_to_timestamps(self.click_times).tolist(),
+        }
+
+    def events(self):
+        """Generates ECS event dictionaries, see `sequence` for the order of events."""
+        ecs = {'version': ECS_VERSION}
+        f = self._formatted()
+        query_ids = f['query_ids']
+        results = string_ids(f['results'])
+        result_offsets = f['result_offsets']
+        page_sizes = f['page_sizes']
+        page_queries = f['page_queries']
+        n = self.num_queries
+
+        for (kind, row) in self.sequence():
+            if kind == QUERY:
+                results_start = result_offsets[row]
+                size = page_sizes[row]
+                yield {
+                    '@timestamp': f['page_timestamps'][row],
+                    'ecs': ecs,
+                    'event': {
+                        'action': 'SearchMetrics.query',
+                        'dataset': 'SearchMetrics.query',
+                        'id': query_ids[row],
+                        'duration': f['durations'][row],
+                    },
+                    'SearchMetrics': {
+                        'query': {
+                            'id': query_ids[row],
+                            'value': f['query_values'][row],
+                            'page': 1,
+                        },
+                        'results': {
+                            'size': size,
+                            'total': f['totals'][row],
+                            'ids': results[results_start:results_start + size],
+                        },
+                    },
+                    'SearchMetricsSimulation': {
+                        'ab': {
+                            'experiment': f['experiments'][row],
+                            'variant': f['variants'][row],
+                        },
+                        'page_name': f['page_names'][row],
+                    },
+                    'source': {
+                        'user': {
+                            'id': f['user_ids'][row],
+                        },
+                        'geo': {
+                            'country_iso_code': f['country_codes'][row],
+                            'city_name': f['cities'][row],
+                            'location': f['locations'][row],
+                        },
+                    },
+                }
+            elif kind == PAGE:
+                query = page_queries[row]
+                results_start = result_offsets[query] + PAGE_SIZE
+                size = page_sizes[row]
+                yield {
+                    '@timestamp': f['page_timestamps'][row],
+                    'ecs': ecs,
+                    'event': {
+                        'action': 'SearchMetrics.page',
+                        'dataset': 'SearchMetrics.page',
+                        'id': f['second_page_ids'][row - n],
+                        'duration': f['second_page_durations'][row - n],
+                    },
+                    'SearchMetrics': {
+                        'query': {
+                            'id': query_ids[query],
+                            'page': 2,
+                        },
+                        'results': {
+                            'size': size,
+                            'ids': results[results_start:results_start + size],
+                        },
+                    },
+                }
+            else:
+                page = f['click_pages'][row]
+                yield {
+                    '@timestamp': f['click_timestamps'][row],
+                    'ecs': {
+                        'version': ECS_VERSION,
+                    },
+                    'event': {
+                        'action': 'SearchMetrics.click',
+                        'dataset': 'SearchMetrics.click',
+                        'id': f['click_ids'][row],
+                    },
+                    'SearchMetrics': {
+                        'query': {
+                            'id': query_ids[page_queries[page]],
+                            'page': f['page_numbers'][page],
+                        },
+                        'click': {
+                            'result': {
+                                'id': str(f['click_results'][row]),
+                                'rank': f['click_ranks'][row],
+                            },
+                        },
+                    },
+                }
+
+    def lines(self):
+        """
+        Generates events as lines of NDJSON (without newlines), directly from the arrays without building event
+        dictionaries. See `sequence` for the order of events.
+        """
+        f = self._formatted()
+        query_ids = f['query_ids']
+        results = f['results']
+        result_offsets = f['result_offsets']
+        page_sizes = f['page_sizes']
+        page_queries = f['page_queries']
+        page_timestamps = f['page_timestamps']
+        n = self.num_queries
+
+        for (kind, row) in self.sequence():
+            if kind == QUERY:
+                results_start = result_offsets[row]
+                size = page_sizes[row]
+                yield ndjson.query_line(
+                    page_timestamps[row], query_ids[row], f['durations'][row], f['query_values'][row], size,
+                    f['totals'][row], ndjson.encode_digit_ids(results[results_start:results_start + size]),
+                    f['experiments'][row], f['variants'][row], f['page_names'][row], f['user_ids'][row],
+                    f['country_codes'][row], f['cities'][row], f['locations'][row])
+            elif kind == PAGE:
+                query = page_queries[row]
+                results_start = result_offsets[query] + PAGE_SIZE
+                size = page_sizes[row]
+                yield ndjson.page_line(
+                    page_timestamps[row], f['second_page_ids'][row - n], f['second_page_durations'][row - n],
+                    query_ids[query], 2, size, ndjson.encode_digit_ids(results[results_start:results_start + size]))
+            else:
+                page = f['click_pages'][row]
+                yield ndjson.click_line(
+                    f['click_timestamps'][row], f['click_ids'][row], query_ids[page_queries[page]],
+                    f['page_numbers'][page], f['click_results'][row], f['click_ranks'][row])
+
+
+def iter_batches(num_documents, num_users, max_queries, with_progress=False, batch_size=DEFAULT_BATCH_SIZE, seed=None,
+                 shard_size=DEFAULT_SHARD_SIZE, profiles_filename=None, query_pool_size=DEFAULT_POOL_SIZE,
+                 query_skew=DEFAULT_SKEW, time_model=None, click_model=None):
+    """
+    Generates an `EventBatch` at a time for all users. User profiles are saved to (or loaded from)
+    `profiles_filename`, when given. See `metrics.parallel` to generate shards on multiple cores.
+    """
+    simulation = Simulation(num_documents, max_queries, seed, shard_size=shard_size, query_pool_size=query_pool_size,
+                            query_skew=query_skew, time_model=time_model, click_model=click_model)
+    simulation.prepare_profiles(num_users, profiles_filename)
+
+    shards = simulation.shards(num_users)
+    if with_progress:
+        shards = tqdm(shards)
+
+    for (shard, user_ids) in shards:
+        yield from simulation.generate_shard(shard, user_ids, batch_size)
+
+
+def iter_events(num_documents, num_users, max_queries, with_progress=False, **kwargs):
+    """Generates ECS event dictionaries for all users, one at a time. See `iter_batches` for arguments."""
+    for events in iter_batches(num_documents, num_users, max_queries, with_progress, **kwargs):
+        yield from events.events()
+
+
+def iter_lines(num_documents, num_users, max_queries, with_progress=False, **kwargs):
+    """Generates events for all users as lines of NDJSON (without newlines). See `iter_batches` for arguments."""
+    for events in iter_batches(num_documents, num_users, max_queries, with_progress, **kwargs):
+        yield from events.lines()
+
+
+def generate_events(num_documents, num_users, max_queries, event_output_fn, with_progress=False, **kwargs):
+    """
+    Generates events for all users in batches, passing each event to `event_output_fn`. This is a drop-in replacement
+    for `simulate.generate_events`. See `iter_batches` for arguments.
+    """
+    for event in iter_events(num_documents, num_users, max_queries, with_progress, **kwargs):
+        event_output_fn(event)
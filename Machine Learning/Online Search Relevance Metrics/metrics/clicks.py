@@ -0,0 +1,171 @@
+"""
+Click models for the simulation. A click model decides which results on a page of results are clicked and when, for
+a whole batch of pages at once:
+
+ - `uniform`: results are clicked uniformly at random (with replacement), the same as `simulate.result_clicks`
+ - `position-bias`: each result is clicked independently, with a probability that decreases with its rank
+ - `cascade`: results are examined from the top down, and after each click the user may stop examining
+
+With `position-bias` and `cascade`, results are clicked in rank order and the time between clicks is the dwell time on
+the clicked result. This gives realistic distributions of metrics that depend on the rank of clicks, such as MRR and
+the number of clicks in the top 3 results.
+"""
+
+import numpy as np
+
+from metrics import batch
+from metrics.simulate import MAX_CLICKS_PER_QUERY, MAX_SECONDS_FIRST_CLICK, MAX_SECONDS_LAST_CLICK, \
+    MIN_SECONDS_FIRST_CLICK
+from metrics.timeline import MS_PER_SECOND
+
+DEFAULT_ATTRACTIVENESS = 0.6
+DEFAULT_CONTINUE_PROBABILITY = 0.4
+DEFAULT_DECAY = 1.0
+DEFAULT_DWELL_SECONDS = 15
+
+
+def random_click_seconds(rng, counts):
+    """
+    Generate distinct click times per page, in whole seconds after a random time to first click and before the last
+    possible click. Returns time offsets (in ms) per click, in increasing order per page.
+    """
+    # pick distinct click seconds for each page by taking the smallest random keys over the available seconds
+    clicked = np.flatnonzero(counts)
+    first = rng.integers(MIN_SECONDS_FIRST_CLICK, MAX_SECONDS_FIRST_CLICK + 1, size=len(clicked))
+    seconds = np.arange(MIN_SECONDS_FIRST_CLICK, MAX_SECONDS_LAST_CLICK)
+    keys = rng.random((len(clicked), len(seconds)))
+    keys[seconds[np.newaxis, :] < first[:, np.newaxis]] = np.inf
+    picked = np.argsort(keys, axis=1)[:, :MAX_CLICKS_PER_QUERY]
+
+    # keep the first `count` picks per page, in time order
+    picked[np.arange(MAX_CLICKS_PER_QUERY)[np.newaxis, :] >= counts[clicked][:, np.newaxis]] = len(seconds)
+    picked.sort(axis=1)
+    picked = picked[picked < len(seconds)]
+
+    return seconds[picked] * MS_PER_SECOND
+
+
+def random_dwell_times(rng, counts, dwell_seconds=DEFAULT_DWELL_SECONDS):
+    """
+    Generate click times per page from dwell times: the first click follows a random time to first click, and every
+    other click follows the previous click by an exponentially distributed dwell time (of at least a second). Returns
+    time offsets (in ms) per click, in increasing order per page.
+    """
+    n = counts.sum()
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    first = rng.integers(MIN_SECONDS_FIRST_CLICK * MS_PER_SECOND, MAX_SECONDS_FIRST_CLICK * MS_PER_SECOND + 1,
+                         size=len(counts))
+    gaps = MS_PER_SECOND + (rng.exponential(dwell_seconds - 1, size=n) * MS_PER_SECOND).astype(np.int64)
+
+    # the first click of each page starts from the time to first click instead of a dwell time
+    starts = offsets[:-1][counts > 0]
+    gaps[starts] = first[counts > 0]
+
+    # cumulative sum per page
+    times = np.cumsum(gaps)
+    return times - np.repeat(times[starts] - gaps[starts], counts[counts > 0])
+
+
+def _clicked_positions(clicked, page_sizes, maximize_num_clicks):
+    """
+    Turns a matrix of clicked positions (pages by positions) into the number of clicks per page and the clicked
+    positions, in rank order and keeping at most `MAX_CLICKS_PER_QUERY` clicks per page.
+    """
+    positions = np.arange(clicked.shape[1])[np.newaxis, :]
+
+    # used at testing time to always click the top results
+    if maximize_num_clicks:
+        clicked = np.ones_like(clicked)
+    clicked &= positions < page_sizes[:, np.newaxis]
+    clicked &= np.cumsum(clicked, axis=1) <= MAX_CLICKS_PER_QUERY
+
+    return clicked.sum(axis=1), np.nonzero(clicked)[1]
+
+
+class UniformClickModel:
+    """Clicks results uniformly at random with replacement, at random distinct seconds."""
+
+    name = 'uniform'
+
+    def sample(self, rng, page_sizes, first_ranks=1, maximize_num_clicks=False):
+        """
+        Generate clicks for pages of results of the given sizes, with `first_ranks` the rank of the first result of
+        each page. Returns the number of clicks per page, and the result position within the page and the time offset
+        from the page (in ms) per click. Clicks are ordered by page, then by time.
+        """
+        max_clicks = np.minimum(page_sizes, MAX_CLICKS_PER_QUERY)
+
+        # used at testing time to always click all results
+        if maximize_num_clicks:
+            counts = max_clicks
+        else:
+            counts = rng.integers(0, max_clicks + 1)
+
+        positions = (rng.random(counts.sum()) * page_sizes[batch.ragged_rows(counts)]).astype(np.int64)
+        return counts, positions, random_click_seconds(rng, counts)
+
+
+class PositionBiasClickModel:
+    """
+    Clicks every result independently, with the probability that a result is examined decreasing with its rank as
+    `1 / rank ** decay`, times the probability that an examined result is attractive enough to be clicked.
+    """
+
+    name = 'position-bias'
+
+    def __init__(self, attractiveness=DEFAULT_ATTRACTIVENESS, decay=DEFAULT_DECAY,
+                 dwell_seconds=DEFAULT_DWELL_SECONDS):
+        self.attractiveness = attractiveness
+        self.decay = decay
+        self.dwell_seconds = dwell_seconds
+
+    def sample(self, rng, page_sizes, first_ranks=1, maximize_num_clicks=False):
+        """See `UniformClickModel.sample`."""
+        width = max(page_sizes.max(initial=0), 1)
+        ranks = np.broadcast_to(first_ranks, page_sizes.shape)[:, np.newaxis] + np.arange(width)[np.newaxis, :]
+        probabilities = self.attractiveness / ranks ** self.decay
+
+        clicked = rng.random((len(page_sizes), width)) < probabilities
+        counts, positions = _clicked_positions(clicked, page_sizes, maximize_num_clicks)
+        return counts, positions, random_dwell_times(rng, counts, self.dwell_seconds)
+
+
+class CascadeClickModel:
+    """
+    Examines results from the top down, clicking each examined result with the attractiveness probability. After a
+    click, the user continues examining with the continue probability, otherwise no more results are clicked.
+    """
+
+    name = 'cascade'
+
+    def __init__(self, attractiveness=DEFAULT_ATTRACTIVENESS, continue_probability=DEFAULT_CONTINUE_PROBABILITY,
+                 dwell_seconds=DEFAULT_DWELL_SECONDS):
+        self.attractiveness = attractiveness
+        self.continue_probability = continue_probability
+        self.dwell_seconds = dwell_seconds
+
+    def sample(self, rng, page_sizes, first_ranks=1, maximize_num_clicks=False):
+        """See `UniformClickModel.sample`."""
+        width = max(page_sizes.max(initial=0), 1)
+        attractive = rng.random((len(page_sizes), width)) < self.attractiveness
+        stops = attractive & (rng.random((len(page_sizes), width)) >= self.continue_probability)
+
+        # a result is examined when the user did not stop at any result above it
+        stopped_above = np.cumsum(stops, axis=1) - stops
+        clicked = attractive & (stopped_above == 0)
+        counts, positions = _clicked_positions(clicked, page_sizes, maximize_num_clicks)
+        return counts, positions, random_dwell_times(rng, counts, self.dwell_seconds)
+
+
+CLICK_MODELS = {
+    UniformClickModel.name: UniformClickModel,
+    PositionBiasClickModel.name: PositionBiasClickModel,
+    CascadeClickModel.name: CascadeClickModel,
+}
+
+
+def click_model(name):
+    """Creates a click model with default parameters, by name."""
+    if name not in CLICK_MODELS:
+        raise ValueError(f"unknown click model: {name}, expected one of: {', '.join(CLICK_MODELS)}")
+    return CLICK_MODELS[name]()
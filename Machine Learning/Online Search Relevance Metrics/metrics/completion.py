@@ -0,0 +1,404 @@
+"""
+Query completion (autocomplete) from the `ecs-search-metrics_transform_completion` index, with a long-running server
+for serving and measuring completions at keystroke rates.
+
+The server is a small HTTP server on an asyncio event loop. Completion suggester requests are sent by a pool of
+threads over a pooled connection (the same as `replay`), and suggestions are kept in an LRU cache by prefix. Cached
+suggestions expire after a TTL, and the whole cache is invalidated as soon as the completion index is refreshed (e.g.
+when the completion transform is done), which is checked for every second. Concurrent requests for the same prefix
+share a single completion suggester request. Latencies are recorded in histograms, for cache hits and misses:
+
+    GET /complete?prefix=sec&fuzziness=0&size=5
+    GET /stats
+
+A load test client replays prefixes as typed by users, one keystroke at a time, for queries sampled by popularity from
+the completion index itself, so that prefixes match whatever events the index was built from.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+import urllib.parse
+
+import numpy as np
+
+from metrics.resources import INDEX
+
+COMPLETION_INDEX = f'{INDEX}_transform_completion'
+COMPLETION_FIELD = 'SearchMetrics.query.value.completion'
+VALUE_FIELD = 'SearchMetrics.query.value'
+NUM_QUERIES_FIELD = 'metrics.num_queries'
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_CACHE_TTL = 300.0
+DEFAULT_CONCURRENCY = 10
+DEFAULT_FUZZINESS = 0
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_MAX_QUERIES = 10000
+DEFAULT_PORT = 8200
+DEFAULT_REFRESH_CHECK_INTERVAL = 1.0
+DEFAULT_SIZE = 5
+
+# upper bounds of latency histogram buckets, in ms
+LATENCY_BUCKETS = [0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def suggest_body(prefix, fuzziness=DEFAULT_FUZZINESS, size=DEFAULT_SIZE):
+    """A search request body with a completion suggester for the prefix."""
+    return {
+        '_source': False,
+        'suggest': {
+            'suggest': {
+                'prefix': prefix,
+                'completion': {
+                    'field': COMPLETION_FIELD,
+                    'size': size,
+                    'fuzzy': {
+                        'fuzziness': fuzziness,
+                    },
+                },
+            },
+        },
+    }
+
+
+def suggestions(response):
+    """The suggested completions in a search response."""
+    return [x['text'] for x in response['suggest']['suggest'][0]['options']]
+
+
+def complete(es, prefix, fuzziness=DEFAULT_FUZZINESS, size=DEFAULT_SIZE, index=COMPLETION_INDEX):
+    """Suggests completions of a prefix with the completion suggester."""
+    return suggestions(es.search(index=index, body=suggest_body(prefix, fuzziness, size)))
+
+
+def refresh_count(es, index=COMPLETION_INDEX):
+    """The number of refreshes of an index, which changes whenever new documents may have become visible."""
+    response = es.indices.stats(index=index, metric='refresh')
+    return response['_all']['total']['refresh']['total']
+
+
+class LatencyHistogram:
+    """Counts latencies in buckets with fixed upper bounds (see `LATENCY_BUCKETS`), plus an overflow bucket."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[np.searchsorted(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """The upper bound (in ms) of the bucket of the p-th percentile, or the maximum when in the overflow bucket."""
+        if not self.count:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), p / 100 * self.count))
+        return self.buckets[i] if i < len(self.buckets) else self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.mean,
+            'max_ms': self.max,
+            'percentiles_ms': {str(p): self.percentile(p) for p in PERCENTILES},
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ['inf'], self.counts)},
+        }
+
+    def print(self, name):
+        print(f" - {name}: {self.count} requests, mean {self.mean:.3f} ms, max {self.max:.3f} ms")
+        for p in PERCENTILES:
+            print(f"   - p{p}: <= {self.percentile(p)} ms")
+
+
+class CompletionCache:
+    """An LRU cache of suggestions by prefix, where entries expire after a TTL (in seconds)."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, now=None):
+        now = time.monotonic() if now is None else now
+        self.entries[key] = (now + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.invalidations += 1
+
+
+def http_response(status, body):
+    """An HTTP/1.1 response with a JSON body."""
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    data = json.dumps(body).encode('utf-8')
+    return (f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'
+            .encode('ascii') + data)
+
+
+async def read_headers(reader):
+    """Reads HTTP headers up to the empty line. Returns lowercase names with values."""
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+class CompletionServer:
+    def __init__(self, es, index=COMPLETION_INDEX, cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, refresh_check_interval=DEFAULT_REFRESH_CHECK_INTERVAL):
+        self.es = es
+        self.index = index
+        self.cache = CompletionCache(cache_size, cache_ttl)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_connections)
+        self.refresh_check_interval = refresh_check_interval
+        self.refreshes = None
+        self.generation = 0
+        self.pending = {}
+        self.latencies = {'hit': LatencyHistogram(), 'miss': LatencyHistogram()}
+        self.num_errors = 0
+
+    async def complete(self, prefix, fuzziness=DEFAULT_FUZZINESS, size=DEFAULT_SIZE):
+        """Suggests completions of a prefix, from the cache if possible. Returns the suggestions and whether cached."""
+        key = (prefix, fuzziness, size)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+
+        # concurrent requests for the same prefix share a single request
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, complete, self.es, prefix, fuzziness, size, self.index)
+            self.pending[key] = future
+            generation = self.generation
+            try:
+                result = await future
+            finally:
+                del self.pending[key]
+
+            # suggestions from before an index refresh are not cached
+            if generation == self.generation:
+                self.cache.put(key, result)
+            return result, False
+
+        return await asyncio.shield(future), False
+
+    async def check_refreshes(self):
+        """Invalidates the cache whenever the completion index has been refreshed."""
+        loop = asyncio.get_running_loop()
+        refreshes = await loop.run_in_executor(self.executor, refresh_count, self.es, self.index)
+        if self.refreshes is not None and refreshes != self.refreshes:
+            self.generation += 1
+            self.cache.clear()
+        self.refreshes = refreshes
+
+    async def watch_refreshes(self):
+        while True:
+            try:
+                await self.check_refreshes()
+            except Exception as e:
+                print(f"Checking refreshes failed: {e}")
+            await asyncio.sleep(self.refresh_check_interval)
+
+    def stats(self):
+        return {
+            'cache': {
+                'size': len(self.cache),
+                'hits': self.cache.hits,
+                'misses': self.cache.misses,
+                'invalidations': self.cache.invalidations,
+            },
+            'errors': self.num_errors,
+            'latency': {name: x.to_dict() for name, x in self.latencies.items()},
+        }
+
+    async def respond(self, target):
+        """Responds to a request target (path and query string). Returns the status and body."""
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        if url.path == '/stats':
+            return 200, self.stats()
+        if url.path != '/complete':
+            return 404, {'error': f'not found: {url.path}'}
+        if 'prefix' not in params:
+            return 400, {'error': 'missing parameter: prefix'}
+
+        start = time.monotonic()
+        try:
+            fuzziness = int(params.get('fuzziness', DEFAULT_FUZZINESS))
+            size = int(params.get('size', DEFAULT_SIZE))
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        try:
+            results, cached = await self.complete(params['prefix'], fuzziness, size)
+        except Exception as e:
+            self.num_errors += 1
+            return 500, {'error': str(e)}
+        self.latencies['hit' if cached else 'miss'].record(time.monotonic() - start)
+        return 200, {'suggestions': results, 'cached': cached}
+
+    async def handle(self, reader, writer):
+        """Handles the requests of a connection, kept alive until the client closes it."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode('latin-1').split()
+                headers = await read_headers(reader)
+                if 'content-length' in headers:
+                    await reader.readexactly(int(headers['content-length']))
+
+                status, body = await self.respond(target)
+                writer.write(http_response(status, body))
+                await writer.drain()
+                if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, started=None):
+        """Serves requests until cancelled. Calls `started` with the server once listening."""
+        watcher = asyncio.ensure_future(self.watch_refreshes())
+        server = await asyncio.start_server(self.handle, host, port)
+        if started:
+            started(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def typed_prefixes(queries, min_length=1):
+    """The prefixes of queries as typed one keystroke at a time, e.g. `se`, `sec` and `secu` for `secu`."""
+    for query in queries:
+        for i in range(min_length, len(query) + 1):
+            yield query[:i]
+
+
+def indexed_queries(es, index=COMPLETION_INDEX, size=DEFAULT_MAX_QUERIES):
+    """The most popular queries of the completion index, up to `size`, with their number of queries."""
+    response = es.search(index=index, body={
+        'size': size,
+        '_source': False,
+        'docvalue_fields': [VALUE_FIELD, NUM_QUERIES_FIELD],
+        'sort': [{NUM_QUERIES_FIELD: 'desc'}],
+    })
+    return [(x['fields'][VALUE_FIELD][0], x['fields'][NUM_QUERIES_FIELD][0]) for x in response['hits']['hits']]
+
+
+def sample_queries(queries, n, seed=None):
+    """
+    Samples `n` queries by popularity from queries with their number of queries (see `indexed_queries`), or uniformly
+    when no query has been counted.
+    """
+    rng = np.random.default_rng(seed)
+    values = np.array([x for x, _ in queries], dtype=object)
+    weights = np.array([x for _, x in queries], dtype=float)
+    p = weights / weights.sum() if weights.sum() > 0 else None
+    return values[rng.choice(len(values), n, p=p)]
+
+
+class LoadTestStats:
+    def __init__(self):
+        self.num_requests = 0
+        self.num_cached = 0
+        self.num_errors = 0
+        self.interval = 0.0
+        self.latencies = LatencyHistogram()
+
+    @property
+    def requests_per_second(self):
+        return self.num_requests / self.interval if self.interval else 0.0
+
+    def print(self):
+        print(f" - requests: {self.num_requests}")
+        print(f" - cached: {self.num_cached}")
+        print(f" - errors: {self.num_errors}")
+        print(f" - duration: {self.interval:.04f} sec")
+        print(f" - throughput: {self.requests_per_second:.0f} requests/sec")
+        self.latencies.print('latency')
+
+
+async def load_test(prefixes, host=DEFAULT_HOST, port=DEFAULT_PORT, concurrency=DEFAULT_CONCURRENCY, duration=None,
+                    fuzziness=DEFAULT_FUZZINESS, size=DEFAULT_SIZE):
+    """
+    Sends completion requests for prefixes to a completion server, from `concurrency` clients with a kept alive
+    connection each, until all prefixes are sent or for `duration` seconds. Returns `LoadTestStats`.
+    """
+    stats = LoadTestStats()
+    prefixes = iter(prefixes)
+    start = time.monotonic()
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for prefix in prefixes:
+                if duration is not None and time.monotonic() - start >= duration:
+                    break
+                query = urllib.parse.urlencode({'prefix': prefix, 'fuzziness': fuzziness, 'size': size})
+                sent = time.monotonic()
+                writer.write(f'GET /complete?{query} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('utf-8'))
+                await writer.drain()
+
+                status = int((await reader.readline()).split()[1])
+                headers = await read_headers(reader)
+                body = json.loads(await reader.readexactly(int(headers['content-length'])))
+                stats.latencies.record(time.monotonic() - sent)
+                stats.num_requests += 1
+                if status != 200:
+                    stats.num_errors += 1
+                elif body['cached']:
+                    stats.num_cached += 1
+        finally:
+            writer.close()
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    stats.interval = time.monotonic() - start
+    return stats
@@ -0,0 +1,172 @@
+"""
+Compact records of simulated events, for the scalar simulation in `metrics.simulate`. A record holds only the fields
+that vary per event, in `__slots__`, with result IDs kept as the integers they are sampled as. The constant parts of
+an event (the `ecs` block, action names) are not stored at all.
+
+Records encode straight to a line of ECS NDJSON with `to_ndjson` (see `metrics.ndjson`), and only become the nested
+event dictionary when a caller asks for it with `to_dict`.
+"""
+
+from metrics.ndjson import ECS_VERSION, click_line, encode_digit_ids, page_line, query_line
+
+
+class QueryEvent:
+    """A query event, with the first page of results."""
+
+    __slots__ = ('timestamp', 'query_id', 'duration', 'value', 'ids', 'total', 'experiment', 'variant', 'page_name',
+                 'user_id', 'country', 'city', 'location')
+
+    action = 'SearchMetrics.query'
+    page = 1
+
+    def __init__(self, timestamp, query_id, duration, value, ids, total, experiment, variant, page_name, user_id,
+                 country, city, location):
+        self.timestamp = timestamp
+        self.query_id = query_id
+        self.duration = duration
+        self.value = value
+        self.ids = ids
+        self.total = total
+        self.experiment = experiment
+        self.variant = variant
+        self.page_name = page_name
+        self.user_id = user_id
+        self.country = country
+        self.city = city
+        self.location = location
+
+    def to_ndjson(self):
+        return query_line(self.timestamp, self.query_id, self.duration, self.value, len(self.ids), self.total,
+                          encode_digit_ids(self.ids), self.experiment, self.variant, self.page_name, self.user_id,
+                          self.country, self.city, self.location)
+
+    def to_dict(self):
+        return {
+            '@timestamp': self.timestamp,
+            'ecs': {
+                'version': ECS_VERSION,
+            },
+            'event': {
+                'action': self.action,
+                'dataset': self.action,
+                'id': self.query_id,
+                'duration': self.duration,
+            },
+            'SearchMetrics': {
+                'query': {
+                    'id': self.query_id,
+                    'value': self.value,
+                    'page': self.page,
+                },
+                'results': {
+                    'size': len(self.ids),
+                    'total': self.total,
+                    'ids': [str(x) for x in self.ids],
+                },
+            },
+            'SearchMetricsSimulation': {
+                'ab': {
+                    'experiment': self.experiment,
+                    'variant': self.variant,
+                },
+                'page_name': self.page_name,
+            },
+            'source': {
+                'user': {
+                    'id': self.user_id,
+                },
+                'geo': {
+                    'country_iso_code': self.country,
+                    'city_name': self.city,
+                    'location': self.location,
+                },
+            },
+        }
+
+
+class PageEvent:
+    """A request for a further page of results of a query."""
+
+    __slots__ = ('timestamp', 'page_id', 'duration', 'query_id', 'page', 'ids')
+
+    action = 'SearchMetrics.page'
+
+    def __init__(self, timestamp, page_id, duration, query_id, page, ids):
+        self.timestamp = timestamp
+        self.page_id = page_id
+        self.duration = duration
+        self.query_id = query_id
+        self.page = page
+        self.ids = ids
+
+    def to_ndjson(self):
+        return page_line(self.timestamp, self.page_id, self.duration, self.query_id, self.page, len(self.ids),
+                         encode_digit_ids(self.ids))
+
+    def to_dict(self):
+        return {
+            '@timestamp': self.timestamp,
+            'ecs': {
+                'version': ECS_VERSION,
+            },
+            'event': {
+                'action': self.action,
+                'dataset': self.action,
+                'id': self.page_id,
+                'duration': self.duration,
+            },
+            'SearchMetrics': {
+                'query': {
+                    'id': self.query_id,
+                    'page': self.page,
+                },
+                'results': {
+                    'size': len(self.ids),
+                    'ids': [str(x) for x in self.ids],
+                },
+            },
+        }
+
+
+class ClickEvent:
+    """A click on a result of a page of a query."""
+
+    __slots__ = ('timestamp', 'click_id', 'query_id', 'page', 'result_id', 'rank')
+
+    action = 'SearchMetrics.click'
+
+    def __init__(self, timestamp, click_id, query_id, page, result_id, rank):
+        self.timestamp = timestamp
+        self.click_id = click_id
+        self.query_id = query_id
+        self.page = page
+        self.result_id = result_id
+        self.rank = rank
+
+    def to_ndjson(self):
+        return click_line(self.timestamp, self.click_id, self.query_id, self.page, self.result_id, self.rank)
+
+    def to_dict(self):
+        return {
+            '@timestamp': self.timestamp,
+            'ecs': {
+                'version': ECS_VERSION,
+            },
+            'event': {
+                'action': self.action,
+                'dataset': self.action,
+                'id': self.click_id,
+            },
+            'SearchMetrics': {
+                'query': {
+                    'id': self.query_id,
+                    'page': self.page,
+                },
+                'click': {
+                    'result': {
+                        'id': str(self.result_id),
+                        'rank': self.rank,
+                    },
+                },
+            },
+        }
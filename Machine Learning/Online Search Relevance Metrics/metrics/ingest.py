@@ -0,0 +1,275 @@
+"""
+Bulk indexing of simulated events. Events are generated in a background thread and handed over through a bounded
+queue to a pool of indexing threads, so that the simulation and indexing overlap instead of running in lockstep.
+
+Every thread sends its chunks with `helpers.streaming_bulk`, retrying documents rejected with a 429 (and whole
+requests rejected with a 429) with exponential backoff, so that a busy cluster slows indexing down instead of dropping
+documents. Retries are counted, so that rejections show up in the stats instead of only as a lower throughput.
+"""
+
+import itertools
+import queue
+import threading
+import time
+
+from elasticsearch import helpers
+from tqdm import tqdm
+
+from metrics import profiling
+from metrics.resources import INDEX, Timer
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_INITIAL_BACKOFF = 0.5
+DEFAULT_MAX_RETRIES = 10
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_THREAD_COUNT = 4
+MAX_FAILURES_SHOWN = 10
+REJECTED_STATUS = 429
+
+# marks the end of the queue
+_DONE = object()
+
+# how long a thread waits on a full (or empty) queue before checking whether the consumer stopped
+_PUT_TIMEOUT = 0.1
+
+
+class BulkStats:
+    """
+    The number of documents indexed, documents that failed (after retries), bulk requests, retried requests and
+    rejected (429) documents, and the duration of a bulk index.
+    """
+
+    def __init__(self):
+        self.num_docs = 0
+        self.num_failures = 0
+        self.num_requests = 0
+        self.num_retries = 0
+        self.num_rejected = 0
+        self.interval = 0.0
+
+    @property
+    def docs_per_second(self):
+        return self.num_docs / self.interval if self.interval else 0.0
+
+    def add(self, success, info):
+        """Counts the result of a document, printing the first few failures."""
+        if success:
+            self.num_docs += 1
+        else:
+            self.num_failures += 1
+            if self.num_failures <= MAX_FAILURES_SHOWN:
+                print(" - failure: ", info)
+
+    def add_requests(self, num_requests, num_rejected):
+        """Counts bulk requests, all but the first of which retried the documents rejected by the one before."""
+        self.num_requests += num_requests
+        self.num_retries += num_requests - 1
+        self.num_rejected += num_rejected
+
+    def print(self):
+        print(f" - documents indexed: {self.num_docs}")
+        print(f" - bulk requests: {self.num_requests}")
+        print(f" - retries: {self.num_retries} ({self.num_rejected} documents rejected)")
+        print(f" - failures: {self.num_failures}")
+        print(f" - duration: {self.interval:.04f} sec")
+        print(f" - throughput: {self.docs_per_second:.0f} docs/sec")
+
+
+def _put(q, item, stop):
+    """Puts an item on a bounded queue, unless `stop` is set while waiting. Returns whether the item was put."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Gets an item from a queue, or `_DONE` when `stop` is set while waiting."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_PUT_TIMEOUT)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def iter_queued(iterable, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Iterates over `iterable` in a background thread, yielding items through a bounded queue. The background thread
+    blocks when the queue is full, so it never gets more than `queue_size` items ahead. Any exception raised while
+    iterating is raised again in the consuming thread. When the consumer stops early (e.g. on an error, or by closing
+    the generator), the background thread stops too.
+    """
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(q, _DONE, stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _status(info):
+    """The HTTP status of a document in a bulk response, given as `{op_type: {'status': ..., ...}}`."""
+    return next(iter(info.values()))['status']
+
+
+def parallel_bulk(es, actions, thread_count=DEFAULT_THREAD_COUNT, chunk_size=DEFAULT_CHUNK_SIZE,
+                  max_retries=DEFAULT_MAX_RETRIES, initial_backoff=DEFAULT_INITIAL_BACKOFF, stats=None, **kwargs):
+    """
+    Like `helpers.parallel_bulk`, but documents rejected with a 429 (or in a request rejected with a 429) are retried up
+    to `max_retries` times, waiting `initial_backoff` seconds before the first retry and twice as long before every next
+    one. Yields `(success, info)` per document, and never raises for failed documents. When given `stats`, counts the
+    bulk requests, retries and rejected documents into it.
+
+    Chunks are taken from `actions` by a feeding thread and handed over to `thread_count` sending threads, through
+    queues of at most `thread_count` chunks (and results), so the threads never get far ahead of the consumer. When
+    the consumer stops early (e.g. on an error, or by closing the generator), the threads stop too: chunks not yet sent
+    are dropped, and only the requests in flight complete.
+    """
+
+    chunks = queue.Queue(maxsize=thread_count)
+    results = queue.Queue(maxsize=thread_count)
+    stop = threading.Event()
+
+    def send(chunk):
+        """Sends a chunk, retrying rejections. Returns the results, the number of requests and of rejections."""
+        sent = []
+        num_rejected = 0
+        for attempt in range(max_retries + 1):
+            if attempt:
+                time.sleep(initial_backoff * 2 ** (attempt - 1))
+
+            # without retries, `streaming_bulk` yields exactly one result per action, in order
+            rejected = []
+            for action, (success, info) in zip(chunk, helpers.streaming_bulk(
+                    es, chunk, chunk_size=len(chunk), max_retries=0, raise_on_error=False, raise_on_exception=False,
+                    yield_ok=True, **kwargs)):
+                if not success and _status(info) == REJECTED_STATUS:
+                    num_rejected += 1
+                    if attempt < max_retries:
+                        rejected.append(action)
+                        continue
+                sent.append((success, info))
+
+            if not rejected:
+                break
+            chunk = rejected
+        return sent, attempt + 1, num_rejected
+
+    def feed():
+        try:
+            for chunk in _chunks(actions, chunk_size):
+                if not _put(chunks, chunk, stop):
+                    return
+        except Exception as e:
+            _put(results, e, stop)
+        finally:
+            for _ in range(thread_count):
+                _put(chunks, _DONE, stop)
+
+    def work():
+        try:
+            while True:
+                chunk = _get(chunks, stop)
+                if chunk is _DONE:
+                    return
+                if not _put(results, send(chunk), stop):
+                    return
+        except Exception as e:
+            _put(results, e, stop)
+        finally:
+            _put(results, _DONE, stop)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads.extend(threading.Thread(target=work, daemon=True) for _ in range(thread_count))
+    for thread in threads:
+        thread.start()
+
+    try:
+        num_done = 0
+        while num_done < thread_count:
+            item = results.get()
+            if item is _DONE:
+                num_done += 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                docs, num_requests, num_rejected = item
+                if stats is not None:
+                    stats.add_requests(num_requests, num_rejected)
+                yield from docs
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def bulk_index(es, events, index=INDEX, pipeline=INDEX, thread_count=DEFAULT_THREAD_COUNT,
+               chunk_size=DEFAULT_CHUNK_SIZE, queue_size=DEFAULT_QUEUE_SIZE, max_retries=DEFAULT_MAX_RETRIES,
+               initial_backoff=DEFAULT_INITIAL_BACKOFF, with_progress=False):
+    """
+    Bulk indexes events (dictionaries or lines of JSON) while they are being generated, retrying rejections (see
+    `parallel_bulk`). Returns `BulkStats` with the number of documents indexed, failures and throughput.
+    """
+
+    def actions():
+        for event in iter_queued(events, queue_size):
+            yield {
+                '_index': index,
+                'pipeline': pipeline,
+                '_source': event,
+            }
+
+    stats = BulkStats()
+    results = parallel_bulk(es, actions(), thread_count=thread_count, chunk_size=chunk_size,
+                            max_retries=max_retries, initial_backoff=initial_backoff, stats=stats, request_timeout=600)
+    if with_progress:
+        results = tqdm(results, unit=' docs')
+
+    with profiling.span('bulk index'), Timer() as t:
+        for success, info in results:
+            stats.add(success, info)
+        profiling.count(docs=stats.num_docs)
+    stats.interval = t.interval
+
+    return stats
@@ -0,0 +1,383 @@
+"""
+Bulk loading of NDJSON event files, e.g. from `bin/simulate files`, for loading large volumes of events as fast as
+Elasticsearch accepts them. Files are partitioned across worker processes by size, and every worker reads its own files
+(plain, gzip compressed `.gz`, or zstandard compressed `.zst` with the optional `zstandard` package) and sends bulk
+requests one at a time. Bulk requests are capped by size in bytes as well as by number of events, and events rejected
+with HTTP 429 (e.g. full write queues) are retried with exponential backoff and jitter. Workers report progress to
+the main process, which prints the throughput every second.
+
+Loading can be resumed. Every event is indexed with a document ID derived from its `event.id`, so events that are
+indexed again overwrite themselves instead of being duplicated. With a journal, the main process records the byte
+offset (in the uncompressed stream) up to which each file has been acknowledged by Elasticsearch, after every bulk
+request. A restarted load skips what the journal records as acknowledged, so a crash costs at most the bulk requests
+in flight, one per worker, and those are indexed again safely.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import re
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from elasticsearch import Elasticsearch, TransportError
+
+from metrics.ingest import MAX_FAILURES_SHOWN
+from metrics.replay import REJECTED_STATUS
+from metrics.resources import INDEX, Timer
+
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_DOCS = 10000
+DEFAULT_MAX_RETRIES = 10
+DEFAULT_WORKERS = 4
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+REPORT_INTERVAL = 1.0
+
+MB = 1024 * 1024
+SKIP_BUFFER_SIZE = 1 << 20
+
+# the (JSON escaped) `event.id` of a line, without parsing the line
+EVENT_ID = re.compile(rb'"event":\{[^{}]*?"id":"((?:[^"\\]|\\.)*)"')
+
+
+class LoadStats:
+    def __init__(self):
+        self.num_docs = 0
+        self.num_bytes = 0
+        self.num_failures = 0
+        self.num_retries = 0
+        self.num_requests = 0
+        self.interval = 0.0
+        self.rates = []
+
+    @property
+    def docs_per_second(self):
+        return self.num_docs / self.interval if self.interval else 0.0
+
+    def add(self, num_docs, num_bytes, num_failures, num_retries, num_requests):
+        self.num_docs += num_docs
+        self.num_bytes += num_bytes
+        self.num_failures += num_failures
+        self.num_retries += num_retries
+        self.num_requests += num_requests
+
+    def print(self):
+        print(f" - documents: {self.num_docs}")
+        print(f" - size: {self.num_bytes / MB:.1f} MB")
+        print(f" - bulk requests: {self.num_requests}")
+        print(f" - retries: {self.num_retries}")
+        print(f" - failures: {self.num_failures}")
+        print(f" - duration: {self.interval:.04f} sec")
+        print(f" - throughput: {self.docs_per_second:.0f} docs/sec, "
+              f"{self.num_bytes / MB / self.interval if self.interval else 0.0:.1f} MB/sec")
+        if self.rates:
+            rates = sorted(self.rates)
+            print(f" - throughput per second: min {rates[0]:.0f}, median {rates[len(rates) // 2]:.0f}, "
+                  f"max {rates[-1]:.0f} docs/sec")
+
+
+def open_file(filename, offset=0):
+    """
+    Opens an NDJSON file for reading lines as bytes, decompressing `.gz` and `.zst` files, from an offset in the
+    (uncompressed) stream. Plain files seek to the offset, while compressed files are decompressed up to it.
+    """
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rb')
+    elif filename.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"Reading {filename} requires the zstandard package: pip install zstandard")
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True))
+    else:
+        f = open(filename, 'rb')
+        f.seek(offset)
+        return f
+
+    remaining = offset
+    while remaining > 0:
+        data = f.read(min(remaining, SKIP_BUFFER_SIZE))
+        if not data:
+            break
+        remaining -= len(data)
+    return f
+
+
+def partition_files(filenames, n):
+    """
+    Partitions files into at most `n` partitions of about the same total size (of the files on disk), assigning the
+    largest files first to the smallest partition.
+    """
+    partitions = [[] for _ in range(min(n, len(filenames)))]
+    sizes = [0] * len(partitions)
+    for filename in sorted(filenames, key=os.path.getsize, reverse=True):
+        i = sizes.index(min(sizes))
+        partitions[i].append(filename)
+        sizes[i] += os.path.getsize(filename)
+    return partitions
+
+
+def iter_chunks(lines, max_bytes=DEFAULT_MAX_BYTES, max_docs=DEFAULT_MAX_DOCS, offset=0):
+    """
+    Groups lines (bytes) into chunks for bulk requests of at most `max_bytes` (including action lines) and at most
+    `max_docs` lines. A single line larger than `max_bytes` is sent on its own. Empty lines are skipped. Yields every
+    chunk, as `(action, line)` pairs for `bulk_body`, with the offset just past its last line, counting from `offset`.
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        offset += len(line)
+        if not line.strip():
+            continue
+        if not line.endswith(b'\n'):
+            line += b'\n'
+
+        action = index_action(line)
+        line_size = len(action) + len(line)
+        if chunk and (size + line_size > max_bytes or len(chunk) >= max_docs):
+            yield chunk, chunk_offset
+            chunk = []
+            size = 0
+        chunk.append((action, line))
+        chunk_offset = offset
+        size += line_size
+
+    if chunk:
+        yield chunk, chunk_offset
+
+
+def document_id(line):
+    """
+    A deterministic document ID for a line of JSON (bytes): its `event.id`, or when missing, a hash of the line. The ID
+    is returned JSON escaped, as bytes.
+    """
+    match = EVENT_ID.search(line)
+    if match:
+        return match.group(1)
+
+    # e.g. strings containing braces in the event object
+    event_id = json.loads(line).get('event', {}).get('id')
+    if event_id is not None:
+        return json.dumps(str(event_id)).encode('utf-8')[1:-1]
+    return hashlib.sha1(line.strip()).hexdigest().encode('ascii')
+
+
+def index_action(line):
+    """The action line to index a line of JSON (bytes) with its document ID."""
+    return b'{"index":{"_id":"' + document_id(line) + b'"}}\n'
+
+
+def bulk_body(docs):
+    """A bulk request body from `(action, line)` pairs (see `iter_chunks`), both bytes ending with a newline."""
+    return b''.join(action + line for action, line in docs)
+
+
+def backoff(attempt):
+    """The time to wait before a retry, exponential in the number of attempts, with jitter."""
+    delay = min(MAX_BACKOFF, INITIAL_BACKOFF * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def send_bulk(es, docs, index=INDEX, pipeline=INDEX, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Sends `(action, line)` pairs (see `iter_chunks`) in a bulk request, retrying rejected lines (or the whole request,
+    when rejected) up to `max_retries` times. Returns the number of retries and the errors of failed lines, including
+    lines still rejected after the last retry.
+    """
+    errors = []
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(backoff(attempt))
+
+        try:
+            response = es.bulk(body=bulk_body(docs), index=index, pipeline=pipeline, request_timeout=600)
+        except TransportError as e:
+            if e.status_code != REJECTED_STATUS:
+                raise
+            continue
+
+        if not response['errors']:
+            return attempt, errors
+
+        items = [x['index'] for x in response['items']]
+        errors.extend(x for x in items if x['status'] >= 300 and x['status'] != REJECTED_STATUS)
+        docs = [doc for doc, x in zip(docs, items) if x['status'] == REJECTED_STATUS]
+        if not docs:
+            return attempt, errors
+
+    errors.extend({'status': REJECTED_STATUS, 'error': 'rejected after retries'} for _ in docs)
+    return max_retries, errors
+
+
+class OffsetJournal:
+    """
+    An append-only journal of the offsets up to which files have been acknowledged, with a line of JSON per bulk
+    request. The last line of a file wins. A partially written last line (e.g. after a crash) is truncated on open, so
+    that new lines are not appended to it.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets = {}
+        self.done = set()
+        if os.path.exists(filename):
+            with open(filename, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.offsets[entry['file']] = entry['offset']
+                if entry['done']:
+                    self.done.add(entry['file'])
+        self.f = open(filename, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, filename, offset, done=False):
+        """Records that a file has been acknowledged up to an offset, flushed right away."""
+        self.offsets[filename] = offset
+        if done:
+            self.done.add(filename)
+        self.f.write(json.dumps({'file': filename, 'offset': offset, 'done': done}) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def load_files(es, filenames, index=INDEX, pipeline=INDEX, max_bytes=DEFAULT_MAX_BYTES, max_docs=DEFAULT_MAX_DOCS,
+               max_retries=DEFAULT_MAX_RETRIES, offsets=None, report=None):
+    """
+    Loads files one after the other with bulk requests, starting every file from its offset in `offsets` (if any).
+    After every bulk request, `report` is called with the number of documents, bytes, failures, retries and requests,
+    the file, the offset acknowledged and whether the file is done. Returns `LoadStats`.
+    """
+    offsets = offsets or {}
+    stats = LoadStats()
+    with Timer() as t:
+        for filename in filenames:
+            offset = offsets.get(filename, 0)
+            with open_file(filename, offset) as f:
+                for docs, offset in iter_chunks(f, max_bytes, max_docs, offset):
+                    num_retries, errors = send_bulk(es, docs, index, pipeline, max_retries)
+                    for error in errors[:max(0, MAX_FAILURES_SHOWN - stats.num_failures)]:
+                        print(" - failure: ", error)
+
+                    progress = (len(docs), sum(len(x) for _, x in docs), len(errors), num_retries, 1 + num_retries)
+                    stats.add(*progress)
+                    if report:
+                        report(progress, filename, offset, False)
+            if report:
+                report((0, 0, 0, 0, 0), filename, offset, True)
+    stats.interval = t.interval
+    return stats
+
+
+def _worker(url, filenames, options, messages):
+    """Loads files in a worker process, sending progress and finally `None` (or an error) to the main process."""
+    try:
+        es = Elasticsearch(url)
+        load_files(es, filenames, report=lambda *x: messages.put(x), **options)
+        messages.put(None)
+    except Exception as e:
+        messages.put(f"{type(e).__name__}: {e}")
+
+
+def load_events(url, filenames, index=INDEX, pipeline=INDEX, workers=DEFAULT_WORKERS, max_bytes=DEFAULT_MAX_BYTES,
+                max_docs=DEFAULT_MAX_DOCS, max_retries=DEFAULT_MAX_RETRIES, journal=None,
+                report_interval=REPORT_INTERVAL):
+    """
+    Loads files on multiple worker processes, with files partitioned across workers by size (see `partition_files`).
+    With a `journal` filename, acknowledged offsets are recorded in the journal, and files (or parts of files) that it
+    records as acknowledged are skipped (see `OffsetJournal`). Prints the throughput every `report_interval` seconds
+    and returns `LoadStats`, with the throughput of every interval. Raises `RuntimeError` when a worker failed.
+    """
+    filenames = [os.path.abspath(x) for x in filenames]
+    journal = OffsetJournal(journal) if journal else None
+    offsets = {}
+    if journal:
+        offsets = {x: journal.offsets[x] for x in filenames if x in journal.offsets}
+        if offsets:
+            print(f"Resuming from journal: {journal.filename}")
+            print(f" - files done: {sum(1 for x in filenames if x in journal.done)}")
+            print(f" - files partially done: {sum(1 for x in offsets if x not in journal.done)}")
+        filenames = [x for x in filenames if x not in journal.done]
+
+    options = {
+        'index': index,
+        'pipeline': pipeline,
+        'max_bytes': max_bytes,
+        'max_docs': max_docs,
+        'max_retries': max_retries,
+        'offsets': offsets,
+    }
+    messages = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker, args=(url, x, options, messages), daemon=True)
+                 for x in partition_files(filenames, workers)]
+
+    stats = LoadStats()
+    errors = []
+    running = len(processes)
+    start = time.monotonic()
+    last_report = start
+    last_docs = 0
+
+    for process in processes:
+        process.start()
+
+    while running:
+        try:
+            message = messages.get(timeout=report_interval)
+        except queue.Empty:
+            # a worker that died without a message (e.g. killed) would otherwise be waited for forever
+            if not any(x.is_alive() for x in processes):
+                errors.append("worker exited unexpectedly")
+                break
+            message = ()
+
+        if message is None:
+            running -= 1
+        elif isinstance(message, str):
+            errors.append(message)
+            running -= 1
+        elif message:
+            progress, filename, offset, done = message
+            stats.add(*progress)
+            if journal:
+                journal.record(filename, offset, done)
+
+        now = time.monotonic()
+        if now - last_report >= report_interval:
+            rate = (stats.num_docs - last_docs) / (now - last_report)
+            stats.rates.append(rate)
+            print(f" - {now - start:.0f} sec: {rate:.0f} docs/sec, {stats.num_docs} docs in total", end='\r')
+            last_report = now
+            last_docs = stats.num_docs
+
+    for process in processes:
+        process.join()
+    if journal:
+        journal.close()
+    stats.interval = time.monotonic() - start
+    print()
+
+    if errors:
+        raise RuntimeError(f"Loading failed: {errors[0]}")
+    return stats
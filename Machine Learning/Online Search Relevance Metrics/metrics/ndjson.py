@@ -0,0 +1,221 @@
+"""
+Fast NDJSON output for simulated events. Events are serialized with pre-encoded constant fragments (the `ecs` block,
+action names, field names) so that only the values that vary per event need to be formatted, and lines are written
+through a buffered writer that can rotate files by size and optionally compress them with gzip.
+
+The output is regular NDJSON, with one compact JSON event per line, and can be indexed with `bin/index`.
+"""
+
+import gzip
+import json
+import os
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+ECS_VERSION = '1.6.0-dev'
+
+# escapes and quotes a string value, the same as `json.dumps`
+_str = json.encoder.encode_basestring_ascii
+
+ECS = '"ecs":{"version":' + _str(ECS_VERSION) + '}'
+QUERY_EVENT = '"event":{"action":"SearchMetrics.query","dataset":"SearchMetrics.query","id":"'
+PAGE_EVENT = '"event":{"action":"SearchMetrics.page","dataset":"SearchMetrics.page","id":"'
+CLICK_EVENT = '"event":{"action":"SearchMetrics.click","dataset":"SearchMetrics.click","id":"'
+
+
+def encode_ids(ids):
+    """Encodes result IDs (strings or integers) as a JSON array of strings."""
+    if not len(ids):
+        return '[]'
+    return '[' + ','.join(_str(str(x)) for x in ids) + ']'
+
+
+def encode_digit_ids(ids):
+    """Encodes integer result IDs as a JSON array of strings. Faster than `encode_ids` since nothing needs escaping."""
+    if not len(ids):
+        return '[]'
+    return '["' + '","'.join(map(str, ids)) + '"]'
+
+
+def query_line(timestamp, query_id, duration, value, size, total, ids, experiment, variant, page_name, user_id,
+               country, city, location):
+    """
+    Encodes a query event. Timestamps and IDs are expected to not need escaping, and `ids` is expected to be encoded
+    already (see `encode_ids`).
+    """
+    return (
+        f'{{"@timestamp":"{timestamp}",{ECS},{QUERY_EVENT}{query_id}","duration":{duration}}},'
+        f'"SearchMetrics":{{"query":{{"id":"{query_id}","value":{_str(value)},"page":1}},'
+        f'"results":{{"size":{size},"total":{total},"ids":{ids}}}}},'
+        f'"SearchMetricsSimulation":{{"ab":{{"experiment":{_str(experiment)},"variant":{_str(variant)}}},'
+        f'"page_name":{_str(page_name)}}},'
+        f'"source":{{"user":{{"id":{_str(user_id)}}},"geo":{{"country_iso_code":{_str(country)},'
+        f'"city_name":{_str(city)},"location":{_str(location)}}}}}}}'
+    )
+
+
+def page_line(timestamp, page_id, duration, query_id, page, size, ids):
+    """Encodes a page event, see `query_line`."""
+    return (
+        f'{{"@timestamp":"{timestamp}",{ECS},{PAGE_EVENT}{page_id}","duration":{duration}}},'
+        f'"SearchMetrics":{{"query":{{"id":"{query_id}","page":{page}}},"results":{{"size":{size},"ids":{ids}}}}}}}'
+    )
+
+
+def click_line(timestamp, click_id, query_id, page, result_id, rank):
+    """Encodes a click event, see `query_line`."""
+    return (
+        f'{{"@timestamp":"{timestamp}",{ECS},{CLICK_EVENT}{click_id}"}},'
+        f'"SearchMetrics":{{"query":{{"id":"{query_id}","page":{page}}},'
+        f'"click":{{"result":{{"id":{_str(str(result_id))},"rank":{rank}}}}}}}}}'
+    )
+
+
+def _encode_query(event):
+    e = event['event']
+    m = event['SearchMetrics']
+    s = event['SearchMetricsSimulation']
+    geo = event['source']['geo']
+    return query_line(event['@timestamp'], e['id'], e['duration'], m['query']['value'], m['results']['size'],
+                      m['results']['total'], encode_ids(m['results']['ids']), s['ab']['experiment'],
+                      s['ab']['variant'], s['page_name'], event['source']['user']['id'], geo['country_iso_code'],
+                      geo['city_name'], geo['location'])
+
+
+def _encode_page(event):
+    e = event['event']
+    m = event['SearchMetrics']
+    return page_line(event['@timestamp'], e['id'], e['duration'], m['query']['id'], m['query']['page'],
+                     m['results']['size'], encode_ids(m['results']['ids']))
+
+
+def _encode_click(event):
+    m = event['SearchMetrics']
+    result = m['click']['result']
+    return click_line(event['@timestamp'], event['event']['id'], m['query']['id'], m['query']['page'], result['id'],
+                      result['rank'])
+
+
+ENCODERS = {
+    'SearchMetrics.query': _encode_query,
+    'SearchMetrics.page': _encode_page,
+    'SearchMetrics.click': _encode_click,
+}
+
+
+def encode_event(event):
+    """
+    Encodes a simulated event dictionary, or an event record (see `metrics.events`), as a single line of JSON (without
+    a newline). Falls back to `json.dumps` for anything that is not a simulated event.
+    """
+    if hasattr(event, 'to_ndjson'):
+        return event.to_ndjson()
+    encoder = ENCODERS.get(event.get('event', {}).get('action'))
+    if encoder and event.get('ecs', {}).get('version') == ECS_VERSION:
+        return encoder(event)
+    return json.dumps(event, separators=(',', ':'))
+
+
+class NdjsonWriter:
+    """
+    Writes lines of NDJSON to a file, buffering lines in memory and writing them in large chunks.
+
+    With `max_bytes`, files are rotated once they reach that (uncompressed) size: parts are written to numbered
+    files, e.g. `events-00000.ndjson`, `events-00001.ndjson`, etc. for the filename `events.ndjson`. With `compress`,
+    files are compressed with gzip and get a `.gz` suffix. Instead of a filename, a binary stream can be given (e.g.
+    `sys.stdout.buffer`), in which case there is no rotation.
+    """
+
+    def __init__(self, filename_or_stream, max_bytes=None, compress=False, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.filenames = []
+        self.num_lines = 0
+        self.num_bytes = 0
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._file_bytes = 0
+        if isinstance(filename_or_stream, str):
+            self._filename = filename_or_stream
+            self._stream = None
+            self._file = None
+        else:
+            self._filename = None
+            self._stream = filename_or_stream
+            self._file = gzip.GzipFile(fileobj=filename_or_stream, mode='wb') if compress else filename_or_stream
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _part_filename(self):
+        filename = self._filename
+        if self.max_bytes:
+            root, ext = os.path.splitext(filename)
+            filename = f'{root}-{len(self.filenames):05d}{ext}'
+        if self.compress:
+            filename += '.gz'
+        return filename
+
+    def _open(self):
+        filename = self._part_filename()
+        self.filenames.append(filename)
+        self._file_bytes = 0
+        if self.compress:
+            self._file = gzip.open(filename, 'wb', compresslevel=6)
+        else:
+            self._file = open(filename, 'wb')
+
+    def _close_file(self):
+        if self._file and not self._stream:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        """Writes all buffered lines."""
+        if not self._buffer:
+            return
+
+        if self._stream is None:
+            if self._file is None:
+                self._open()
+            elif self.max_bytes and self._file_bytes >= self.max_bytes:
+                self._close_file()
+                self._open()
+
+        self._file.write(b''.join(self._buffer))
+        self._file_bytes += self._buffer_bytes
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def write(self, line):
+        """Writes a line (without a newline)."""
+        # encoded events are ASCII only, but other lines (e.g. from `json.dumps` with `ensure_ascii=False`) may not be,
+        # so the buffer and file sizes are counted in bytes as written rather than in characters
+        data = (line + '\n').encode('utf-8')
+        size = len(data)
+        self._buffer.append(data)
+        self._buffer_bytes += size
+        self.num_lines += 1
+        self.num_bytes += size
+
+        # flush at the buffer size, or earlier when the current file needs to be rotated
+        if self._buffer_bytes >= self.buffer_size or \
+                (self.max_bytes and self._file_bytes + self._buffer_bytes >= self.max_bytes):
+            self.flush()
+
+    def write_event(self, event):
+        """Encodes and writes an event dictionary or record."""
+        self.write(encode_event(event))
+
+    def close(self):
+        self.flush()
+        if self._stream is None:
+            self._close_file()
+        else:
+            if self.compress:
+                self._file.close()
+            self._stream.flush()
@@ -0,0 +1,100 @@
+"""
+Runs the batch simulation on multiple cores. Users are split into the shards of a `batch.Simulation` and shards are
+generated by a pool of worker processes. Since every block of users of a shard has its own random generator derived
+from the seed, the same seed gives the same events regardless of the number of workers. When merging into a single
+stream, every batch of a shard is a task of its own, so that a worker only holds a batch of lines at a time.
+"""
+
+import multiprocessing
+import os
+
+from tqdm import tqdm
+
+from metrics.batch import DEFAULT_BATCH_SIZE, DEFAULT_SHARD_SIZE, Simulation
+from metrics.ndjson import NdjsonWriter
+from metrics.queries import DEFAULT_POOL_SIZE, DEFAULT_SKEW
+
+DEFAULT_WORKERS = os.cpu_count()
+
+# the simulation, per worker process
+_simulation = None
+
+
+def shard_filename(output_dir, shard):
+    return os.path.join(output_dir, f'events-{shard:05d}.ndjson')
+
+
+def _init_worker(simulation):
+    global _simulation
+    _simulation = simulation
+
+
+def _batch_lines(task):
+    """Generates the events of a batch of a shard as NDJSON."""
+    (shard, block, user_ids) = task
+    return ''.join(f'{x}\n' for x in _simulation.generate_batch(shard, block, user_ids).lines())
+
+
+def _write_shard(task):
+    """Generates the events of a shard into a file (or files, when rotating). Returns the filenames."""
+    (shard, user_ids, batch_size, filename, max_bytes, compress) = task
+    with NdjsonWriter(filename, max_bytes=max_bytes, compress=compress) as writer:
+        for events in _simulation.generate_shard(shard, user_ids, batch_size):
+            for line in events.lines():
+                writer.write(line)
+    return writer.filenames
+
+
+def _map(simulation, fn, tasks, workers, with_progress):
+    """Maps tasks over a pool of workers (or in this process for a single worker), in task order."""
+    if workers <= 1:
+        _init_worker(simulation)
+        results = map(fn, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(simulation,))
+        results = pool.imap(fn, tasks)
+
+    if with_progress:
+        results = tqdm(results, total=len(tasks))
+
+    try:
+        yield from results
+    finally:
+        if pool:
+            pool.terminate()
+
+
+def generate_to_stream(num_documents, num_users, max_queries, out, workers=DEFAULT_WORKERS, seed=None,
+                       batch_size=DEFAULT_BATCH_SIZE, shard_size=DEFAULT_SHARD_SIZE, profiles_filename=None,
+                       query_pool_size=DEFAULT_POOL_SIZE, query_skew=DEFAULT_SKEW, time_model=None,
+                       click_model=None, with_progress=False):
+    """Generates events on multiple cores, merged into a single NDJSON stream in shard order, a batch at a time."""
+    simulation = Simulation(num_documents, max_queries, seed, shard_size=shard_size, query_pool_size=query_pool_size,
+                            query_skew=query_skew, time_model=time_model,
+                            click_model=click_model)
+    simulation.prepare_profiles(num_users, profiles_filename)
+    tasks = [(shard, block, batch_user_ids) for (shard, user_ids) in simulation.shards(num_users)
+             for (block, batch_user_ids) in simulation.batches(user_ids, batch_size)]
+
+    for lines in _map(simulation, _batch_lines, tasks, workers, with_progress):
+        out.write(lines)
+
+
+def generate_to_files(num_documents, num_users, max_queries, output_dir, workers=DEFAULT_WORKERS, seed=None,
+                      batch_size=DEFAULT_BATCH_SIZE, shard_size=DEFAULT_SHARD_SIZE, profiles_filename=None,
+                      query_pool_size=DEFAULT_POOL_SIZE, query_skew=DEFAULT_SKEW, time_model=None,
+                      click_model=None, max_bytes=None, compress=False, with_progress=False):
+    """
+    Generates events on multiple cores, with each shard written in parallel to its own file in `output_dir`. Files
+    can be rotated by size and compressed, see `ndjson.NdjsonWriter`.
+    """
+    simulation = Simulation(num_documents, max_queries, seed, shard_size=shard_size, query_pool_size=query_pool_size,
+                            query_skew=query_skew, time_model=time_model,
+                            click_model=click_model)
+    simulation.prepare_profiles(num_users, profiles_filename)
+    tasks = [(shard, user_ids, batch_size, shard_filename(output_dir, shard), max_bytes, compress)
+             for (shard, user_ids) in simulation.shards(num_users)]
+
+    os.makedirs(output_dir, exist_ok=True)
+    return [x for filenames in _map(simulation, _write_shard, tasks, workers, with_progress) for x in filenames]
@@ -0,0 +1,305 @@
+"""
+An in-memory weighted prefix index for query completion without a round trip to Elasticsearch. The index is a snapshot
+of the `ecs-search-metrics_transform_completion` index, with a weight per query value from its metrics (see
+`completion_weight`).
+
+Query values are kept as keys (normalized to lowercase) in sorted order, so that all keys with a given prefix are in a
+contiguous range that is found by binary search. For all prefixes of up to `max_prefix_length` characters, the top-k
+keys by weight are precomputed, so that completing a short prefix is a single binary search. Longer prefixes match
+fewer keys, and the top-k of their range is computed when needed. Fuzzy completion walks the sorted keys as a trie,
+keeping a row of edit distances per node (as with a Levenshtein automaton), and only visits prefixes within the
+fuzziness.
+
+All arrays (strings as UTF-8 bytes with offsets) are stored in a single file that is memory mapped when loaded, so
+loading is instant and the operating system shares pages between processes.
+"""
+
+import json
+
+import numpy as np
+
+from elasticsearch import helpers
+
+from metrics.completion import COMPLETION_INDEX, DEFAULT_FUZZINESS, DEFAULT_SIZE
+
+DEFAULT_K = 10
+DEFAULT_MAX_PREFIX_LENGTH = 8
+MAX_FUZZINESS = 2
+
+# like the completion suggester, the first character of a prefix is never fuzzy, nor are prefixes shorter than this
+FUZZY_MIN_LENGTH = 3
+
+# keys of a range this small are compared one by one rather than walked as a trie
+FUZZY_SCAN_SIZE = 16
+
+ALIGNMENT = 64
+MAGIC = b'PFXIDX01'
+
+# greater than any byte of a UTF-8 encoded string
+_END = b'\xff'
+
+
+def normalize(text):
+    return text.lower()
+
+
+def completion_weight(doc):
+    """The weight of a query value: the number of queries, weighted by their mean reciprocal rank."""
+    metrics = doc.get('metrics', {})
+    return metrics.get('num_queries', 0) * (metrics.get('mean_mean_reciprocal_rank') or 0.0)
+
+
+def snapshot(es, index=COMPLETION_INDEX):
+    """Scrolls through the completion index. Returns query values and their weights."""
+    values = []
+    weights = []
+    for hit in helpers.scan(es, index=index, query={'_source': ['SearchMetrics.query.value', 'metrics']}):
+        values.append(hit['_source']['SearchMetrics']['query']['value'])
+        weights.append(completion_weight(hit['_source']))
+    return values, weights
+
+
+def _pack(strings):
+    """Packs strings into UTF-8 bytes and offsets."""
+    encoded = [x.encode('utf-8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _group_starts(strings):
+    """Group IDs of runs of equal, sorted strings, and the start of each group."""
+    changes = np.ones(len(strings), dtype=bool)
+    changes[1:] = strings[1:] != strings[:-1]
+    return np.cumsum(changes) - 1, np.flatnonzero(changes)
+
+
+def _top_k_rows(keys, weights, k, max_prefix_length):
+    """
+    The prefixes of up to `max_prefix_length` characters of sorted keys, each with the indices of its top-k keys by
+    weight (padded with -1). Prefixes of the same length are grouped at once: keys are sorted by prefix, then by
+    decreasing weight, and the first k of each prefix are kept.
+    """
+    prefixes = []
+    rows = []
+    for length in range(1, max_prefix_length + 1):
+        indices = np.flatnonzero(np.array([len(x) >= length for x in keys], dtype=bool))
+        if not len(indices):
+            break
+        grouped = np.array([keys[i][:length] for i in indices], dtype=object)
+        groups, starts = _group_starts(grouped)
+
+        order = np.lexsort((-weights[indices], groups))
+        ranks = np.arange(len(order)) - starts[groups[order]]
+        top = ranks < k
+
+        top_k = np.full((len(starts), k), -1, dtype=np.int32)
+        top_k[groups[order][top], ranks[top]] = indices[order][top]
+        prefixes.extend(grouped[starts])
+        rows.append(top_k)
+
+    return prefixes, np.concatenate(rows) if rows else np.zeros((0, k), dtype=np.int32)
+
+
+def _edit_distance_row(row, char, prefix, depth, fuzziness):
+    """
+    The next row of edit distances between the prefix and a path in the trie extended with a character, at a depth.
+    Distances are capped at one more than the fuzziness, so only cells near the diagonal are computed.
+    """
+    cap = fuzziness + 1
+    next_row = [cap] * len(row)
+    next_row[0] = min(depth, cap)
+    for j in range(max(1, depth - fuzziness), min(len(prefix), depth + fuzziness) + 1):
+        next_row[j] = min(next_row[j - 1] + 1, row[j] + 1, row[j - 1] + (prefix[j - 1] != char), cap)
+    return next_row
+
+
+class PrefixIndex:
+    def __init__(self, arrays, k, max_prefix_length):
+        self.arrays = arrays
+        self.k = k
+        self.max_prefix_length = max_prefix_length
+        self.key_data = arrays['key_data']
+        self.key_offsets = arrays['key_offsets']
+        self.value_data = arrays['value_data']
+        self.value_offsets = arrays['value_offsets']
+        self.weights = arrays['weights']
+        self.prefix_data = arrays['prefix_data']
+        self.prefix_offsets = arrays['prefix_offsets']
+        self.top_k = arrays['top_k']
+
+    def __len__(self):
+        return len(self.key_offsets) - 1
+
+    @classmethod
+    def build(cls, values, weights, k=DEFAULT_K, max_prefix_length=DEFAULT_MAX_PREFIX_LENGTH):
+        """Builds an index of query values with their weights."""
+        keys = [normalize(x) for x in values]
+        order = sorted(range(len(keys)), key=lambda i: keys[i].encode('utf-8'))
+        keys = [keys[i] for i in order]
+        values = [values[i] for i in order]
+        weights = np.asarray(weights, dtype=np.float32)[order] if len(order) else np.zeros(0, dtype=np.float32)
+
+        prefixes, top_k = _top_k_rows(keys, weights, k, max_prefix_length)
+        prefix_order = sorted(range(len(prefixes)), key=lambda i: prefixes[i].encode('utf-8'))
+
+        arrays = {}
+        arrays['key_data'], arrays['key_offsets'] = _pack(keys)
+        arrays['value_data'], arrays['value_offsets'] = _pack(values)
+        arrays['weights'] = weights
+        arrays['prefix_data'], arrays['prefix_offsets'] = _pack([prefixes[i] for i in prefix_order])
+        arrays['top_k'] = top_k[prefix_order] if len(prefix_order) else top_k
+        return cls(arrays, k, max_prefix_length)
+
+    def save(self, filename):
+        """
+        Saves the index to a single file: a magic number, the length of a JSON header with the type, shape and offset
+        of every array, the header, and the arrays, aligned for memory mapping.
+        """
+        header = {'k': self.k, 'max_prefix_length': self.max_prefix_length, 'arrays': {}}
+        offset = 0
+        for name, array in self.arrays.items():
+            header['arrays'][name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        data = json.dumps(header).encode('utf-8')
+        start = -(-(len(MAGIC) + 8 + len(data)) // ALIGNMENT) * ALIGNMENT
+        with open(filename, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(data).to_bytes(8, 'little'))
+            f.write(data)
+            for name, array in self.arrays.items():
+                f.seek(start + header['arrays'][name]['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(start + offset)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads an index saved with `save`, memory mapping its arrays."""
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a prefix index file: {filename}")
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+        start = -(-(len(MAGIC) + 8 + size) // ALIGNMENT) * ALIGNMENT
+
+        arrays = {}
+        for name, x in header['arrays'].items():
+            shape = tuple(x['shape'])
+            if 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=x['dtype'])
+            else:
+                arrays[name] = np.memmap(filename, dtype=x['dtype'], mode='r', offset=start + x['offset'],
+                                         shape=shape)
+        return cls(arrays, header['k'], header['max_prefix_length'])
+
+    def _key(self, i):
+        return self.key_data[self.key_offsets[i]:self.key_offsets[i + 1]].tobytes()
+
+    def _prefix(self, i):
+        return self.prefix_data[self.prefix_offsets[i]:self.prefix_offsets[i + 1]].tobytes()
+
+    def value(self, i):
+        return self.value_data[self.value_offsets[i]:self.value_offsets[i + 1]].tobytes().decode('utf-8')
+
+    def _bisect(self, get, n, target, lo=0):
+        """The first of `n` sorted strings (from `get`) that is not less than the target."""
+        hi = n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if get(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def key_range(self, prefix):
+        """The range of keys starting with a (normalized, encoded) prefix."""
+        return self._bisect(self._key, len(self), prefix), self._bisect(self._key, len(self), prefix + _END)
+
+    def _top(self, ranges, size):
+        """The indices of the top keys by weight in the ranges."""
+        indices = np.concatenate([np.arange(lo, hi) for lo, hi in ranges]) if ranges else np.zeros(0, dtype=np.int64)
+        if len(indices) > size:
+            indices = indices[np.argpartition(-self.weights[indices], size - 1)[:size]]
+        return indices[np.argsort(-self.weights[indices], kind='stable')]
+
+    def _exact(self, prefix, size):
+        encoded = prefix.encode('utf-8')
+        if len(prefix) <= self.max_prefix_length and size <= self.k:
+            i = self._bisect(self._prefix, len(self.prefix_offsets) - 1, encoded)
+            if i == len(self.prefix_offsets) - 1 or self._prefix(i) != encoded:
+                return []
+            return [x for x in self.top_k[i][:size] if x >= 0]
+        return list(self._top([self.key_range(encoded)], size))
+
+    def _scan(self, i, path, row, prefix, fuzziness):
+        """The edit distance of the closest prefix of a key extending a path, continuing from the path's row."""
+        best = row[-1]
+        depth = len(path) - 1
+        for char in self._key(i).decode('utf-8')[len(path):]:
+            depth += 1
+            row = _edit_distance_row(row, char, prefix, depth, fuzziness)
+            best = min(best, row[-1])
+            if min(row) >= best:
+                break
+        return best
+
+    def _fuzzy_ranges(self, prefix, fuzziness):
+        """
+        The ranges of keys within the fuzziness of the prefix, with their edit distance, where a key may be in several
+        ranges. The first character has to match. Walks the trie of sorted keys depth first, pruning paths that cannot
+        get closer to the prefix, and scans the keys of small ranges one by one.
+        """
+        matches = []
+        first, rest = prefix[0], prefix[1:]
+        lo, hi = self.key_range(first.encode('utf-8'))
+        stack = [(first, lo, hi, [min(j, fuzziness + 1) for j in range(len(prefix))])]
+        while stack:
+            path, lo, hi, row = stack.pop()
+            if row[-1] <= fuzziness:
+                matches.append((row[-1], lo, hi))
+            if min(row) >= row[-1]:
+                continue
+
+            # skip a key equal to the path, it has no more characters
+            encoded = path.encode('utf-8')
+            if lo < hi and self._key(lo) == encoded:
+                lo += 1
+            if hi - lo <= FUZZY_SCAN_SIZE:
+                for i in range(lo, hi):
+                    distance = self._scan(i, path, row, rest, fuzziness)
+                    if distance < row[-1]:
+                        matches.append((distance, i, i + 1))
+                continue
+
+            while lo < hi:
+                char = self._key(lo)[len(encoded):].decode('utf-8', errors='ignore')[:1]
+                child = path + char
+                child_hi = self._bisect(self._key, hi, child.encode('utf-8') + _END, lo=lo)
+                stack.append((child, lo, child_hi, _edit_distance_row(row, char, rest, len(path), fuzziness)))
+                lo = child_hi
+        return matches
+
+    def complete(self, prefix, size=DEFAULT_SIZE, fuzziness=DEFAULT_FUZZINESS):
+        """
+        Suggests up to `size` query values starting with the prefix, by decreasing weight. With fuzziness, values
+        starting with a prefix within that edit distance are suggested as well, closer prefixes first.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        fuzziness = min(fuzziness, MAX_FUZZINESS)
+        if not fuzziness or len(prefix) < FUZZY_MIN_LENGTH:
+            return [self.value(i) for i in self._exact(prefix, size)]
+
+        matches = self._fuzzy_ranges(prefix, fuzziness)
+        if not matches:
+            return []
+        indices = np.concatenate([np.arange(lo, hi) for _, lo, hi in matches])
+        distances = np.concatenate([np.full(hi - lo, distance) for distance, lo, hi in matches])
+
+        # by distance then weight, keeping the closest match of every key
+        order = np.lexsort((-self.weights[indices], distances))
+        _, first = np.unique(indices[order], return_index=True)
+        return [self.value(i) for i in indices[order][np.sort(first)][:size]]
@@ -0,0 +1,72 @@
+"""
+A compact, array-backed table of user profiles for the batch simulation: country, city, location and A/B test
+assignment per user ID. The table is built once per run, after which looking up the profile of a user is just an
+index into the arrays. Tables can be saved to disk so that repeated runs with the same user population can skip
+building them.
+"""
+
+import numpy as np
+import os
+import zlib
+
+from metrics.simulate import AB_EXPERIMENTS, AB_VARIANTS
+
+EXPERIMENT_NAMES = np.array([x or 'none' for x in AB_EXPERIMENTS], dtype=object)
+VARIANT_NAMES = np.array(AB_VARIANTS + ['none'], dtype=object)
+NO_VARIANT = len(AB_VARIANTS)
+
+
+class UserProfiles:
+    """
+    User profiles, as one array per attribute indexed by (integer) user ID. Locations are indices into the coordinates
+    of a `batch.Simulation`, experiments and variants are indices into `EXPERIMENT_NAMES` and `VARIANT_NAMES`.
+    """
+
+    def __init__(self, key, countries, coords, experiments, variants):
+        self.key = key
+        self.countries = countries
+        self.coords = coords
+        self.experiments = experiments
+        self.variants = variants
+
+    def __len__(self):
+        return len(self.coords)
+
+    def save(self, filename):
+        """Saves the table to a (NumPy `.npz`) file."""
+        with open(filename, 'wb') as f:
+            np.savez(f, key=np.array(self.key), countries=self.countries, coords=self.coords,
+                     experiments=self.experiments, variants=self.variants)
+
+    @staticmethod
+    def load(filename, key):
+        """Loads a table from a file. Returns `None` if there is no file or if it was built with a different key."""
+        if not os.path.isfile(filename):
+            return None
+
+        with np.load(filename) as f:
+            if str(f['key']) != key:
+                return None
+            return UserProfiles(key, f['countries'], f['coords'], f['experiments'], f['variants'])
+
+
+def build_profiles(key, user_ids, country_offsets, country_counts, salt):
+    """
+    Builds profiles for the given (integer) user IDs. The country and A/B test of a user are consistent with
+    `simulate.random_geo` and `simulate.random_ab_test`. The location within a country is picked with a second hash,
+    salted by the simulation, so that a user always has the same location no matter which users are in the table.
+    """
+    user_ids = [str(x).encode('utf-8') for x in user_ids]
+
+    # the same as `simulate.stable_hash`
+    hashes = np.array([zlib.crc32(x) for x in user_ids], dtype=np.int64)
+    salted_hashes = np.array([zlib.crc32(x, salt) for x in user_ids], dtype=np.int64)
+
+    countries = (hashes % len(country_counts)).astype(np.uint8)
+    coords = (country_offsets[countries] + salted_hashes % country_counts[countries]).astype(np.int32)
+
+    experiments = (hashes % len(AB_EXPERIMENTS)).astype(np.uint8)
+    variants = ((hashes // len(AB_EXPERIMENTS)) % len(AB_VARIANTS)).astype(np.uint8)
+    variants[EXPERIMENT_NAMES[experiments] == 'none'] = NO_VARIANT
+
+    return UserProfiles(key, countries, coords, experiments, variants)
@@ -0,0 +1,229 @@
+"""
+Stage timings and profiling hooks for the `bin/` commands. Stages are timed with nested spans, e.g. `prepare`,
+`generate`, `load`, `refresh` and one span per transform, and can count documents, bytes and requests. Spans are
+recorded in a registry by path (e.g. `simulate/transforms/ecs-search-metrics_transform_queryid`), aggregated over
+all the times a stage runs, so that a whole run breaks down into stages without ad-hoc prints.
+
+Spans nest per thread. A span started in another thread (e.g. a transform run by a thread pool) can name its parent
+explicitly. Spans in worker processes are not recorded, only what the main process counts from their reports.
+
+With `--profile` or `--trace-memory` (see `add_arguments`), a command runs under `profiled`, which also collects
+function timings with cProfile (of the main thread) and allocations with tracemalloc, and prints them after the
+stage breakdown: the top functions by cumulative time, and the top allocators by size still allocated.
+"""
+
+import contextlib
+import cProfile
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from timeit import default_timer as timer
+
+DEFAULT_TOP = 20
+SEPARATOR = '/'
+
+MB = 1024 * 1024
+
+
+class Span:
+    """The aggregate of all the times a stage ran: number of calls, total duration, counters and memory change."""
+
+    def __init__(self, path, started):
+        self.path = path
+        self.started = started
+        self.num_calls = 0
+        self.interval = 0.0
+        self.memory = 0
+        self.counters = {}
+
+    @property
+    def name(self):
+        return self.path.rsplit(SEPARATOR, 1)[-1]
+
+    @property
+    def depth(self):
+        return self.path.count(SEPARATOR)
+
+    def to_dict(self):
+        return {'path': self.path, 'num_calls': self.num_calls, 'interval': self.interval, 'memory': self.memory,
+                **self.counters}
+
+
+class Registry:
+    """Spans by path, with a stack of open spans per thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spans = {}
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        """The path of the innermost open span of this thread, if any."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def _get(self, path):
+        with self.lock:
+            if path not in self.spans:
+                self.spans[path] = Span(path, timer())
+            return self.spans[path]
+
+    @contextlib.contextmanager
+    def span(self, name, parent=None):
+        """
+        Times a stage, nested in the innermost open span of this thread, or in `parent` (a path). Yields the path of
+        the span.
+        """
+        parent = parent or self.current()
+        path = f'{parent}{SEPARATOR}{name}' if parent else name
+        span = self._get(path)
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+        stack = self._stack()
+        stack.append(path)
+        start = timer()
+        try:
+            yield path
+        finally:
+            interval = timer() - start
+            stack.pop()
+            with self.lock:
+                span.num_calls += 1
+                span.interval += interval
+                if tracemalloc.is_tracing():
+                    span.memory += tracemalloc.get_traced_memory()[0] - memory
+
+    def count(self, path=None, **counters):
+        """Adds to counters (e.g. `docs`, `bytes`, `requests`) of a span, by default the innermost open span."""
+        path = path or self.current()
+        if not path:
+            return
+        span = self._get(path)
+        with self.lock:
+            for name, value in counters.items():
+                span.counters[name] = span.counters.get(name, 0) + value
+
+    def sorted_spans(self):
+        """Spans in tree order, with children after their parent, in the order they first started."""
+        with self.lock:
+            spans = dict(self.spans)
+
+        def key(span):
+            parts = span.path.split(SEPARATOR)
+            paths = [SEPARATOR.join(parts[:i + 1]) for i in range(len(parts))]
+            return [spans[x].started if x in spans else 0.0 for x in paths]
+
+        return sorted(spans.values(), key=key)
+
+    def print(self, file=None):
+        print("Stage timings:", file=file)
+        for span in self.sorted_spans():
+            line = f"{'  ' * span.depth} - {span.name}: {span.interval:.04f} sec"
+            if span.num_calls > 1:
+                line += f" ({span.num_calls} calls)"
+            for name, value in span.counters.items():
+                line += f", {value / MB:.1f} MB" if name == 'bytes' else f", {value} {name}"
+            if span.memory:
+                line += f", {span.memory / MB:+.1f} MB allocated"
+            print(line, file=file)
+
+
+REGISTRY = Registry()
+
+
+def span(name, parent=None):
+    """A span in the default registry, see `Registry.span`."""
+    return REGISTRY.span(name, parent)
+
+
+def count(path=None, **counters):
+    """Adds to counters of a span in the default registry, see `Registry.count`."""
+    REGISTRY.count(path, **counters)
+
+
+def current():
+    return REGISTRY.current()
+
+
+def add_arguments(parser):
+    """Adds `--profile`, `--profile-output` and `--trace-memory` to the arguments of a command."""
+    parser.add_argument('--profile', action='store_true',
+                        help="profile the run with cProfile, and print the stage timings and top functions")
+    parser.add_argument('--profile-output', metavar='FILE', default=None,
+                        help="also save the profile to a file, e.g. for snakeviz (implies --profile)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="trace memory allocations with tracemalloc, and print the stage timings and top "
+                             "allocators")
+
+
+def print_top_functions(profiler, top=DEFAULT_TOP, file=None):
+    print(f"Top {top} functions by cumulative time:", file=file)
+    stats = pstats.Stats(profiler, stream=file or sys.stdout)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+
+def print_top_allocators(snapshot, top=DEFAULT_TOP, file=None):
+    current, peak = tracemalloc.get_traced_memory()
+    print("Memory:", file=file)
+    print(f" - current: {current / MB:.1f} MB", file=file)
+    print(f" - peak: {peak / MB:.1f} MB", file=file)
+    print(f"Top {top} allocators:", file=file)
+    for stat in snapshot.statistics('lineno')[:top]:
+        frame = stat.traceback[0]
+        print(f" - {frame.filename}:{frame.lineno}: {stat.size / MB:.1f} MB ({stat.count} blocks)", file=file)
+
+
+@contextlib.contextmanager
+def profiled(name, profile=False, trace_memory=False, output=None, top=DEFAULT_TOP, registry=REGISTRY,
+             file=None):
+    """
+    Runs a command in a span, under cProfile with `profile` (saving the profile to `output`, if given) and tracemalloc
+    with `trace_memory`. Afterwards, even when the command failed or was interrupted, prints the stage timings, top
+    functions and top allocators to `file` (stderr, as some commands write events to stdout). Does nothing more than
+    the span without either option.
+    """
+    profile = profile or bool(output)
+    file = file or sys.stderr
+    if not profile and not trace_memory:
+        with registry.span(name):
+            yield
+        return
+
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        with registry.span(name):
+            yield
+    finally:
+        if profiler:
+            profiler.disable()
+        snapshot = tracemalloc.take_snapshot() if trace_memory else None
+
+        registry.print(file=file)
+        if profiler:
+            print_top_functions(profiler, top, file)
+            if output:
+                profiler.dump_stats(output)
+                print(f"Saved profile to: {output}", file=file)
+        if snapshot:
+            print_top_allocators(snapshot, top, file)
+            tracemalloc.stop()
+
+
+def profiled_command(name, args):
+    """Runs a command under `profiled`, with the options from its arguments (see `add_arguments`)."""
+    return profiled(name, args.profile, args.trace_memory, args.profile_output)
@@ -0,0 +1,70 @@
+"""
+Query strings for the batch simulation. Instead of generating a new query string for every query, a vocabulary of
+query strings is generated up front and queries are sampled from it with Zipf-like popularity. This gives a realistic
+number of distinct queries, with a few very popular head queries and a long tail of rare ones.
+"""
+
+import faker
+import numpy as np
+import sys
+
+DEFAULT_POOL_SIZE = 10000
+DEFAULT_SKEW = 1.0
+MAX_QUERY_WORDS = 8
+MIN_QUERY_WORDS = 3
+WORDS = np.array(faker.providers.lorem.en_US.Provider.word_list, dtype=object)
+
+
+def random_queries(rng, n):
+    """
+    Generate `n` random query strings of varying length, vectorized over the same word list and casing rules as
+    `simulate.random_query`: the first token is title cased and one random token is capitalized.
+    """
+    lengths = rng.integers(MIN_QUERY_WORDS, MAX_QUERY_WORDS + 1, size=n)
+    words = WORDS[rng.integers(0, len(WORDS), size=lengths.sum())]
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    # title case the first token, capitalize a random token
+    words[offsets[:-1]] = [x.title() for x in words[offsets[:-1]]]
+    capitalized = offsets[:-1] + (rng.random(n) * lengths).astype(np.int64)
+    words[capitalized] = [x.capitalize() for x in words[capitalized]]
+
+    return np.array([" ".join(words[start:end]) for (start, end) in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+def zipf_weights(size, skew):
+    """Popularity of each rank (starting at 1) proportional to `1 / rank ** skew`, normalized to sum to 1."""
+    weights = 1.0 / np.arange(1, size + 1) ** skew
+    return weights / weights.sum()
+
+
+class QueryPool:
+    """
+    A vocabulary of distinct, interned query strings in order of popularity. Sampling draws indices into the
+    vocabulary in bulk, using the cumulative distribution of Zipf weights.
+    """
+
+    def __init__(self, values, skew=DEFAULT_SKEW):
+        self.values = np.array([sys.intern(x) for x in values], dtype=object)
+        self.skew = skew
+        self.cdf = np.cumsum(zipf_weights(len(values), skew))
+
+    def __len__(self):
+        return len(self.values)
+
+    def sample(self, rng, n):
+        """Samples `n` indices into the vocabulary."""
+        return np.minimum(np.searchsorted(self.cdf, rng.random(n), side='right'), len(self.values) - 1)
+
+
+def build_query_pool(rng, size=DEFAULT_POOL_SIZE, skew=DEFAULT_SKEW, exclude=()):
+    """Generates a pool of `size` distinct random queries, none of which are in `exclude`."""
+    seen = set(exclude)
+    values = []
+    while len(values) < size:
+        for value in random_queries(rng, size - len(values)):
+            if value not in seen:
+                seen.add(value)
+                values.append(value)
+
+    return QueryPool(values, skew)
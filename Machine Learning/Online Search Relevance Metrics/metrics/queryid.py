@@ -0,0 +1,310 @@
+"""
+A client-side alternative to the `ecs-search-metrics_transform_queryid` transform and pipeline. Events (from NDJSON
+files or a simulation) are grouped by query ID and reduced to one document per query, the same as the documents the
+transform and its pipeline write to the `ecs-search-metrics_transform_queryid` index.
+
+Grouping is an external sort/merge that stays memory-bounded: events are reduced into partial metrics per query ID
+in memory, and whenever there are too many query IDs in memory, the partial metrics are sorted by query ID and spilled
+to a run file. The runs are then merged in query ID order, combining the partial metrics of each query ID. Since
+events of the same query are usually close together, most queries are complete in a single run. At most
+`MAX_FAN_IN` runs are open at a time: with more runs, groups of runs are first merged into intermediate runs, in as
+many passes as needed.
+"""
+
+import gzip
+import heapq
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+
+from elasticsearch import helpers
+from tqdm import tqdm
+
+from metrics import profiling
+from metrics.ingest import DEFAULT_CHUNK_SIZE, DEFAULT_THREAD_COUNT, BulkStats, parallel_bulk
+from metrics.resources import INDEX, Timer
+from metrics.timeline import timestamp_to_millis
+
+DEFAULT_MAX_QUERIES = 100000
+MAX_FAN_IN = 64
+QUERYID_INDEX = f'{INDEX}_transform_queryid'
+
+# fields of the partial metrics of a query
+(QUERY_EVENT, MAX_PAGE_REQUESTED, COUNT, COUNT_AT_3, COUNT_AT_10, MAX_RECIPROCAL_RANK, SUM_RECIPROCAL_RANK,
+ FIRST_CLICK_TIME, LAST_CLICK_TIME, MAX_PAGE_CLICKED, NUM_ABOVE_FOLD, NUM_BELOW_FOLD) = range(12)
+
+
+def _max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+def _min(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+
+def new_partial():
+    """Empty partial metrics of a query."""
+    return [None, None, 0, 0, 0, None, 0.0, None, None, None, 0, 0]
+
+
+def accumulate(partial, event):
+    """
+    Adds an event to the partial metrics of its query, the same as the aggregations of the transform. Click times are
+    compared as strings, which works for timestamps in the same format (see `simulate.time_to_timestamp`).
+    """
+    action = event['event']['action']
+    m = event['SearchMetrics']
+
+    if action == 'SearchMetrics.query':
+        partial[QUERY_EVENT] = event
+        partial[MAX_PAGE_REQUESTED] = _max(partial[MAX_PAGE_REQUESTED], m['query']['page'])
+    elif action == 'SearchMetrics.page':
+        partial[MAX_PAGE_REQUESTED] = _max(partial[MAX_PAGE_REQUESTED], m['query']['page'])
+    elif action == 'SearchMetrics.click':
+        result = m['click']['result']
+        rank = result['rank']
+        page = m['query']['page']
+
+        # the reciprocal rank is added by the ingest pipeline of the events index, when missing
+        reciprocal_rank = result.get('reciprocal_rank')
+        if reciprocal_rank is None:
+            reciprocal_rank = 1.0 / rank
+
+        partial[COUNT] += 1
+        partial[COUNT_AT_3] += rank <= 3
+        partial[COUNT_AT_10] += rank <= 10
+        partial[MAX_RECIPROCAL_RANK] = _max(partial[MAX_RECIPROCAL_RANK], reciprocal_rank)
+        partial[SUM_RECIPROCAL_RANK] += reciprocal_rank
+        partial[FIRST_CLICK_TIME] = _min(partial[FIRST_CLICK_TIME], event['@timestamp'])
+        partial[LAST_CLICK_TIME] = _max(partial[LAST_CLICK_TIME], event['@timestamp'])
+        partial[MAX_PAGE_CLICKED] = _max(partial[MAX_PAGE_CLICKED], page)
+        partial[NUM_ABOVE_FOLD] += page == 1
+        partial[NUM_BELOW_FOLD] += page > 1
+
+
+def combine(partial, other):
+    """Combines the partial metrics of the same query from two runs."""
+    if other[QUERY_EVENT] is not None:
+        partial[QUERY_EVENT] = other[QUERY_EVENT]
+    for i in (MAX_PAGE_REQUESTED, MAX_RECIPROCAL_RANK, LAST_CLICK_TIME, MAX_PAGE_CLICKED):
+        partial[i] = _max(partial[i], other[i])
+    for i in (COUNT, COUNT_AT_3, COUNT_AT_10, SUM_RECIPROCAL_RANK, NUM_ABOVE_FOLD, NUM_BELOW_FOLD):
+        partial[i] += other[i]
+    partial[FIRST_CLICK_TIME] = _min(partial[FIRST_CLICK_TIME], other[FIRST_CLICK_TIME])
+
+
+def _without_none(d):
+    return {k: v for k, v in d.items() if v is not None}
+
+
+def query_document(query_id, partial):
+    """
+    The per-query document, as written by the transform and its pipeline. Metrics without a value (e.g. reciprocal
+    ranks without clicks) are left out.
+    """
+    clicks = {
+        'count': partial[COUNT],
+        'max_reciprocal_rank': partial[MAX_RECIPROCAL_RANK],
+        'mean_reciprocal_rank': partial[SUM_RECIPROCAL_RANK] / partial[COUNT] if partial[COUNT] else None,
+        'max_page_clicked': partial[MAX_PAGE_CLICKED],
+        'num_above_fold': partial[NUM_ABOVE_FOLD],
+        'num_below_fold': partial[NUM_BELOW_FOLD],
+        'exist_at_3': partial[COUNT_AT_3] > 0,
+        'exist_at_10': partial[COUNT_AT_10] > 0,
+    }
+
+    doc = {
+        'SearchMetrics': {
+            'query': {
+                'id': query_id,
+            },
+        },
+        'metrics': {
+            'pages': _without_none({'max_page_requested': partial[MAX_PAGE_REQUESTED]}),
+        },
+    }
+
+    # without a query event there is nothing to measure click times from (the pipeline fails on these documents)
+    query_event = partial[QUERY_EVENT]
+    if query_event is not None:
+        doc['query_event'] = {k: v for k, v in query_event.items() if k != 'ecs'}
+        query_millis = timestamp_to_millis(query_event['@timestamp'])
+        if partial[FIRST_CLICK_TIME] is not None:
+            clicks['time_to_first_click'] = timestamp_to_millis(partial[FIRST_CLICK_TIME]) - query_millis
+            clicks['time_to_last_click'] = timestamp_to_millis(partial[LAST_CLICK_TIME]) - query_millis
+
+    doc['metrics']['clicks'] = _without_none(clicks)
+    return doc
+
+
+def _write_run(items, directory, run):
+    """Writes query IDs and their partial metrics, in query ID order, to a run file. Returns the filename."""
+    filename = os.path.join(directory, f'run-{run:05d}.ndjson')
+    with open(filename, 'w') as f:
+        for item in items:
+            f.write(json.dumps(item, separators=(',', ':')))
+            f.write('\n')
+    return filename
+
+
+def _spill(partials, directory, run):
+    """Writes partial metrics sorted by query ID to a run file. Returns the filename."""
+    return _write_run(([x, partials[x]] for x in sorted(partials)), directory, run)
+
+
+def _read_run(filename):
+    with open(filename, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _merge_runs(runs):
+    """Merges runs in query ID order, combining the partial metrics of each query ID."""
+    merged = heapq.merge(*[_read_run(x) for x in runs], key=lambda x: x[0])
+    for query_id, group in itertools.groupby(merged, key=lambda x: x[0]):
+        partial = new_partial()
+        for _, other in group:
+            combine(partial, other)
+        yield [query_id, partial]
+
+
+def _reduce_runs(runs, directory, max_fan_in=MAX_FAN_IN):
+    """Merges groups of runs into intermediate runs until at most `max_fan_in` runs are left. Returns the runs."""
+    num_runs = len(runs)
+    while len(runs) > max_fan_in:
+        merged = []
+        for i in range(0, len(runs), max_fan_in):
+            group = runs[i:i + max_fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.append(_write_run(_merge_runs(group), directory, num_runs))
+            num_runs += 1
+            for x in group:
+                os.remove(x)
+        runs = merged
+    return runs
+
+
+def query_documents(events, max_queries=DEFAULT_MAX_QUERIES, temp_dir=None, max_fan_in=MAX_FAN_IN):
+    """
+    Generates per-query documents from events (dictionaries or lines of JSON), in query ID order. At most
+    `max_queries` query IDs are kept in memory, any more are spilled to temporary run files in `temp_dir`, of which at
+    most `max_fan_in` are merged at a time.
+    """
+    partials = {}
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        runs = []
+        for event in events:
+            if isinstance(event, str):
+                event = json.loads(event)
+
+            query_id = event['SearchMetrics']['query']['id']
+            partial = partials.get(query_id)
+            if partial is None:
+                if len(partials) >= max_queries:
+                    runs.append(_spill(partials, directory, len(runs)))
+                    partials = {}
+                partial = partials[query_id] = new_partial()
+            accumulate(partial, event)
+
+        # everything fit in memory
+        if not runs:
+            for query_id in sorted(partials):
+                yield query_document(query_id, partials[query_id])
+            return
+
+        if partials:
+            runs.append(_spill(partials, directory, len(runs)))
+            partials = {}
+
+        for query_id, partial in _merge_runs(_reduce_runs(runs, directory, max_fan_in)):
+            yield query_document(query_id, partial)
+
+
+def iter_ndjson(filenames):
+    """Reads events from NDJSON files (gzip compressed when ending in `.gz`), or from stdin for `-`."""
+    for filename in filenames:
+        if filename == '-':
+            f = sys.stdin
+        elif filename.endswith('.gz'):
+            f = gzip.open(filename, 'rt')
+        else:
+            f = open(filename, 'r')
+        with f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def index_documents(es, docs, index=QUERYID_INDEX, thread_count=DEFAULT_THREAD_COUNT, chunk_size=DEFAULT_CHUNK_SIZE,
+                    with_progress=False):
+    """Bulk indexes per-query documents, with the query ID as document ID. Returns `ingest.BulkStats`."""
+
+    def actions():
+        for doc in docs:
+            yield {
+                '_index': index,
+                '_id': doc['SearchMetrics']['query']['id'],
+                '_source': doc,
+            }
+
+    stats = BulkStats()
+    results = parallel_bulk(es, actions(), thread_count=thread_count, chunk_size=chunk_size, stats=stats,
+                            request_timeout=600)
+    if with_progress:
+        results = tqdm(results, unit=' docs')
+
+    with profiling.span('index per-query documents'), Timer() as t:
+        for success, info in results:
+            stats.add(success, info)
+        profiling.count(docs=stats.num_docs)
+    stats.interval = t.interval
+
+    return stats
+
+
+def _normalized(value):
+    """Drops missing values, so that documents with `null` and missing metrics compare equal."""
+    if isinstance(value, dict):
+        return {k: _normalized(v) for k, v in value.items() if v is not None}
+    return value
+
+
+def _equal(a, b):
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and math.isclose(a, b, rel_tol=1e-6)
+    return a == b
+
+
+def compare_documents(expected, actual):
+    """
+    Compares per-query documents (e.g. from the transform, and from `query_documents`) by query ID. Returns the query
+    IDs that are missing, unexpected and different.
+    """
+    expected = {x['SearchMetrics']['query']['id']: _normalized(x) for x in expected}
+    missing = set(expected)
+    unexpected = set()
+    different = set()
+
+    for doc in actual:
+        query_id = doc['SearchMetrics']['query']['id']
+        if query_id not in expected:
+            unexpected.add(query_id)
+            continue
+        missing.discard(query_id)
+        if not _equal(expected[query_id], _normalized(doc)):
+            different.add(query_id)
+
+    return missing, unexpected, different
+
+
+def scan_documents(es, index):
+    """All documents in an index."""
+    for hit in helpers.scan(es, index=index, query={'query': {'match_all': {}}}):
+        yield hit['_source']
@@ -0,0 +1,210 @@
+"""
+Live replay of simulated events, for load testing ingest. Instead of indexing events as fast as possible, events are
+sent at a controlled pace through the ingest pipeline with bulk requests, either:
+
+ - at a fixed rate, with event times shifted to start now, keeping the time between the events of a query
+ - in simulated real time, optionally sped up, with event times shifted (and compressed) to start now
+
+Pacing runs on an asyncio event loop, while bulk requests are sent by a pool of threads with a bounded number of
+requests in flight. When Elasticsearch cannot keep up, sending falls behind schedule, which shows up as lag. For every
+event, the end-to-end indexing latency (from when the event is sent until its bulk request is acknowledged) is
+recorded, as well as the number of events rejected with HTTP 429 (e.g. full write queues) or otherwise failed.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import time
+
+import numpy as np
+
+from elasticsearch import TransportError
+
+from metrics import ndjson
+from metrics.resources import INDEX
+from metrics.timeline import MS_PER_SECOND, millis_to_timestamp, timestamp_to_millis
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CONCURRENCY = 4
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_RATE = 1000
+PERCENTILES = [50, 90, 99, 99.9]
+REJECTED_STATUS = 429
+
+# sleeping is only worth it when an event is due at least this far ahead (in seconds)
+MIN_SLEEP = 0.001
+
+
+def sorted_events(events):
+    """Sorts events by time, as needed to replay them in real time. All events are kept in memory."""
+    return sorted(events, key=lambda x: x['@timestamp'])
+
+
+class ReplayStats:
+    def __init__(self):
+        self.num_events = 0
+        self.num_failures = 0
+        self.num_rejected = 0
+        self.num_requests = 0
+        self.max_lag = 0.0
+        self.interval = 0.0
+        self.latencies = []
+
+    @property
+    def events_per_second(self):
+        return self.num_events / self.interval if self.interval else 0.0
+
+    def percentiles(self):
+        """End-to-end indexing latency percentiles, in ms."""
+        if not self.latencies:
+            return {p: 0.0 for p in PERCENTILES}
+        values = np.percentile(np.array(self.latencies) * 1000, PERCENTILES)
+        return dict(zip(PERCENTILES, values))
+
+    def print(self):
+        print(f" - events: {self.num_events}")
+        print(f" - bulk requests: {self.num_requests}")
+        print(f" - rejected: {self.num_rejected}")
+        print(f" - failures: {self.num_failures}")
+        print(f" - duration: {self.interval:.04f} sec")
+        print(f" - throughput: {self.events_per_second:.0f} events/sec")
+        print(f" - max lag: {self.max_lag * 1000:.0f} ms")
+        for p, value in self.percentiles().items():
+            print(f" - latency p{p}: {value:.0f} ms")
+
+
+def bulk_body(lines, index):
+    """A bulk request body to index lines of JSON into the index."""
+    action = json.dumps({'index': {'_index': index}})
+    return ''.join(f'{action}\n{x}\n' for x in lines)
+
+
+def send_bulk(es, lines, index=INDEX, pipeline=INDEX):
+    """Sends a bulk request. Returns the number of failed and rejected events."""
+    try:
+        response = es.bulk(body=bulk_body(lines, index), pipeline=pipeline, request_timeout=600)
+    except TransportError as e:
+        if e.status_code == REJECTED_STATUS:
+            return 0, len(lines)
+        return len(lines), 0
+
+    if not response['errors']:
+        return 0, 0
+
+    statuses = [x['index']['status'] for x in response['items']]
+    num_rejected = sum(1 for x in statuses if x == REJECTED_STATUS)
+    num_failures = sum(1 for x in statuses if x >= 300) - num_rejected
+    return num_failures, num_rejected
+
+
+def _take(iterator, n):
+    """Takes up to `n` items from an iterator."""
+    items = []
+    for item in iterator:
+        items.append(item)
+        if len(items) == n:
+            break
+    return items
+
+
+async def replay_events(es, events, rate=DEFAULT_RATE, speedup=None, index=INDEX, pipeline=INDEX,
+                        chunk_size=DEFAULT_CHUNK_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                        flush_interval=DEFAULT_FLUSH_INTERVAL, duration=None):
+    """
+    Replays events (dictionaries) into Elasticsearch and returns `ReplayStats`.
+
+    Events are sent at `rate` events per second, or with `speedup`, in simulated real time sped up by that factor, in
+    which case events must be in time order (see `sorted_events`). Events are sent in bulk requests of `chunk_size`
+    events, or fewer when the oldest event has waited `flush_interval` seconds, with at most `concurrency` requests in
+    flight. With `duration`, replay stops after that many seconds.
+    """
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = ReplayStats()
+    requests = set()
+
+    async def send(lines, sent_times):
+        try:
+            num_failures, num_rejected = await loop.run_in_executor(executor, send_bulk, es, lines, index, pipeline)
+        finally:
+            semaphore.release()
+        acknowledged = time.monotonic()
+        stats.num_requests += 1
+        stats.num_failures += num_failures
+        stats.num_rejected += num_rejected
+        stats.latencies.extend(acknowledged - x for x in sent_times)
+
+    async def flush():
+        nonlocal lines, sent_times
+        if not lines:
+            return
+        await semaphore.acquire()
+        request = asyncio.ensure_future(send(lines, sent_times))
+        requests.add(request)
+        request.add_done_callback(requests.discard)
+        lines = []
+        sent_times = []
+
+    lines = []
+    sent_times = []
+    start = time.monotonic()
+    start_millis = int(time.time() * MS_PER_SECOND)
+    first_millis = None
+    i = 0
+    done = False
+
+    # events are generated in another thread, one chunk ahead of sending
+    iterator = iter(events)
+    pending = loop.run_in_executor(None, _take, iterator, chunk_size)
+    while not done:
+        chunk = await pending
+        if not chunk:
+            break
+        pending = loop.run_in_executor(None, _take, iterator, chunk_size)
+
+        for event in chunk:
+            millis = timestamp_to_millis(event['@timestamp'])
+            if first_millis is None:
+                first_millis = millis
+            if speedup:
+                due = (millis - first_millis) / MS_PER_SECOND / speedup
+            else:
+                due = i / rate
+
+            if duration is not None and due >= duration:
+                done = True
+                break
+
+            # flush instead of waiting past the flush interval, then wait until the event is due
+            if lines and due > sent_times[0] - start + flush_interval:
+                await flush()
+            wait = start + due - time.monotonic()
+            if wait >= MIN_SLEEP:
+                await asyncio.sleep(wait)
+
+            now = time.monotonic()
+            stats.max_lag = max(stats.max_lag, now - start - due)
+            # only pacing changes with the rate, event times are shifted by a constant offset, so that e.g. the time
+            # from a query to its clicks is kept
+            if speedup:
+                event_millis = start_millis + int((millis - first_millis) / speedup)
+            else:
+                event_millis = start_millis + millis - first_millis
+            event = dict(event, **{'@timestamp': millis_to_timestamp(event_millis)})
+
+            lines.append(ndjson.encode_event(event))
+            sent_times.append(now)
+            stats.num_events += 1
+            i += 1
+
+            if len(lines) >= chunk_size or now - sent_times[0] >= flush_interval:
+                await flush()
+
+    await flush()
+    if requests:
+        await asyncio.gather(*requests)
+    executor.shutdown()
+    stats.interval = time.monotonic() - start
+
+    return stats
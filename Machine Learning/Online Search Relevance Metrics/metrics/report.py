@@ -0,0 +1,205 @@
+"""
+Headline metrics from the `ecs-search-metrics_transform_queryid` index, computed server-side with aggregations rather
+than by pulling per-query documents to the client. Metrics are broken down by page name and day with a composite
+aggregation, and are also computed over all queries:
+
+ - zero result rate: the share of queries without results
+ - click-through rate: the share of queries with results that have at least one click, and (CTR@3) the share of
+   queries with clicks that have a click in the top 3 results
+ - abandonment rate: the share of queries that have results but no clicks
+ - max and mean reciprocal rank: the mean over queries with clicks of the reciprocal rank of the best clicked result,
+   and of the mean reciprocal rank of all clicked results
+ - time to first click: the mean and percentiles, in milliseconds, over queries with clicks
+ - paging rate: the share of queries for which a second page (or beyond) was requested
+
+These follow the definitions of the "Metrics with eland" notebook.
+
+All buckets usually fit in a single page of the composite aggregation, so a report takes a single request. Reports
+can be cached in a JSON file, and are reused while they are younger than a maximum age and were made with the same
+parameters.
+"""
+
+import json
+import os
+import time
+
+from metrics.resources import QUERYID_TRANSFORM
+
+DEFAULT_MAX_AGE = 300.0
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_TIME_ZONE = 'UTC'
+PERCENTS = [50, 90, 99]
+
+PAGE_NAME_FIELD = 'query_event.SearchMetricsSimulation.page_name.keyword'
+TIMESTAMP_FIELD = 'query_event.@timestamp'
+
+
+def metrics_aggs():
+    """Aggregations for the metrics of a set of queries."""
+    return {
+        'with_results': {'filter': {'range': {'query_event.SearchMetrics.results.size': {'gt': 0}}}},
+        'with_results_and_clicks': {'filter': {'bool': {'filter': [
+            {'range': {'query_event.SearchMetrics.results.size': {'gt': 0}}},
+            {'range': {'metrics.clicks.count': {'gt': 0}}},
+        ]}}},
+        'with_clicks_at_3': {'filter': {'term': {'metrics.clicks.exist_at_3': True}}},
+        'paged': {'filter': {'range': {'metrics.pages.max_page_requested': {'gt': 1}}}},
+        'max_reciprocal_rank': {'avg': {'field': 'metrics.clicks.max_reciprocal_rank'}},
+        'mean_reciprocal_rank': {'avg': {'field': 'metrics.clicks.mean_reciprocal_rank'}},
+        'time_to_first_click': {'stats': {'field': 'metrics.clicks.time_to_first_click'}},
+        'time_to_first_click_percentiles': {
+            'percentiles': {'field': 'metrics.clicks.time_to_first_click', 'percents': PERCENTS},
+        },
+    }
+
+
+def report_body(start=None, end=None, time_zone=DEFAULT_TIME_ZONE, page_size=DEFAULT_PAGE_SIZE, after=None):
+    """
+    A search request body for a page of the report. The metrics over all queries are only requested on the first
+    page, i.e. without `after`.
+    """
+    composite = {
+        'size': page_size,
+        'sources': [
+            {'page_name': {'terms': {'field': PAGE_NAME_FIELD, 'missing_bucket': True}}},
+            {'day': {'date_histogram': {'field': TIMESTAMP_FIELD, 'calendar_interval': '1d', 'format': 'yyyy-MM-dd',
+                                        'time_zone': time_zone}}},
+        ],
+    }
+    if after:
+        composite['after'] = after
+
+    aggs = {'buckets': {'composite': composite, 'aggs': metrics_aggs()}}
+    if not after:
+        aggs.update(metrics_aggs())
+
+    body = {'size': 0, 'track_total_hits': True, 'aggs': aggs}
+    if start or end:
+        timestamps = {'time_zone': time_zone}
+        if start:
+            timestamps['gte'] = start
+        if end:
+            timestamps['lt'] = end
+        body['query'] = {'range': {TIMESTAMP_FIELD: timestamps}}
+    return body
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+
+def bucket_metrics(bucket, num_queries):
+    """The metrics from the aggregations of a set of queries (see `metrics_aggs`)."""
+    num_with_results = bucket['with_results']['doc_count']
+    num_with_clicks = bucket['with_results_and_clicks']['doc_count']
+    time_to_first_click = bucket['time_to_first_click']
+    percentiles = bucket['time_to_first_click_percentiles']['values']
+    return {
+        'num_queries': num_queries,
+        'num_with_results': num_with_results,
+        'num_with_clicks': num_with_clicks,
+        'zero_result_rate': _ratio(num_queries - num_with_results, num_queries),
+        'click_through_rate': _ratio(num_with_clicks, num_with_results),
+        'click_through_rate_at_3': _ratio(bucket['with_clicks_at_3']['doc_count'], num_with_clicks),
+        'abandonment_rate': _ratio(num_with_results - num_with_clicks, num_queries),
+        'max_reciprocal_rank': bucket['max_reciprocal_rank']['value'],
+        'mean_reciprocal_rank': bucket['mean_reciprocal_rank']['value'],
+        'time_to_first_click': {
+            'avg': time_to_first_click['avg'],
+            'min': time_to_first_click['min'],
+            'max': time_to_first_click['max'],
+            **{f'p{p}': percentiles.get(f'{float(p)}') for p in PERCENTS},
+        },
+        'paging_rate': _ratio(bucket['paged']['doc_count'], num_queries),
+    }
+
+
+def report(es, index=QUERYID_TRANSFORM, start=None, end=None, time_zone=DEFAULT_TIME_ZONE,
+           page_size=DEFAULT_PAGE_SIZE):
+    """
+    Computes the metrics over all queries (between `start` and `end`, if given) and by page name and day. Pages
+    through the composite aggregation, with one request per `page_size` buckets.
+    """
+    result = {
+        'index': index,
+        'params': report_params(start, end, time_zone),
+        'created': time.time(),
+        'total': None,
+        'buckets': [],
+        'num_requests': 0,
+    }
+    after = None
+    while True:
+        response = es.search(index=index, body=report_body(start, end, time_zone, page_size, after))
+        result['num_requests'] += 1
+        aggs = response['aggregations']
+        if result['total'] is None:
+            result['total'] = bucket_metrics(aggs, response['hits']['total']['value'])
+
+        for bucket in aggs['buckets']['buckets']:
+            result['buckets'].append(dict(bucket['key'], **bucket_metrics(bucket, bucket['doc_count'])))
+
+        after = aggs['buckets'].get('after_key')
+        if not after or len(aggs['buckets']['buckets']) < page_size:
+            break
+    return result
+
+
+def report_params(start=None, end=None, time_zone=DEFAULT_TIME_ZONE):
+    return {'start': start, 'end': end, 'time_zone': time_zone}
+
+
+def load_cached(filename, index, params, max_age=DEFAULT_MAX_AGE, now=None):
+    """A cached report, if it exists, is for the same index and parameters, and is younger than `max_age` seconds."""
+    try:
+        with open(filename, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    now = time.time() if now is None else now
+    if cached.get('index') != index or cached.get('params') != params or now - cached.get('created', 0) > max_age:
+        return None
+    return cached
+
+
+def save(result, filename):
+    """Saves a report as JSON, replacing any previous report atomically."""
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_filename, filename)
+
+
+def cached_report(es, filename, max_age=DEFAULT_MAX_AGE, index=QUERYID_TRANSFORM, start=None, end=None,
+                  time_zone=DEFAULT_TIME_ZONE, page_size=DEFAULT_PAGE_SIZE):
+    """A report from the cache file when fresh (see `load_cached`), or else a new report, which is then cached."""
+    cached = load_cached(filename, index, report_params(start, end, time_zone), max_age)
+    if cached:
+        cached['cached'] = True
+        return cached
+
+    result = report(es, index, start, end, time_zone, page_size)
+    save(result, filename)
+    result['cached'] = False
+    return result
+
+
+def _format(value, fmt):
+    return '-' if value is None else format(value, fmt)
+
+
+def print_report(result):
+    """Prints a report as a table, with the metrics over all queries last."""
+    rows = [(x['page_name'] or '-', x['day'], x) for x in result['buckets']]
+    rows.append(('all', '', result['total']))
+
+    print(f"{'page name':<24}{'day':<12}{'queries':>10}{'ZRR':>8}{'CTR':>8}{'CTR@3':>8}{'abandon':>9}{'MaxRR':>7}"
+          f"{'MRR':>7}{'TTFC p50':>10}{'TTFC p90':>10}{'paging':>8}")
+    for page_name, day, x in rows:
+        ttfc = x['time_to_first_click']
+        print(f"{page_name:<24}{day:<12}{x['num_queries']:>10}{_format(x['zero_result_rate'], '.1%'):>8}"
+              f"{_format(x['click_through_rate'], '.1%'):>8}{_format(x['click_through_rate_at_3'], '.1%'):>8}"
+              f"{_format(x['abandonment_rate'], '.1%'):>9}{_format(x['max_reciprocal_rank'], '.3f'):>7}"
+              f"{_format(x['mean_reciprocal_rank'], '.3f'):>7}{_format(ttfc['p50'], ',.0f'):>10}"
+              f"{_format(ttfc['p90'], ',.0f'):>10}{_format(x['paging_rate'], '.1%'):>8}")
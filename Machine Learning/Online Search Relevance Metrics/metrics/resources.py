@@ -1,14 +1,45 @@
+import concurrent.futures
+import functools
+import hashlib
 import json
 import os
 import time
 
 from timeit import default_timer as timer
 
+from metrics import profiling
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+DEFAULT_MAX_WORKERS = 8
 IGNORES = [400, 404]
 INDEX = 'ecs-search-metrics'
 TRANSFORM_NAMES = [f'{INDEX}_transform_queryid', f'{INDEX}_transform_completion']
 INDEX_NAMES = [INDEX] + TRANSFORM_NAMES
-PIPELINE_NAMES = INDEX_NAMES
+
+# alternative configs of a transform, by variant
+QUERYID_TRANSFORM = f'{INDEX}_transform_queryid'
+DEFAULT_VARIANT = 'scripted'
+TRANSFORM_VARIANTS = {
+    QUERYID_TRANSFORM: {
+        'scripted': QUERYID_TRANSFORM,
+        'native': f'{QUERYID_TRANSFORM}_native',
+    },
+}
+VARIANTS = list(TRANSFORM_VARIANTS[QUERYID_TRANSFORM])
+PIPELINE_NAMES = INDEX_NAMES + [f'{QUERYID_TRANSFORM}_native']
+
+# continuous transforms
+DEFAULT_FREQUENCY = '1s'
+DEFAULT_SYNC_DELAY = '1s'
+DEFAULT_SYNC_FIELD = '@timestamp'
+SYNC_FIELDS = {
+    f'{INDEX}_transform_completion': 'query_event.@timestamp',
+}
+
+# polling transform stats, in seconds
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 5.0
+POLL_BACKOFF = 1.5
 
 
 class Timer:
@@ -41,9 +72,37 @@ def load_json(filename):
         return json.load(f)
 
 
+@functools.lru_cache(maxsize=None)
+def _read_config(kind, name):
+    with open(os.path.join(CONFIG_DIR, kind, f'{name}.json'), 'r') as f:
+        return f.read()
+
+
 def load_config(kind, name):
-    f = os.path.join('config', kind, f'{name}.json')
-    return load_json(f)
+    """Loads a config file from the `config` directory of the project. Files are only read once."""
+    return json.loads(_read_config(kind, name))
+
+
+def config_hash(body):
+    """A hash of a config body, independent of key order and formatting."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _with_hash(body, h):
+    """
+    Adds the config hash to the metadata (`_meta`) of a config body. Pipelines and transforms only accept `_meta` from
+    Elasticsearch 7.16, so only `provision` stores hashes in them, and `prepare` creates them as configured.
+    """
+    body = dict(body)
+    body['_meta'] = dict(body.get('_meta', {}), config_hash=h)
+    return body
+
+
+def index_config(name):
+    """Loads an index config, with the hash of the config in the metadata of the mappings."""
+    body = load_config('indices', name)
+    body['mappings'] = _with_hash(body.get('mappings', {}), config_hash(body))
+    return body
 
 
 def delete_index(es, name):
@@ -56,7 +115,7 @@ def recreate_index(es, name):
     """Creates a new index, deleting any existing index."""
     delete_index(es, name)
     print(f"Creating new index: {name}")
-    es.indices.create(name, body=load_config('indices', name))
+    es.indices.create(name, body=index_config(name))
 
 
 def recreate_indices(es, names):
@@ -69,51 +128,234 @@ def delete_transform(es, name):
     es.transform.delete_transform(name, ignore=IGNORES)
 
 
-def create_transform(es, name):
-    print(f"Creating new transform: {name}")
-    with open(os.path.join('config', 'transforms', f'{name}.json'), 'r') as f:
-        transform = json.load(f)
-    es.transform.put_transform(name, transform)
+def transform_config_name(name, variant=DEFAULT_VARIANT):
+    """
+    The name of the config file of a variant of a transform. The `scripted` variant of the queryid transform collects
+    the query event with a `scripted_metric` aggregation, while the `native` variant uses `top_metrics` (which only
+    supports single-valued fields with doc values, see the README).
+    """
+    variants = TRANSFORM_VARIANTS.get(name, {})
+    if variants and variant not in variants:
+        raise ValueError(f"unknown variant of transform {name}: {variant}, expected one of: {', '.join(variants)}")
+    return variants.get(variant, name)
 
 
-def recreate_transform(es, name):
+def transform_config(name, continuous=False, frequency=DEFAULT_FREQUENCY, delay=DEFAULT_SYNC_DELAY,
+                     variant=DEFAULT_VARIANT):
+    """
+    Loads a transform config. A continuous transform syncs on the timestamp of the source documents, checking for
+    changes at the given frequency. Only source documents with timestamps later than the last checkpoint (minus the
+    delay) are picked up, e.g. events from `bin/simulate live`.
+    """
+    transform = load_config('transforms', transform_config_name(name, variant))
+    if continuous:
+        transform['frequency'] = frequency
+        transform['sync'] = {
+            'time': {
+                'field': SYNC_FIELDS.get(name, DEFAULT_SYNC_FIELD),
+                'delay': delay,
+            },
+        }
+    return transform
+
+
+def create_transform(es, name, continuous=False, frequency=DEFAULT_FREQUENCY, delay=DEFAULT_SYNC_DELAY,
+                     variant=DEFAULT_VARIANT):
+    kind = 'continuous' if continuous else 'batch'
+    print(f"Creating new {kind} transform: {name} ({transform_config_name(name, variant)})")
+    es.transform.put_transform(name, transform_config(name, continuous, frequency, delay, variant))
+
+
+def recreate_transform(es, name, **kwargs):
     """Creates transform, deleting any existing transform."""
     delete_transform(es, name)
-    create_transform(es, name)
+    create_transform(es, name, **kwargs)
 
 
-def recreate_transforms(es, names):
+def recreate_transforms(es, names, **kwargs):
     for name in names:
-        recreate_transform(es, name)
+        recreate_transform(es, name, **kwargs)
 
 
-def get_transform_state(es, name):
+def get_transform_stats(es, name):
     response = es.transform.get_transform_stats(name)
     assert response['count'] == 1
-    return response['transforms'][0]['state']
+    return response['transforms'][0]
+
+
+def get_transform_state(es, name):
+    return get_transform_stats(es, name)['state']
+
+
+def is_continuous_transform(es, name):
+    response = es.transform.get_transform(name)
+    assert response['count'] == 1
+    return 'sync' in response['transforms'][0]
 
 
-def start_transform(es, name):
-    print(f"Starting batch transform: {name}")
-    es.transform.start_transform(name)
+def is_transform_done(stats, continuous):
+    """
+    Whether a batch transform has completed its checkpoint and stopped, or a continuous transform has completed a
+    checkpoint and caught up with all changes in its source.
+    """
+    checkpointing = stats['checkpointing']
+    if checkpointing.get('last', {}).get('checkpoint', 0) < 1:
+        return False
+    if continuous:
+        return 'next' not in checkpointing and checkpointing.get('operations_behind', 0) == 0
+    return stats['state'] == 'stopped'
 
-    time.sleep(1)
-    state = get_transform_state(es, name)
 
-    if state != 'stopped':
-        print(f"Waiting for batch transform: {name} ", end='')
-        while state != 'stopped':
-            print(".", end='')
-            time.sleep(5)
-            state = get_transform_state(es, name)
+def wait_for_transform(es, name, continuous=False, timeout=None, with_progress=True):
+    """
+    Waits for a transform to be done (see `is_transform_done`), printing progress as documents processed and indexed
+    per second. Transform stats are polled at short intervals at first, backing off while there is no progress.
+    Returns the final transform stats.
+    """
+    start = timer()
+    interval = MIN_POLL_INTERVAL
+    stats = get_transform_stats(es, name)
+    first = stats['stats']
+    last_processed = first['documents_processed']
+
+    while not is_transform_done(stats, continuous):
+        if stats['state'] == 'failed':
+            raise RuntimeError(f"Transform failed: {name}: {stats.get('reason')}")
+        if timeout is not None and timer() - start > timeout:
+            raise TimeoutError(f"Timed out waiting for transform: {name}")
+
+        time.sleep(interval)
+        stats = get_transform_stats(es, name)
+
+        processed = stats['stats']['documents_processed']
+        if processed == last_processed:
+            interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+        last_processed = processed
+
+        if not with_progress:
+            continue
+        elapsed = timer() - start
+        num_processed = processed - first['documents_processed']
+        num_indexed = stats['stats']['documents_indexed'] - first['documents_indexed']
+        print(f" - processed: {num_processed} ({num_processed / elapsed:.0f} docs/sec), "
+              f"indexed: {num_indexed} ({num_indexed / elapsed:.0f} docs/sec)", end='\r')
+
+    if with_progress:
         print()
+    return stats
+
+
+def start_transform(es, name, wait=True, with_progress=True):
+    """
+    Starts a transform and waits for it to be done. A continuous transform that is already running is not started
+    again, but instead picks up new source documents at its next checkpoint, which is waited for.
+    """
+    continuous = is_continuous_transform(es, name)
+    state = get_transform_state(es, name)
+
+    if continuous and state in ('started', 'indexing'):
+        print(f"Waiting for continuous transform: {name}")
+    else:
+        print(f"Starting {'continuous' if continuous else 'batch'} transform: {name}")
+        es.transform.start_transform(name)
+
+    if wait:
+        wait_for_transform(es, name, continuous, with_progress=with_progress)
+        with profiling.span('refresh'):
+            es.indices.refresh(name)
+        print(f"Done with transform: {name}")
+
 
-    es.indices.refresh(name)
+def load_manifest():
+    """Loads the transforms manifest, with the transforms each transform depends on (reads from)."""
+    return load_config('transforms', 'manifest')
 
 
-def start_transforms(es, names):
+def transform_levels(names, manifest):
+    """
+    Groups transforms into levels, where every transform only depends on transforms in earlier levels. Dependencies
+    that are not in `names` are assumed to be done already.
+    """
+    dependencies = {x: set(manifest.get(x, {}).get('depends_on', [])) & set(names) for x in names}
+    levels = []
+    done = set()
+    while len(done) < len(names):
+        level = [x for x in names if x not in done and dependencies[x] <= done]
+        if not level:
+            raise ValueError(f"Cyclic transform dependencies: {', '.join(x for x in names if x not in done)}")
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+def _run_transform(es, name, start, with_progress, parent=None):
+    started = timer() - start
+    with profiling.span(name, parent):
+        start_transform(es, name, with_progress=with_progress)
+    return started, timer() - start
+
+
+def print_transform_timings(timings, interval):
+    print("Transform timings:")
+    for name, (started, finished) in sorted(timings.items(), key=lambda x: x[1]):
+        print(f" - {name}: {finished - started:.04f} sec (from {started:.04f} to {finished:.04f} sec)")
+    print(f" - total: {interval:.04f} sec")
+
+
+def run_transforms(es, names, manifest=None):
+    """
+    Starts transforms and waits for them to be done, following the dependencies in the manifest. Independent
+    transforms run concurrently, and a transform is started as soon as all transforms it depends on are done. Prints
+    and returns the start and end time (in seconds from the start) per transform.
+    """
+    manifest = load_manifest() if manifest is None else manifest
+    levels = transform_levels(names, manifest)
+
+    # progress is only shown when transforms run one at a time
+    with_progress = all(len(x) == 1 for x in levels)
+
+    start = timer()
+    timings = {}
+    errors = []
+    with profiling.span('transforms') as parent, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(len(x) for x in levels)) as executor:
+        running = {}
+
+        def start_ready():
+            for name in names:
+                if name in timings or name in running.values():
+                    continue
+                dependencies = set(manifest.get(name, {}).get('depends_on', [])) & set(names)
+                if all(x in timings for x in dependencies):
+                    running[executor.submit(_run_transform, es, name, start, with_progress, parent)] = name
+
+        start_ready()
+        while running:
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except Exception as e:
+                    errors.append(e)
+
+            # do not start any more transforms after a failure
+            if not errors:
+                start_ready()
+
+    print_transform_timings(timings, timer() - start)
+    if errors:
+        raise errors[0]
+
+    return timings
+
+
+def start_transforms(es, names, wait=True):
+    """Starts transforms, and when waiting, runs them following their dependencies (see `run_transforms`)."""
+    if wait:
+        return run_transforms(es, names)
     for name in names:
-        start_transform(es, name)
+        start_transform(es, name, wait=False)
 
 
 def create_pipeline(es, name):
@@ -126,11 +368,111 @@ def recreate_pipelines(es, names):
         create_pipeline(es, name)
 
 
-def prepare(es, index_names=INDEX_NAMES, pipeline_names=PIPELINE_NAMES, transform_names=TRANSFORM_NAMES):
-    """Prepares resources: indices, pipelines, transforms"""
+def prepare(es, index_names=INDEX_NAMES, pipeline_names=PIPELINE_NAMES, transform_names=TRANSFORM_NAMES,
+            continuous=False, frequency=DEFAULT_FREQUENCY, variant=DEFAULT_VARIANT):
+    """Prepares resources: indices, pipelines, transforms (batch, or continuous, and of the given variant)"""
+
+    with profiling.span('prepare'):
+        with profiling.span('indices'):
+            recreate_indices(es, index_names)
+        with profiling.span('pipelines'):
+            recreate_pipelines(es, pipeline_names)
+        with profiling.span('transforms'):
+            recreate_transforms(es, transform_names, continuous=continuous, frequency=frequency, variant=variant)
+            for x in transform_names:
+                delete_index(es, f'{x}_failed')
+
+
+def _stored_index_hash(es, name):
+    response = es.indices.get_mapping(index=name, ignore=404)
+    if name not in response:
+        return None
+    return response[name]['mappings'].get('_meta', {}).get('config_hash')
+
+
+def _stored_pipeline_hash(es, name):
+    response = es.ingest.get_pipeline(id=name, ignore=404)
+    if name not in response:
+        return None
+    return response[name].get('_meta', {}).get('config_hash')
+
+
+def _stored_transform_hash(es, name):
+    response = es.transform.get_transform(transform_id=name, ignore=404)
+    if not response.get('transforms'):
+        return None
+    return response['transforms'][0].get('_meta', {}).get('config_hash')
+
 
-    recreate_indices(es, index_names)
-    recreate_pipelines(es, pipeline_names)
-    recreate_transforms(es, transform_names)
-    for x in transform_names:
-        delete_index(es, f'{x}_failed')
+def provision_index(es, name):
+    """Creates an index unless it exists with the same config. Returns whether the index was (re)created."""
+    body = index_config(name)
+    if _stored_index_hash(es, name) == body['mappings']['_meta']['config_hash']:
+        return False
+
+    print(f"Creating new index: {name}")
+    es.indices.delete(name, ignore=IGNORES)
+    es.indices.create(name, body=body)
+    return True
+
+
+def provision_pipeline(es, name):
+    """Creates a pipeline unless it exists with the same config. Returns whether the pipeline was (re)created."""
+    body = load_config('pipelines', name)
+    h = config_hash(body)
+    if _stored_pipeline_hash(es, name) == h:
+        return False
+
+    print(f"Creating pipeline: {name}")
+    es.ingest.put_pipeline(name, body=_with_hash(body, h))
+    return True
+
+
+def provision_transform(es, name, force=False, continuous=False, frequency=DEFAULT_FREQUENCY,
+                        variant=DEFAULT_VARIANT):
+    """
+    Creates a transform unless it exists with the same config, or with `force` (e.g. when its source or destination
+    index was recreated). Returns whether the transform was (re)created.
+    """
+    body = transform_config(name, continuous, frequency, variant=variant)
+    h = config_hash(body)
+    if not force and _stored_transform_hash(es, name) == h:
+        return False
+
+    kind = 'continuous' if continuous else 'batch'
+    print(f"Creating new {kind} transform: {name} ({transform_config_name(name, variant)})")
+    es.transform.delete_transform(name, force=True, ignore=IGNORES)
+    es.transform.put_transform(name, _with_hash(body, h))
+    return True
+
+
+def _changed(names, futures):
+    """The names for which the futures returned `True`."""
+    return [name for name, future in zip(names, futures) if future.result()]
+
+
+def provision(es, index_names=INDEX_NAMES, pipeline_names=PIPELINE_NAMES, transform_names=TRANSFORM_NAMES,
+              continuous=False, frequency=DEFAULT_FREQUENCY, variant=DEFAULT_VARIANT, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Prepares resources idempotently: only resources whose config changed since they were created are (re)created,
+    which is detected with a hash of the config that is stored in the metadata (`_meta`) of each resource. Existing
+    indices with an unchanged config are kept, with their data. Calls are made concurrently, first for indices and
+    pipelines and then for the transforms that use them. Returns the names of the resources that were (re)created.
+    """
+    with profiling.span('provision'), concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        indices = [executor.submit(provision_index, es, x) for x in index_names]
+        pipelines = [executor.submit(provision_pipeline, es, x) for x in pipeline_names]
+        indices = _changed(index_names, indices)
+        pipelines = _changed(pipeline_names, pipelines)
+
+        # transforms read from and write to indices, which are gone when those were recreated
+        transforms = []
+        for name in transform_names:
+            transform = load_config('transforms', transform_config_name(name, variant))
+            force = transform['source']['index'] in indices or transform['dest']['index'] in indices
+            transforms.append(executor.submit(provision_transform, es, name, force, continuous, frequency, variant))
+        transforms = _changed(transform_names, transforms)
+
+    if not (indices or pipelines or transforms):
+        print("All resources are up to date")
+    return indices + pipelines + transforms
@@ -1,10 +1,15 @@
 import datetime
 import faker
+import numpy as np
 import random
 import uuid
+import zlib
 
 from tqdm import tqdm
 
+from metrics.events import ClickEvent, PageEvent, QueryEvent
+from metrics.ndjson import ECS_VERSION
+
 AB_EXPERIMENTS = ['alpha', 'beta', None]
 AB_VARIANTS = ['control', 'a', 'b']
 COUNTRIES_ALL = sorted(list(set(
@@ -12,7 +17,6 @@ COUNTRIES_ALL = sorted(list(set(
 )))
 COUNTRIES = random.sample(COUNTRIES_ALL, 5)
 DATE = datetime.date(2019, 11, 15)
-ECS_VERSION = '1.6.0-dev'
 FAKE = faker.Faker()
 MAX_CLICKS_PER_QUERY = 5
 MAX_NUM_RESULTS = 100
@@ -33,6 +37,14 @@ def string_ids(ids):
     return [str(x) for x in ids]
 
 
+def stable_hash(user_id):
+    """
+    A hash of the user ID that is the same in every process, unlike the built-in (salted) `hash`. This keeps users
+    consistent when the simulation is split across processes.
+    """
+    return zlib.crc32(str(user_id).encode('utf-8'))
+
+
 def time_to_timestamp(time):
     """Converts from a datetime to a string timestamp in a standard ISO 8601 format, with Z timezone for UTC."""
     return time.isoformat(sep='T', timespec='milliseconds') + "Z"
@@ -67,15 +79,16 @@ def random_geo(user_id):
     Generate a consistent random ISO country code based on the user ID. Then generate a random location within that
     country.
     """
-    idx = hash(user_id) % len(COUNTRIES)
+    idx = stable_hash(user_id) % len(COUNTRIES)
     (lat, lon, city, country_code, tz) = FAKE.local_latlng(country_code=COUNTRIES[idx])
     return country_code, city, f'{lat},{lon}'
 
 
 def random_ab_test(user_id):
     """Generate a random A/B experiment name and assignment bucket."""
-    exp_idx = hash(user_id) % len(AB_EXPERIMENTS)
-    var_idx = hash(user_id) % len(AB_VARIANTS)
+    h = stable_hash(user_id)
+    exp_idx = h % len(AB_EXPERIMENTS)
+    var_idx = (h // len(AB_EXPERIMENTS)) % len(AB_VARIANTS)
 
     if AB_EXPERIMENTS[exp_idx]:
         return AB_EXPERIMENTS[exp_idx], AB_VARIANTS[var_idx]
@@ -100,7 +113,10 @@ def random_uuid():
 
 
 def random_results(doc_ids, maximize_num_results=False):
-    """Generate a random result set."""
+    """
+    Generate a random result set. The corpus `doc_ids` is a sequence of integer document IDs, usually a `range` so
+    that it takes no memory, and results are integers as well. IDs are only turned into strings for events.
+    """
 
     # used at testing time to always return results
     if maximize_num_results:
@@ -132,8 +148,8 @@ def generate_static_queries(doc_ids, maximize_num_results=False):
     }
 
 
-def query(doc_ids, user_id, static_queries, maximize_num_results=False):
-    """Generates a random query and returns a complete event as a dictionary (for ECS)."""
+def query_record(doc_ids, user_id, static_queries, maximize_num_results=False):
+    """Generates a random query and returns it as a `QueryEvent` record, with its time and all results."""
 
     time = random_time()
     timestamp = time_to_timestamp(time)
@@ -157,128 +173,81 @@ def query(doc_ids, user_id, static_queries, maximize_num_results=False):
         (query_value, results) = random.choice(static_queries[key])
 
     results_end = min(len(results), PAGE_SIZE)
-    results_page = results[:results_end]
-
-    event = {
-        '@timestamp': timestamp,
-        'ecs': {
-            'version': ECS_VERSION,
-        },
-        'event': {
-            'action': 'SearchMetrics.query',
-            'dataset': 'SearchMetrics.query',
-            'id': query_id,
-            'duration': random.randint(MIN_TOOK_MS, MAX_TOOK_MS) * MS_TO_NANOS,
-        },
-        'SearchMetrics': {
-            'query': {
-                'id': query_id,
-                'value': query_value,
-                'page': 1,
-            },
-            'results': {
-                'size': len(results_page),
-                'total': len(results),
-                'ids': results_page,
-            },
-        },
-        'SearchMetricsSimulation': {
-            'ab': {
-                'experiment': ab_experiment,
-                'variant': ab_variant,
-            },
-            'page_name': random.choice(PAGE_NAMES),
-        },
-        'source': {
-            'user': {
-                'id': user_id,
-            },
-            'geo': {
-                'country_iso_code': country_code,
-                'city_name': city,
-                'location': location,
-            },
-        },
-    }
+    duration = random.randint(MIN_TOOK_MS, MAX_TOOK_MS) * MS_TO_NANOS
+    page_name = random.choice(PAGE_NAMES)
 
+    event = QueryEvent(timestamp, query_id, duration, query_value, results[:results_end], len(results), ab_experiment,
+                       ab_variant, page_name, user_id, country_code, city, location)
     return time, event, results
 
 
-def query_second_page(first_query_event, results, last_timestamp):
+def query(doc_ids, user_id, static_queries, maximize_num_results=False):
+    """Generates a random query and returns a complete event as a dictionary (for ECS)."""
+    time, event, results = query_record(doc_ids, user_id, static_queries, maximize_num_results)
+    return time, event.to_dict(), results
+
+
+def second_page_record(query_id, results, time):
+    """Generates the request for the second page of results of a query, as a `PageEvent` record."""
 
-    time = timestamp_to_time(last_timestamp)
-    timestamp = last_timestamp
+    timestamp = time_to_timestamp(time)
 
     results_start = PAGE_SIZE
     results_end = min(results_start + len(results), results_start + PAGE_SIZE)
-    results_page = results[results_start:results_end]
-
-    event = {
-        '@timestamp': timestamp,
-        'ecs': first_query_event['ecs'],
-        'event': {
-            'action': 'SearchMetrics.page',
-            'dataset': 'SearchMetrics.page',
-            'id': random_uuid(),
-            'duration': random.randint(MIN_TOOK_MS, MAX_TOOK_MS),
-        },
-        'SearchMetrics': {
-            'query': {
-                'id': first_query_event['SearchMetrics']['query']['id'],
-                'page': 2,
-            },
-            'results': {
-                'size': len(results_page),
-                'ids': results_page,
-            },
-        }
-    }
 
-    return time, event
-
-
-def result_clicks(query_time, query_event, maximize_num_clicks=False):
-    """For a given query event, generate resulting clicks and return click events as dictionaries (for ECS)."""
-
-    def click(result):
-        (click_time, result) = result
-        timestamp = time_to_timestamp(click_time)
-        query_id = query_event['SearchMetrics']['query']['id']
-
-        return {
-            '@timestamp': timestamp,
-            'ecs': {
-                'version': ECS_VERSION,
-            },
-            'event': {
-                'action': 'SearchMetrics.click',
-                'dataset': 'SearchMetrics.click',
-                'id': random_uuid(),
-            },
-            'SearchMetrics': {
-                'query': {
-                    'id': query_id,
-                    'page': page,
-                },
-                'click': {
-                    'result': {
-                        'id': result['id'],
-                        'rank': result['rank'],
-                    },
-                },
-            },
-        }
-
-    results = query_event['SearchMetrics']['results']['ids']
-    page = query_event['SearchMetrics']['query']['page']
-    num_results = len(results)
-
-    # add rank to results before selecting for clicks
-    results = [{'rank': ((page - 1) * PAGE_SIZE) + idx + 1, 'id': id} for (idx, id) in enumerate(results)]
+    return time, PageEvent(timestamp, random_uuid(), random.randint(MIN_TOOK_MS, MAX_TOOK_MS), query_id, 2,
+                           results[results_start:results_end])
+
+
+def query_second_page(first_query_event, results, time):
+    time, event = second_page_record(first_query_event['SearchMetrics']['query']['id'], results, time)
+    return time, event.to_dict()
+
+
+def result_clicks(query_time, query_event, maximize_num_clicks=False, click_model=None, rng=None):
+    """
+    For a given query event, generate resulting clicks and return click events as dictionaries (for ECS). Clicks are
+    sampled uniformly, or from the click model when given (see `metrics.clicks`).
+    """
+    _, events = timed_result_clicks(query_time, query_event, maximize_num_clicks, click_model, rng)
+    return events
+
+
+def timed_result_clicks(query_time, query_event, maximize_num_clicks=False, click_model=None, rng=None):
+    """Like `result_clicks`, but also returns the click times (as datetimes), so they need not be parsed again."""
+    m = query_event['SearchMetrics']
+    click_times, events = click_records(query_time, m['query']['id'], m['query']['page'], m['results']['ids'],
+                                        maximize_num_clicks, click_model, rng)
+    return click_times, [x.to_dict() for x in events]
+
+
+def click_model_rng():
+    """A NumPy generator for a click model, drawn from `random` so that it is repeatable with the same seed."""
+    return np.random.default_rng(random.getrandbits(64))
+
+
+def click_records(query_time, query_id, page, ids, maximize_num_clicks=False, click_model=None, rng=None):
+    """
+    Generates clicks on a page of results with the given IDs, as `ClickEvent` records. Returns the click times (as
+    datetimes) and the records. A click model draws from `rng` (see `click_model_rng`), or a new generator if none is
+    given.
+    """
+
+    def click(click_time, idx):
+        return ClickEvent(time_to_timestamp(click_time), random_uuid(), query_id, page, ids[idx], first_rank + idx)
+
+    num_results = len(ids)
+    first_rank = ((page - 1) * PAGE_SIZE) + 1
+
+    if click_model:
+        # the click model works on batches of pages, so this is a batch of one
+        rng = rng or click_model_rng()
+        _, positions, offsets = click_model.sample(rng, np.array([num_results]), first_rank, maximize_num_clicks)
+        click_times = [query_time + datetime.timedelta(milliseconds=int(x)) for x in offsets]
+        return click_times, [click(t, int(x)) for t, x in zip(click_times, positions)]
 
     # random sample results to produce clicks for
     # sampling is done with replacement so that some results could get multiple clicks
-    # TODO: This should really be weighted sampling to get the position-bias effect
     max_clicks = min(num_results, MAX_CLICKS_PER_QUERY)
 
     # used at testing time to always click all results
@@ -287,7 +256,7 @@ def result_clicks(query_time, query_event, maximize_num_clicks=False):
     else:
         num_clicked_results = random.randint(0, max_clicks)
 
-    clicked_results = random.choices(results, k=num_clicked_results)
+    clicked_results = random.choices(range(num_results), k=num_clicked_results)
 
     # calculate click times
     seconds_first_click = random.randint(MIN_SECONDS_FIRST_CLICK, MAX_SECONDS_FIRST_CLICK)
@@ -296,67 +265,80 @@ def result_clicks(query_time, query_event, maximize_num_clicks=False):
 
     # zip in click times with result docs
     # generate click per result
-    return [click(result) for result in zip(click_times, clicked_results)]
+    return click_times, [click(t, idx) for t, idx in zip(click_times, clicked_results)]
 
 
-def user_behaviour(doc_ids, user_id, max_queries, static_queries):
-    """Generates a number of queries and clicks for a user. Returns all events flattened in a single list."""
+def iter_user_records(doc_ids, user_id, max_queries, static_queries, click_model=None, rng=None):
+    """
+    Generates a number of queries and clicks for a user. Yields event records one at a time, in order. A click model
+    draws from `rng`, or from a generator for this user if none is given.
+    """
+    if click_model and rng is None:
+        rng = click_model_rng()
 
-    events = []
+    for _ in random_range(max_queries):
+        time, query_event, results = query_record(doc_ids, user_id, static_queries)
+        click_times, click_events = click_records(time, query_event.query_id, query_event.page, query_event.ids,
+                                                  click_model=click_model, rng=rng)
 
-    def generate():
-        time, query_event, results = query(doc_ids, user_id, static_queries)
-        click_events = result_clicks(time, query_event)
+        yield query_event
+        yield from click_events
 
-        events.append(query_event)
-        events.extend(click_events)
+        last_time = click_times[-1] if click_times else time
 
-        if not click_events:
-            last_timestamp = query_event['@timestamp']
-        else:
-            last_timestamp = click_events[-1]['@timestamp']
+        # decide if we should add a second page query and maybe clicks sometimes
+        is_pageable = query_event.total > PAGE_SIZE
+        if is_pageable and random.random() >= SECOND_PAGE_PROBABILITY:
+            time, page_event = second_page_record(query_event.query_id, results, last_time)
 
-        return query_event, results, last_timestamp
+            yield page_event
+            yield from click_records(time, page_event.query_id, page_event.page, page_event.ids,
+                                     click_model=click_model, rng=rng)[1]
 
-    def generate_second_page(first_query_event, results, timestamp):
-        time, query_event = query_second_page(first_query_event, results, timestamp)
-        click_events = result_clicks(time, query_event)
 
-        events.append(query_event)
-        events.extend(click_events)
+def iter_user_behaviour(doc_ids, user_id, max_queries, static_queries, click_model=None):
+    """Generates a number of queries and clicks for a user. Yields events one at a time, in order."""
+    for record in iter_user_records(doc_ids, user_id, max_queries, static_queries, click_model):
+        yield record.to_dict()
 
-    for _ in random_range(max_queries):
-        query_event, results, last_timestamp = generate()
 
-        # decide if we should add a second page query and maybe clicks sometimes
-        is_pageable = query_event['SearchMetrics']['results']['total'] > PAGE_SIZE
-        if is_pageable and random.random() >= SECOND_PAGE_PROBABILITY:
-            generate_second_page(query_event, results, last_timestamp)
+def user_records(doc_ids, user_id, max_queries, static_queries, click_model=None):
+    """Generates a number of queries and clicks for a user. Returns all event records in a single list."""
+    return list(iter_user_records(doc_ids, user_id, max_queries, static_queries, click_model))
 
-    return events
 
+def user_behaviour(doc_ids, user_id, max_queries, static_queries, click_model=None):
+    """Generates a number of queries and clicks for a user. Returns all events flattened in a single list."""
+    return list(iter_user_behaviour(doc_ids, user_id, max_queries, static_queries, click_model))
 
-def generate_events(num_documents, num_users, max_queries, event_output_fn, with_progress=False):
-    doc_ids = string_ids(range(0, num_documents))
+
+def iter_records(num_documents, num_users, max_queries, with_progress=False, click_model=None):
+    """
+    Generates event records (see `metrics.events`) for all users, one at a time. See `metrics.batch` for a faster,
+    vectorized variant.
+    """
+    doc_ids = range(0, num_documents)
     user_ids = string_ids(range(0, num_users))
 
     # generate the static queries: with results, without results
     static_queries = generate_static_queries(doc_ids)
 
-    def generate(user_id):
-        events = user_behaviour(
-            doc_ids,
-            user_id,
-            max_queries,
-            static_queries,
-        )
-
-        for event in events:
-            event_output_fn(event)
+    # one generator for the click model for all users
+    rng = click_model_rng() if click_model else None
 
     if with_progress:
-        for user_id in tqdm(user_ids):
-            generate(user_id)
-    else:
-        for user_id in user_ids:
-            generate(user_id)
+        user_ids = tqdm(user_ids)
+
+    for user_id in user_ids:
+        yield from iter_user_records(doc_ids, user_id, max_queries, static_queries, click_model, rng)
+
+
+def iter_events(num_documents, num_users, max_queries, with_progress=False, click_model=None):
+    """Generates events for all users, one at a time, as dictionaries. See `iter_records` for compact records."""
+    for record in iter_records(num_documents, num_users, max_queries, with_progress, click_model):
+        yield record.to_dict()
+
+
+def generate_events(num_documents, num_users, max_queries, event_output_fn, with_progress=False, click_model=None):
+    for event in iter_events(num_documents, num_users, max_queries, with_progress, click_model):
+        event_output_fn(event)
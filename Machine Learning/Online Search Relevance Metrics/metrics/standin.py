@@ -0,0 +1,264 @@
+"""
+A local stand-in for the parts of the Elasticsearch API that events are loaded with: bulk requests, indexing single
+documents, refreshing and counting, plus putting ingest pipelines (which are acknowledged but not run). It is enough
+for `ingest.bulk_index`, `loader.load_events` and `bin/index` to run against, to measure their throughput without a
+cluster, and to reproduce rejections.
+
+Every request can be delayed, whole write requests can be rejected with HTTP 429, and items of bulk requests can be
+rejected (429) or fail (400) at random, with configurable rates. Documents are not stored, only their IDs per index
+for counting, so documents indexed again with the same ID are counted once, as in Elasticsearch. Counters of
+requests, documents and bytes are available from `stats`, or at `/_standin/stats`.
+"""
+
+import contextlib
+import fnmatch
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9201
+VERSION = '7.17.0'
+
+REJECTED_ERROR = {
+    'type': 'es_rejected_execution_exception',
+    'reason': 'rejected execution of coordinating operation (stand-in)',
+}
+FAILED_ERROR = {
+    'type': 'mapper_parsing_exception',
+    'reason': 'failed to parse (stand-in)',
+}
+
+
+class StandinStats:
+    def __init__(self):
+        self.num_requests = 0
+        self.num_bulk_requests = 0
+        self.num_docs = 0
+        self.num_bytes = 0
+        self.num_rejected_requests = 0
+        self.num_rejected_items = 0
+        self.num_failed_items = 0
+        self.num_refreshes = 0
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def print(self):
+        print(f" - requests: {self.num_requests}")
+        print(f" - bulk requests: {self.num_bulk_requests}")
+        print(f" - documents: {self.num_docs}")
+        print(f" - size: {self.num_bytes / 1024 / 1024:.1f} MB")
+        print(f" - rejected requests: {self.num_rejected_requests}")
+        print(f" - rejected items: {self.num_rejected_items}")
+        print(f" - failed items: {self.num_failed_items}")
+        print(f" - refreshes: {self.num_refreshes}")
+
+
+def error_body(error, status):
+    return {'error': dict(error, root_cause=[error]), 'status': status}
+
+
+class Standin:
+    """
+    The state and behaviour of a stand-in cluster. Each request is delayed by `latency` seconds, plus up to `jitter`
+    seconds at random. Write requests are rejected with probability `reject_rate`, and items of bulk requests with
+    probability `item_reject_rate`, or else fail with probability `failure_rate`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, reject_rate=0.0, item_reject_rate=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.reject_rate = reject_rate
+        self.item_reject_rate = item_reject_rate
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = StandinStats()
+        self.ids = {}
+        self.next_id = 0
+
+    def reset(self):
+        with self.lock:
+            self.stats = StandinStats()
+            self.ids = {}
+
+    def _random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def _delay(self):
+        delay = self.latency + (self._random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def _rejected(self):
+        if self.reject_rate and self._random() < self.reject_rate:
+            with self.lock:
+                self.stats.num_rejected_requests += 1
+            return True
+        return False
+
+    def _add(self, index, doc_id):
+        """Adds a document ID to an index, or generates an ID. Returns the ID and whether it was new."""
+        with self.lock:
+            if doc_id is None:
+                doc_id = f'standin-{self.next_id}'
+                self.next_id += 1
+            ids = self.ids.setdefault(index, set())
+            created = doc_id not in ids
+            ids.add(doc_id)
+            self.stats.num_docs += 1
+            return doc_id, created
+
+    def _delete(self, index, doc_id):
+        with self.lock:
+            ids = self.ids.get(index, set())
+            deleted = doc_id in ids
+            ids.discard(doc_id)
+            return deleted
+
+    def bulk(self, index, body):
+        """Handles a bulk request body (bytes). Returns the status and response."""
+        if self._rejected():
+            return 429, error_body(REJECTED_ERROR, 429)
+
+        start = time.monotonic()
+        items = []
+        lines = iter(body.splitlines())
+        for line in lines:
+            if not line.strip():
+                continue
+            op_type, action = next(iter(json.loads(line).items()))
+            if op_type != 'delete':
+                next(lines, None)
+            item_index = action.get('_index', index)
+
+            draw = self._random() if self.item_reject_rate or self.failure_rate else 1.0
+            if draw < self.item_reject_rate:
+                with self.lock:
+                    self.stats.num_rejected_items += 1
+                items.append({op_type: {'_index': item_index, 'status': 429, 'error': REJECTED_ERROR}})
+            elif draw < self.item_reject_rate + self.failure_rate:
+                with self.lock:
+                    self.stats.num_failed_items += 1
+                items.append({op_type: {'_index': item_index, 'status': 400, 'error': FAILED_ERROR}})
+            elif op_type == 'delete':
+                deleted = self._delete(item_index, action.get('_id'))
+                items.append({op_type: {'_index': item_index, '_id': action.get('_id'),
+                                        'result': 'deleted' if deleted else 'not_found',
+                                        'status': 200 if deleted else 404}})
+            else:
+                doc_id, created = self._add(item_index, action.get('_id'))
+                items.append({op_type: {'_index': item_index, '_id': doc_id, '_version': 1,
+                                        'result': 'created' if created else 'updated',
+                                        'status': 201 if created else 200}})
+
+        with self.lock:
+            self.stats.num_bulk_requests += 1
+        errors = any(x[next(iter(x))]['status'] >= 300 and next(iter(x)) != 'delete' for x in items)
+        return 200, {'took': int((time.monotonic() - start) * 1000), 'errors': errors, 'items': items}
+
+    def index(self, index, doc_id):
+        """Handles indexing a single document. Returns the status and response."""
+        if self._rejected():
+            return 429, error_body(REJECTED_ERROR, 429)
+        doc_id, created = self._add(index, doc_id)
+        return 201 if created else 200, {'_index': index, '_id': doc_id, '_version': 1,
+                                         'result': 'created' if created else 'updated'}
+
+    def refresh(self, index):
+        with self.lock:
+            self.stats.num_refreshes += 1
+        return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def count(self, index):
+        """Counts the documents of indices, given as comma separated names or patterns (or all indices)."""
+        with self.lock:
+            patterns = index.split(',') if index else ['*']
+            names = [x for x in self.ids if any(fnmatch.fnmatchcase(x, p) for p in patterns)]
+            missing = [p for p in patterns if '*' not in p and p not in self.ids]
+            if missing:
+                error = {'type': 'index_not_found_exception', 'reason': f'no such index [{missing[0]}]'}
+                return 404, error_body(error, 404)
+            return 200, {'count': sum(len(self.ids[x]) for x in names),
+                         '_shards': {'total': len(names), 'successful': len(names), 'skipped': 0, 'failed': 0}}
+
+    def info(self):
+        return 200, {
+            'name': 'standin',
+            'cluster_name': 'standin',
+            'version': {'number': VERSION, 'build_flavor': 'default'},
+            'tagline': 'You Know, for Search',
+        }
+
+    def handle(self, method, path, body):
+        """Routes a request to a handler. Returns the status and response."""
+        parts = [unquote(x) for x in path.strip('/').split('/') if x]
+        with self.lock:
+            self.stats.num_requests += 1
+            self.stats.num_bytes += len(body)
+        self._delay()
+
+        if not parts:
+            return self.info()
+        if parts[-1] == '_bulk' and method in ('POST', 'PUT'):
+            return self.bulk(parts[0] if len(parts) == 2 else None, body)
+        if len(parts) in (2, 3) and parts[1] in ('_doc', '_create') and method in ('POST', 'PUT'):
+            return self.index(parts[0], parts[2] if len(parts) == 3 else None)
+        if parts[-1] == '_refresh' and method in ('POST', 'GET'):
+            return self.refresh(parts[0] if len(parts) == 2 else None)
+        if parts[-1] == '_count' and method in ('POST', 'GET'):
+            return self.count(parts[0] if len(parts) == 2 else None)
+        if parts[:2] == ['_ingest', 'pipeline'] and method == 'PUT':
+            return 200, {'acknowledged': True}
+        if parts == ['_standin', 'stats']:
+            return 200, self.stats.to_dict()
+
+        error = {'type': 'illegal_argument_exception', 'reason': f'no handler for [{method}] [{path}] (stand-in)'}
+        return 400, error_body(error, 400)
+
+
+def make_server(standin, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """An HTTP server (with a thread per connection) for a stand-in."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def respond(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            status, response = standin.handle(self.command, urlsplit(self.path).path, body)
+            data = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+@contextlib.contextmanager
+def running(standin, host=DEFAULT_HOST, port=0):
+    """Runs a stand-in in a background thread, on a free port by default. Yields its URL."""
+    server = make_server(standin, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://{host}:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
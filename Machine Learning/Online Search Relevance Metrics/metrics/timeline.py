@@ -0,0 +1,87 @@
+"""
+Time handling for the batch simulation. Times are integer milliseconds since the epoch (UTC) throughout, and are only
+formatted as ISO 8601 strings when events are serialized. Query times are sampled over a range of days following a
+traffic curve, e.g. with more traffic during the day than at night.
+"""
+
+import datetime
+import numpy as np
+
+MS_PER_SECOND = 1000
+MS_PER_HOUR = 60 * 60 * MS_PER_SECOND
+MS_PER_DAY = 24 * MS_PER_HOUR
+
+# relative traffic per hour of the day (UTC), low at night with peaks late morning and in the evening
+DIURNAL_WEIGHTS = np.array([
+    0.30, 0.20, 0.15, 0.12, 0.12, 0.15, 0.30, 0.55, 0.80, 0.95, 1.00, 1.00,
+    0.98, 0.95, 0.95, 0.95, 0.95, 0.95, 1.00, 1.05, 1.10, 1.00, 0.80, 0.50,
+])
+
+# relative traffic per day of the week, Monday to Sunday
+WEEKLY_WEIGHTS = np.array([1.00, 1.00, 1.00, 1.00, 0.95, 0.75, 0.70])
+
+TRAFFIC_CURVES = ['flat', 'diurnal', 'weekly']
+
+
+def date_to_millis(date):
+    """Converts a date to milliseconds since the epoch, at midnight UTC."""
+    return int(np.datetime64(date, 'ms').astype(np.int64))
+
+
+def millis_to_time(millis):
+    """Converts milliseconds since the epoch to a (naive, UTC) datetime."""
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(millis))
+
+
+def timestamp_to_millis(timestamp):
+    """Converts a string timestamp (see `simulate.time_to_timestamp`) to milliseconds since the epoch."""
+    return int(np.datetime64(timestamp.rstrip('Z'), 'ms').astype(np.int64))
+
+
+def millis_to_timestamp(millis):
+    """Converts milliseconds since the epoch to a string timestamp, formatted like `simulate.time_to_timestamp`."""
+    return millis_to_time(millis).isoformat(sep='T', timespec='milliseconds') + 'Z'
+
+
+def millis_to_timestamps(millis):
+    """
+    Converts an array of milliseconds since the epoch to string timestamps in the same format as
+    `simulate.time_to_timestamp`.
+    """
+    return np.char.add(np.datetime_as_string(millis.astype('datetime64[ms]'), unit='ms'), 'Z')
+
+
+def hourly_weights(start_date, num_days, curve):
+    """Relative traffic for each hour in the range of days, following the traffic curve."""
+    if curve not in TRAFFIC_CURVES:
+        raise ValueError(f"unknown traffic curve: {curve}, expected one of: {', '.join(TRAFFIC_CURVES)}")
+
+    weights = np.ones((num_days, 24))
+    if curve in ('diurnal', 'weekly'):
+        weights *= DIURNAL_WEIGHTS
+    if curve == 'weekly':
+        weekdays = (start_date.weekday() + np.arange(num_days)) % 7
+        weights *= WEEKLY_WEIGHTS[weekdays][:, np.newaxis]
+
+    return weights.ravel()
+
+
+class TimeModel:
+    """Samples times over `num_days` days from `start_date`, with hourly traffic following the traffic curve."""
+
+    def __init__(self, start_date, num_days=1, curve='flat'):
+        assert num_days >= 1, f"num_days {num_days} must be greater than or equal to 1"
+
+        self.start_date = start_date
+        self.num_days = num_days
+        self.curve = curve
+        self.start_millis = date_to_millis(start_date)
+        self.end_millis = self.start_millis + num_days * MS_PER_DAY
+
+        weights = hourly_weights(start_date, num_days, curve)
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def sample(self, rng, n):
+        """Samples `n` times, in milliseconds since the epoch."""
+        hours = np.minimum(np.searchsorted(self.cdf, rng.random(n), side='right'), len(self.cdf) - 1)
+        return self.start_millis + hours * MS_PER_HOUR + rng.integers(0, MS_PER_HOUR, size=n)
@@ -0,0 +1,61 @@
+"""
+Runs the benchmarks in `tests/benchmarks` and writes the results as JSON. For example, to compare with a baseline:
+
+    python -m tests.benchmarks --output baseline.json
+    python -m tests.benchmarks --compare baseline.json
+"""
+
+import argparse
+import importlib
+import json
+import os
+import pkgutil
+import sys
+
+from tests.benchmarks import harness
+
+
+def load_modules():
+    directory = os.path.dirname(__file__)
+    for module in pkgutil.iter_modules([directory]):
+        if module.name.startswith('bench_'):
+            importlib.import_module(f'tests.benchmarks.{module.name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m tests.benchmarks')
+    parser.add_argument('--output', help="the file to write results to as JSON, or stdout")
+    parser.add_argument('--compare', metavar='BASELINE', help="a JSON file of results to compare against")
+    parser.add_argument('--threshold', type=float, default=harness.DEFAULT_THRESHOLD,
+                        help="the relative slowdown to fail a comparison on")
+    parser.add_argument('--filter', help="only run benchmarks with names containing this string")
+    parser.add_argument('--quick', action='store_true', help="only run the first value of every sweep")
+    parser.add_argument('--repeat', type=int, default=harness.DEFAULT_REPEAT, help="the number of timed runs")
+    parser.add_argument('--seed', type=int, default=harness.DEFAULT_SEED, help="the seed of all random generators")
+    args = parser.parse_args()
+
+    load_modules()
+    benchmarks = [x for x in harness.BENCHMARKS if not args.filter or args.filter in x.name]
+    report = harness.run(benchmarks, repeat=args.repeat, seed=args.seed, quick=args.quick)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changes, regressions = harness.compare(baseline, report, args.threshold)
+        print("Compared to baseline:", file=sys.stderr)
+        for result, change in changes:
+            print(f" - {result['name']} {harness.format_params(result['params'])}: {change:+.1%}", file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regression(s) of more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
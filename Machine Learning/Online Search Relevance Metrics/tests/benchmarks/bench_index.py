@@ -0,0 +1,40 @@
+"""Throughput of generating bulk requests in `bin/index`, from lines of NDJSON to request bodies."""
+
+from metrics import batch, loader
+from tests.benchmarks.harness import DEFAULT_SEED, benchmark
+
+NUM_DOCUMENTS = 10000
+MAX_QUERIES = 10
+NUM_USERS = [100, 1000]
+MAX_BYTES = [1024 * 1024, loader.DEFAULT_MAX_BYTES]
+
+
+def lines(num_users):
+    return [x.encode('utf-8') + b'\n'
+            for x in batch.iter_lines(NUM_DOCUMENTS, num_users, MAX_QUERIES, seed=DEFAULT_SEED)]
+
+
+@benchmark('index.document_id', unit='docs', num_users=NUM_USERS)
+def bench_document_id(num_users):
+    all_lines = lines(num_users)
+
+    def run():
+        for line in all_lines:
+            loader.document_id(line)
+        return len(all_lines)
+
+    return run
+
+
+@benchmark('index.bulk_body', unit='docs', num_users=NUM_USERS, max_bytes=MAX_BYTES)
+def bench_bulk_body(num_users, max_bytes):
+    all_lines = lines(num_users)
+
+    def run():
+        num_docs = 0
+        for chunk, _ in loader.iter_chunks(all_lines, max_bytes=max_bytes):
+            loader.bulk_body(chunk)
+            num_docs += len(chunk)
+        return num_docs
+
+    return run
@@ -0,0 +1,76 @@
+"""Throughput of serializing events as lines of NDJSON."""
+
+import json
+import os
+import tempfile
+
+from metrics import batch, ndjson, simulate
+from tests.benchmarks.harness import DEFAULT_SEED, benchmark
+
+NUM_DOCUMENTS = 10000
+MAX_QUERIES = 10
+NUM_USERS = [100, 1000]
+
+
+def events(num_users):
+    return list(simulate.iter_events(NUM_DOCUMENTS, num_users, MAX_QUERIES))
+
+
+@benchmark('serialization.to_ndjson', num_users=NUM_USERS)
+def bench_to_ndjson(num_users):
+    records = list(simulate.iter_records(NUM_DOCUMENTS, num_users, MAX_QUERIES))
+
+    def run():
+        for record in records:
+            record.to_ndjson()
+        return len(records)
+
+    return run
+
+
+@benchmark('serialization.json_dumps', num_users=NUM_USERS)
+def bench_json_dumps(num_users):
+    all_events = events(num_users)
+
+    def run():
+        for event in all_events:
+            json.dumps(event, separators=(',', ':'))
+        return len(all_events)
+
+    return run
+
+
+@benchmark('serialization.encode_event', num_users=NUM_USERS)
+def bench_encode_event(num_users):
+    all_events = events(num_users)
+
+    def run():
+        for event in all_events:
+            ndjson.encode_event(event)
+        return len(all_events)
+
+    return run
+
+
+@benchmark('serialization.batch_lines', num_users=NUM_USERS)
+def bench_batch_lines(num_users):
+    batches = list(batch.iter_batches(NUM_DOCUMENTS, num_users, MAX_QUERIES, seed=DEFAULT_SEED))
+
+    def run():
+        return sum(1 for events in batches for _ in events.lines())
+
+    return run
+
+
+@benchmark('serialization.ndjson_writer', num_users=NUM_USERS, compress=[False, True])
+def bench_ndjson_writer(num_users, compress):
+    all_events = events(num_users)
+
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            with ndjson.NdjsonWriter(os.path.join(directory, 'events.ndjson'), compress=compress) as writer:
+                for event in all_events:
+                    writer.write_event(event)
+        return len(all_events)
+
+    return run
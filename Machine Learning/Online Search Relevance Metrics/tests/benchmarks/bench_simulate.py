@@ -0,0 +1,87 @@
+"""Throughput of event generation, of the whole simulation and its components."""
+
+from metrics import batch, simulate
+from tests.benchmarks.harness import DEFAULT_SEED, benchmark
+
+MAX_QUERIES = 10
+NUM_CALLS = 1000
+NUM_DOCUMENTS = [1000, 100000]
+NUM_USERS = [100, 1000]
+
+
+def counter():
+    """An `event_output_fn` that counts events, and a function returning the count."""
+    count = [0]
+
+    def output(event):
+        count[0] += 1
+
+    return output, lambda: count[0]
+
+
+@benchmark('simulate.generate_events', num_documents=NUM_DOCUMENTS, num_users=NUM_USERS)
+def bench_generate_events(num_documents, num_users):
+    def run():
+        output, count = counter()
+        simulate.generate_events(num_documents, num_users, MAX_QUERIES, output)
+        return count()
+
+    return run
+
+
+@benchmark('simulate.iter_records', num_documents=NUM_DOCUMENTS, num_users=NUM_USERS)
+def bench_iter_records(num_documents, num_users):
+    def run():
+        return sum(1 for _ in simulate.iter_records(num_documents, num_users, MAX_QUERIES))
+
+    return run
+
+
+@benchmark('batch.generate_events', num_documents=NUM_DOCUMENTS, num_users=NUM_USERS)
+def bench_batch_generate_events(num_documents, num_users):
+    def run():
+        output, count = counter()
+        batch.generate_events(num_documents, num_users, MAX_QUERIES, output, seed=DEFAULT_SEED)
+        return count()
+
+    return run
+
+
+@benchmark('simulate.query', unit='queries', num_documents=NUM_DOCUMENTS)
+def bench_query(num_documents):
+    doc_ids = range(num_documents)
+    static_queries = simulate.generate_static_queries(doc_ids)
+
+    def run():
+        for user_id in simulate.string_ids(range(NUM_CALLS)):
+            simulate.query(doc_ids, user_id, static_queries)
+        return NUM_CALLS
+
+    return run
+
+
+@benchmark('simulate.result_clicks', unit='queries', num_documents=NUM_DOCUMENTS)
+def bench_result_clicks(num_documents):
+    doc_ids = range(num_documents)
+    static_queries = simulate.generate_static_queries(doc_ids)
+    queries = [simulate.query(doc_ids, user_id, static_queries)
+               for user_id in simulate.string_ids(range(NUM_CALLS))]
+
+    def run():
+        for time, query_event, _ in queries:
+            simulate.result_clicks(time, query_event)
+        return NUM_CALLS
+
+    return run
+
+
+@benchmark('simulate.random_results', unit='result sets', num_documents=NUM_DOCUMENTS)
+def bench_random_results(num_documents):
+    doc_ids = range(num_documents)
+
+    def run():
+        for _ in range(NUM_CALLS):
+            simulate.random_results(doc_ids)
+        return NUM_CALLS
+
+    return run
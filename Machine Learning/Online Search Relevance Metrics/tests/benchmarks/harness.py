@@ -0,0 +1,140 @@
+"""
+A small harness for throughput benchmarks. Benchmarks are registered with the `benchmark` decorator in `bench_*`
+modules: a benchmark function takes the parameters of a sweep, does any setup, and returns a function to time that
+returns the number of items it processed. Random number generators are seeded before every setup and run, so runs
+are comparable between commits. Results are written as JSON (see `run` and `compare`).
+"""
+
+import datetime
+import itertools
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from metrics import simulate
+
+DEFAULT_REPEAT = 3
+DEFAULT_SEED = 0
+DEFAULT_THRESHOLD = 0.1
+
+BENCHMARKS = []
+
+
+class Benchmark:
+    def __init__(self, name, fn, unit, sweep):
+        self.name = name
+        self.fn = fn
+        self.unit = unit
+        self.sweep = sweep
+
+    def params(self, quick=False):
+        """The cartesian product of the sweep, or only the first value of every parameter when quick."""
+        names = list(self.sweep)
+        values = [self.sweep[x][:1] if quick else self.sweep[x] for x in names]
+        return [dict(zip(names, x)) for x in itertools.product(*values)]
+
+
+def benchmark(name, unit='events', **sweep):
+    """Registers a benchmark with a sweep over lists of parameter values, e.g. `num_users=[100, 1000]`."""
+
+    def decorator(fn):
+        BENCHMARKS.append(Benchmark(name, fn, unit, sweep))
+        return fn
+
+    return decorator
+
+
+def seed_all(seed):
+    random.seed(seed)
+    # countries are sampled when `metrics.simulate` is imported, which would differ between processes
+    simulate.COUNTRIES = random.sample(simulate.COUNTRIES_ALL, len(simulate.COUNTRIES))
+    np.random.seed(seed)
+    simulate.FAKE.seed_instance(seed)
+
+
+def measure(benchmark, params, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED):
+    """Times a benchmark with parameters. Returns a result with the median throughput over repeated runs."""
+    seed_all(seed)
+    run = benchmark.fn(**params)
+
+    seconds = []
+    num_items = 0
+    for _ in range(repeat):
+        seed_all(seed)
+        start = timer()
+        num_items = run()
+        seconds.append(timer() - start)
+
+    median = statistics.median(seconds)
+    return {
+        'name': benchmark.name,
+        'params': params,
+        'unit': benchmark.unit,
+        'items': num_items,
+        'seconds': seconds,
+        'median_seconds': median,
+        'items_per_second': num_items / median if median else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(repeat, seed):
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'seed': seed,
+    }
+
+
+def run(benchmarks, repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, quick=False, out=sys.stderr):
+    """Runs benchmarks over their sweeps. Returns a JSON serializable report."""
+    results = []
+    for b in benchmarks:
+        for params in b.params(quick):
+            result = measure(b, params, repeat, seed)
+            print(f" - {b.name} {format_params(params)}: {result['items_per_second']:.0f} {b.unit}/sec", file=out)
+            results.append(result)
+    return {'metadata': metadata(repeat, seed), 'results': results}
+
+
+def format_params(params):
+    return ' '.join(f'{k}={v}' for k, v in params.items())
+
+
+def result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(baseline, report, threshold=DEFAULT_THRESHOLD):
+    """
+    Compares the throughput of results with a baseline report. Returns the relative change per benchmark and
+    parameters, and the ones that are slower than the baseline by more than the threshold.
+    """
+    baseline_results = {result_key(x): x for x in baseline['results']}
+    changes = []
+    regressions = []
+    for result in report['results']:
+        base = baseline_results.get(result_key(result))
+        if not base or not base['items_per_second']:
+            continue
+        change = result['items_per_second'] / base['items_per_second'] - 1
+        changes.append((result, change))
+        if change < -threshold:
+            regressions.append((result, change))
+    return changes, regressions
@@ -1,11 +1,15 @@
-import eland as ed
 import unittest
 
+import metrics.ingest as ingest
+import metrics.report as report
 import metrics.resources as resources
 import metrics.simulate as simulate
 
 from tests.integration import ES_TEST_CLIENT, METRICS_INDEX
 
+# per-query click metrics that the report does not cover
+CLICK_METRICS = ['num_above_fold', 'num_below_fold', 'max_page_clicked', 'time_to_last_click']
+
 
 class TestIntegration(unittest.TestCase):
 
@@ -17,13 +21,12 @@ class TestIntegration(unittest.TestCase):
         max_queries = 5
 
         resources.prepare(ES_TEST_CLIENT)
-        simulate.generate_events(
-            num_documents,
-            num_users,
-            max_queries,
-            lambda x: ES_TEST_CLIENT.index(index=resources.INDEX, pipeline=resources.INDEX, body=x),
+        stats = ingest.bulk_index(
+            ES_TEST_CLIENT,
+            simulate.iter_events(num_documents, num_users, max_queries),
             with_progress=True,
         )
+        self.assertEqual(stats.num_failures, 0)
         ES_TEST_CLIENT.indices.refresh(resources.INDEX)
         resources.start_transforms(ES_TEST_CLIENT, resources.TRANSFORM_NAMES)
 
@@ -35,7 +38,19 @@ class TestIntegration(unittest.TestCase):
 
         # make some invariant assertions based on aggregate statistics of the data
         # when things break, these statistics go to 0
-        metrics_df = ed.DataFrame(es_client=ES_TEST_CLIENT, es_index_pattern=METRICS_INDEX)
-        metrics_cols = [x for x in metrics_df.columns if x.startswith('metrics.clicks.')]
-        non_zero_properties = metrics_df[metrics_cols].describe().loc[['count', 'mean', 'std', 'max']]
-        self.assertFalse(non_zero_properties.eq(0.0).any().any())
+        result = report.report(ES_TEST_CLIENT, index=METRICS_INDEX)
+        total = result['total']
+        self.assertEqual(total['num_queries'], index_size)
+        self.assertEqual(sum(x['num_queries'] for x in result['buckets']), index_size)
+        self.assertGreater(total['click_through_rate'], 0.0)
+        self.assertGreater(total['max_reciprocal_rank'], 0.0)
+        self.assertGreater(total['mean_reciprocal_rank'], 0.0)
+        self.assertGreater(total['time_to_first_click']['avg'], 0.0)
+        self.assertGreater(total['time_to_first_click']['max'], 0.0)
+
+        aggs = {x: {'extended_stats': {'field': f'metrics.clicks.{x}'}} for x in CLICK_METRICS}
+        response = ES_TEST_CLIENT.search(index=METRICS_INDEX, body={'size': 0, 'aggs': aggs})
+        for name in CLICK_METRICS:
+            metric = response['aggregations'][name]
+            for key in ['count', 'avg', 'std_deviation', 'max']:
+                self.assertNotEqual(metric[key] or 0.0, 0.0, f"metrics.clicks.{name}: {key}")
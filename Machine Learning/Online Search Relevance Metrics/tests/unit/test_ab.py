@@ -0,0 +1,114 @@
+import io
+import unittest
+
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from metrics.ab import *
+
+
+def hit(i, experiment, variant, results, clicks, reciprocal_rank=None, time_to_first_click=None):
+    fields = {RESULTS_FIELD: [results], CLICKS_FIELD: [clicks]}
+    if experiment:
+        fields[EXPERIMENT_FIELD] = [experiment]
+        fields[VARIANT_FIELD] = [variant]
+    if reciprocal_rank is not None:
+        fields[RECIPROCAL_RANK_FIELD] = [reciprocal_rank]
+        fields[TIME_TO_FIRST_CLICK_FIELD] = [time_to_first_click]
+    return {'fields': fields, 'sort': [i]}
+
+
+def make_hits(seed=0, n=600):
+    """Queries of two experiments, where variant `a` of `alpha` has a much higher CTR than its control."""
+    rng = np.random.default_rng(seed)
+    hits = []
+    for i in range(n):
+        experiment = ['alpha', 'beta', None][i % 3]
+        variant = ['control', 'a'][(i // 3) % 2]
+        ctr = 0.8 if (experiment, variant) == ('alpha', 'a') else 0.3
+        clicked = rng.random() < ctr
+        hits.append(hit(i, experiment, variant, 10, int(clicked), 1 / rng.integers(1, 4) if clicked else None,
+                        float(rng.integers(1000, 5000)) if clicked else None))
+    return hits
+
+
+class FakeElasticsearch:
+    """Pages through hits of a point in time with `search_after`, recording request bodies."""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.bodies = []
+        self.closed = []
+
+    def open_point_in_time(self, index, keep_alive):
+        return {'id': f'pit-{index}'}
+
+    def close_point_in_time(self, body):
+        self.closed.append(body['id'])
+
+    def search(self, body):
+        self.bodies.append(body)
+        start = body['search_after'][0] + 1 if 'search_after' in body else 0
+        return {'pit_id': body['pit']['id'], 'hits': {'hits': self.hits[start:start + body['size']]}}
+
+
+class TestAB(unittest.TestCase):
+
+    def test_page_columns(self):
+        hits = [hit(0, 'alpha', 'a', 10, 2, 0.5, 1200.0), hit(1, 'beta', 'control', 0, 0), hit(2, None, None, 5, 0)]
+        experiments, variants, columns = page_columns(hits)
+        self.assertEqual(experiments.tolist(), ['alpha', 'beta', 'none'])
+        self.assertEqual(columns.dtype, np.float32)
+        self.assertEqual(columns.tolist(), [[1, 1, 1, 0.5, 1200], [0, 0, 0, 0, 0], [1, 0, 0, 0, 0]])
+
+        split = dict(split_by_variant(experiments, variants, columns))
+        self.assertEqual(sorted(split), [('alpha', 'a'), ('beta', 'control')])
+        self.assertEqual(split[('alpha', 'a')].shape, (1, len(COLUMNS)))
+
+    def test_iter_pages(self):
+        es = FakeElasticsearch(make_hits(n=25))
+        pages = list(iter_pages(es, page_size=10))
+        self.assertEqual([len(x[2]) for x in pages], [10, 10, 5])
+        self.assertEqual(es.bodies[1]['search_after'], [9])
+        self.assertEqual(es.closed, [f'pit-{QUERYID_TRANSFORM}'])
+
+    def test_bootstrap_sums(self):
+        columns = np.ones((3000, 2), dtype=np.float32)
+        sums = bootstrap_sums(columns, 200, seed=1)
+        self.assertEqual(sums.shape, (200, 2))
+        # Poisson(1) weights keep the expected sum
+        self.assertAlmostEqual(sums[:, 0].mean() / 3000, 1.0, delta=0.01)
+        np.testing.assert_array_equal(sums, bootstrap_sums(columns, 200, seed=1))
+
+    def test_compare(self):
+        pages = list(iter_pages(FakeElasticsearch(make_hits()), page_size=100))
+        results = bootstrap(pages, num_replicates=300, seed=42, workers=1)
+        self.assertEqual(sorted(results), [('alpha', 'a'), ('alpha', 'control'), ('beta', 'a'), ('beta', 'control')])
+        self.assertEqual(sum(x.num_queries for x in results.values()), 400)
+
+        rows = {(x['experiment'], x['metric']): x for x in compare(results)}
+        self.assertEqual(len(rows), 2 * len(METRICS))
+
+        ctr = rows[('alpha', 'ctr')]
+        self.assertTrue(ctr['significant'])
+        self.assertLess(ctr['ci_low'], ctr['difference'])
+        self.assertLess(ctr['difference'], ctr['ci_high'])
+        self.assertGreater(ctr['ci_low'], 0)
+        self.assertFalse(rows[('beta', 'ctr')]['significant'])
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            print_comparison(compare(results))
+        self.assertIn('alpha', out.getvalue())
+
+    def test_bootstrap_workers(self):
+        pages = list(iter_pages(FakeElasticsearch(make_hits(n=120)), page_size=50))
+        inline = bootstrap(pages, num_replicates=50, seed=7, workers=1)
+        pooled = bootstrap(pages, num_replicates=50, seed=7, workers=2, max_pending=2)
+        for key in inline:
+            np.testing.assert_allclose(inline[key].replicates, pooled[key].replicates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import datetime
+import unittest
+import uuid
+
+from metrics.batch import *
+from metrics.clicks import CascadeClickModel
+from metrics.timeline import TimeModel
+from metrics.simulate import generate_static_queries, query, result_clicks, timestamp_to_time
+
+
+def keys(d):
+    """All nested keys of a dictionary, as dotted paths."""
+    paths = set()
+    for k, v in d.items():
+        if isinstance(v, dict):
+            paths.update(f'{k}.{x}' for x in keys(v))
+        else:
+            paths.add(k)
+    return paths
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def test_uuid_strings(self):
+        uuids = uuid_strings(random_uuids(self.rng, 10))
+
+        for x in uuids:
+            self.assertEqual(str(uuid.UUID(x)), x)
+            self.assertEqual(uuid.UUID(x).version, 4)
+        self.assertEqual(len(set(uuids)), len(uuids))
+
+    def test_random_results(self):
+        counts = np.array([0, 5, 20, 20])
+        results = random_results(self.rng, 20, counts)
+        offsets = ragged_offsets(counts)
+
+        self.assertEqual(len(results), counts.sum())
+        for (start, end) in zip(offsets[:-1], offsets[1:]):
+            self.assertEqual(len(set(results[start:end])), end - start)
+        self.assertTrue(((results >= 0) & (results < 20)).all())
+
+    def test_click_model(self):
+        simulation = Simulation(1000, 5, 42, click_model=CascadeClickModel())
+        events = simulation.generate(self.rng, np.arange(0, 100)).events()
+        ranks = [x['SearchMetrics']['click']['result']['rank'] for x in events
+                 if x['event']['action'] == 'SearchMetrics.click']
+
+        # most clicks are at the top
+        self.assertGreater(ranks.count(1), ranks.count(5))
+
+    def test_events_schema(self):
+        simulation = Simulation(1000, 5, 42, maximize_num_results=True)
+        events = list(simulation.generate(self.rng, np.arange(0, 10), maximize_num_clicks=True).events())
+
+        doc_ids = range(0, 1000)
+        static_queries = generate_static_queries(doc_ids, maximize_num_results=True)
+        (query_time, query_event, _) = query(doc_ids, '1', static_queries, maximize_num_results=True)
+        click_event = result_clicks(query_time, query_event, maximize_num_clicks=True)[0]
+
+        queries = [x for x in events if x['event']['action'] == 'SearchMetrics.query']
+        clicks = [x for x in events if x['event']['action'] == 'SearchMetrics.click']
+        pages = [x for x in events if x['event']['action'] == 'SearchMetrics.page']
+
+        self.assertTrue(queries and clicks and pages, "error in test, missing event types")
+        for x in queries:
+            self.assertEqual(keys(x), keys(query_event))
+        for x in clicks:
+            self.assertEqual(keys(x), keys(click_event))
+        for x in pages:
+            self.assertEqual(x['SearchMetrics']['query']['page'], 2)
+            self.assertEqual(len(x['SearchMetrics']['results']['ids']), x['SearchMetrics']['results']['size'])
+
+    def test_events_order(self):
+        simulation = Simulation(1000, 5, 42)
+        events = list(simulation.generate(self.rng, np.arange(0, 10)).events())
+
+        # every click follows its query (or page) event, in time order
+        query_id = None
+        last_time = None
+        for event in events:
+            time = timestamp_to_time(event['@timestamp'])
+            if event['event']['action'] == 'SearchMetrics.click':
+                self.assertEqual(event['SearchMetrics']['query']['id'], query_id)
+                self.assertGreater(time, last_time)
+            else:
+                query_id = event['SearchMetrics']['query']['id']
+            last_time = time
+
+    def test_time_model(self):
+        time_model = TimeModel(datetime.date(2020, 1, 1), num_days=3, curve='diurnal')
+        simulation = Simulation(1000, 5, 42, time_model=time_model)
+        events = simulation.generate(self.rng, np.arange(0, 100)).events()
+        days = set(timestamp_to_time(x['@timestamp']).date() for x in events
+                   if x['event']['action'] == 'SearchMetrics.query')
+
+        self.assertEqual(days, {datetime.date(2020, 1, 1), datetime.date(2020, 1, 2), datetime.date(2020, 1, 3)})
+
+    def test_query_pool(self):
+        simulation = Simulation(1000, 5, 42, query_pool_size=20)
+        events = simulation.generate(np.random.default_rng(1), np.arange(0, 100)).events()
+        values = set(x['SearchMetrics']['query']['value'] for x in events
+                     if x['event']['action'] == 'SearchMetrics.query')
+
+        # all queries are either static or from the pool
+        self.assertTrue(values.issubset(simulation.query_values))
+        self.assertEqual(len(simulation.query_values), 2 * NUM_STATIC_QUERIES + 20)
+
+    def test_generate_events(self):
+        events = []
+        generate_events(100, 10, 5, events.append, batch_size=3, seed=1)
+
+        users = set(x['source']['user']['id'] for x in events if 'source' in x)
+        self.assertEqual(users, set(string_ids(range(0, 10))))
+
+    def test_generate_events_seed(self):
+        def generate(batch_size):
+            events = []
+            generate_events(100, 350, 3, events.append, batch_size=batch_size, seed=1, shard_size=250)
+            return events
+
+        # the same seed gives the same events, in batches of one or more blocks of users
+        events = generate(DEFAULT_BLOCK_SIZE)
+        self.assertEqual(len(set(x['source']['user']['id'] for x in events if 'source' in x)), 350)
+        self.assertEqual(generate(2 * DEFAULT_BLOCK_SIZE), events)
+        self.assertEqual(generate(1000), events)
+        self.assertEqual(generate(10), events)
+
+    def test_concatenate(self):
+        simulation = Simulation(1000, 10, 1, query_pool_size=0)
+        batches = [simulation.generate(simulation.block_rng(0, i), np.arange(i * 10, (i + 1) * 10)) for i in range(3)]
+        batch = EventBatch.concatenate(batches)
+
+        self.assertEqual(len(batch), sum(len(x) for x in batches))
+        self.assertEqual(list(batch.lines()), [line for x in batches for line in x.lines()])
+
+    def test_shards(self):
+        simulation = Simulation(100, 5, 1, shard_size=4)
+        shards = simulation.shards(10)
+
+        self.assertEqual([shard for (shard, _) in shards], [0, 1, 2])
+        self.assertEqual(np.concatenate([user_ids for (_, user_ids) in shards]).tolist(), list(range(0, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
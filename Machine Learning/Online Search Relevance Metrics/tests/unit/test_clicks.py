@@ -0,0 +1,84 @@
+import unittest
+
+from metrics.clicks import *
+
+
+def offsets(counts):
+    return np.concatenate(([0], np.cumsum(counts)))
+
+
+class TestClicks(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def assertIncreasing(self, counts, times):
+        for (start, end) in zip(offsets(counts)[:-1], offsets(counts)[1:]):
+            self.assertTrue((np.diff(times[start:end]) > 0).all())
+
+    def test_random_click_seconds(self):
+        counts = np.array([0, 1, 5, 3])
+        times = random_click_seconds(self.rng, counts)
+
+        self.assertEqual(len(times), counts.sum())
+        self.assertTrue((times >= MIN_SECONDS_FIRST_CLICK * MS_PER_SECOND).all())
+        self.assertTrue((times < MAX_SECONDS_LAST_CLICK * MS_PER_SECOND).all())
+        self.assertTrue((times % MS_PER_SECOND == 0).all())
+        self.assertIncreasing(counts, times)
+
+    def test_random_dwell_times(self):
+        counts = np.array([0, 1, 5, 0, 3])
+        times = random_dwell_times(self.rng, counts)
+
+        self.assertEqual(len(times), counts.sum())
+        first = times[offsets(counts)[:-1][counts > 0]]
+        self.assertTrue((first >= MIN_SECONDS_FIRST_CLICK * MS_PER_SECOND).all())
+        self.assertTrue((first <= MAX_SECONDS_FIRST_CLICK * MS_PER_SECOND).all())
+        self.assertIncreasing(counts, times)
+        self.assertEqual(len(random_dwell_times(self.rng, np.array([0, 0]))), 0)
+
+    def test_maximize_num_clicks(self):
+        page_sizes = np.array([0, 1, 10, 10])
+
+        for name in CLICK_MODELS:
+            counts, positions, times = click_model(name).sample(self.rng, page_sizes, maximize_num_clicks=True)
+
+            self.assertEqual(list(counts), [0, 1, MAX_CLICKS_PER_QUERY, MAX_CLICKS_PER_QUERY], name)
+            self.assertEqual(len(positions), counts.sum())
+            self.assertTrue((positions < np.repeat(page_sizes, counts)).all(), name)
+            self.assertIncreasing(counts, times)
+
+    def test_position_bias(self):
+        page_sizes = np.full(10000, 10)
+        counts, positions, _ = PositionBiasClickModel().sample(self.rng, page_sizes)
+        clicks = np.bincount(positions, minlength=10)
+
+        self.assertTrue((counts <= MAX_CLICKS_PER_QUERY).all())
+        self.assertGreater(clicks[0], clicks[1])
+        self.assertGreater(clicks[1], clicks[4])
+
+        # results on the second page are clicked less
+        second_counts, _, _ = PositionBiasClickModel().sample(self.rng, page_sizes, first_ranks=11)
+        self.assertGreater(counts.sum(), 2 * second_counts.sum())
+
+    def test_cascade(self):
+        page_sizes = np.full(10000, 10)
+        model = CascadeClickModel(attractiveness=1.0, continue_probability=0.0)
+        counts, positions, _ = model.sample(self.rng, page_sizes)
+
+        # always exactly one click on the top result
+        self.assertTrue((counts == 1).all())
+        self.assertTrue((positions == 0).all())
+
+        counts, positions, _ = CascadeClickModel().sample(self.rng, page_sizes)
+        clicks = np.bincount(positions, minlength=10)
+        self.assertGreater(clicks[0], clicks[2])
+
+    def test_click_model(self):
+        self.assertIsInstance(click_model('cascade'), CascadeClickModel)
+        with self.assertRaises(ValueError):
+            click_model('unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
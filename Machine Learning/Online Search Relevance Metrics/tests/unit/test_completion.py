@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from metrics.completion import *
+
+VALUES = ['security', 'secure login', 'second hand', 'search']
+
+
+class FakeIndices:
+    def __init__(self):
+        self.refreshes = 0
+
+    def stats(self, index, metric):
+        return {'_all': {'total': {'refresh': {'total': self.refreshes}}}}
+
+
+class FakeElasticsearch:
+    """Suggests values starting with the prefix, slowly, counting requests."""
+
+    def __init__(self, values=VALUES, delay=0.05):
+        self.values = values
+        self.delay = delay
+        self.indices = FakeIndices()
+        self.num_searches = 0
+        self.bodies = []
+        self.lock = threading.Lock()
+
+    def search(self, index, body):
+        if 'suggest' not in body:
+            # the most popular values first, with fewer queries for every next value
+            self.bodies.append(body)
+            hits = [{'fields': {VALUE_FIELD: [x], NUM_QUERIES_FIELD: [len(self.values) - i]}}
+                    for i, x in enumerate(self.values)]
+            return {'hits': {'hits': hits[:body['size']]}}
+
+        with self.lock:
+            self.num_searches += 1
+        time.sleep(self.delay)
+        suggest = body['suggest']['suggest']
+        size = suggest['completion']['size']
+        options = [{'text': x} for x in self.values if x.startswith(suggest['prefix'])][:size]
+        return {'suggest': {'suggest': [{'options': options}]}}
+
+
+def run_with_server(server, fn):
+    """Runs a coroutine function with the address of a running server, then stops the server."""
+
+    async def run():
+        started = asyncio.get_running_loop().create_future()
+        serving = asyncio.ensure_future(server.serve('127.0.0.1', 0, started=started.set_result))
+        address = (await started).sockets[0].getsockname()
+        try:
+            return await fn(*address)
+        finally:
+            serving.cancel()
+
+    return asyncio.run(run())
+
+
+class TestCompletion(unittest.TestCase):
+
+    def test_suggestions(self):
+        es = FakeElasticsearch(delay=0)
+        self.assertEqual(complete(es, 'sec', size=2), ['security', 'secure login'])
+        self.assertEqual(suggest_body('sec')['suggest']['suggest']['completion']['field'], COMPLETION_FIELD)
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+        for ms in [0.3] * 90 + [3] * 9 + [10000]:
+            histogram.record(ms / 1000)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), 0.5)
+        self.assertEqual(histogram.percentile(99), 5)
+        self.assertAlmostEqual(histogram.percentile(100), 10000)
+        self.assertEqual(histogram.to_dict()['buckets']['0.5'], 90)
+        self.assertEqual(histogram.to_dict()['buckets']['inf'], 1)
+
+    def test_cache(self):
+        cache = CompletionCache(max_size=2, ttl=10)
+        cache.put('a', [1], now=0)
+        cache.put('b', [2], now=0)
+        self.assertEqual(cache.get('a', now=1), [1])
+
+        # least recently used is evicted
+        cache.put('c', [3], now=1)
+        self.assertIsNone(cache.get('b', now=1))
+        self.assertEqual(cache.get('c', now=1), [3])
+
+        # expired
+        self.assertIsNone(cache.get('a', now=10))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+        cache.clear()
+        self.assertIsNone(cache.get('c', now=1))
+
+    def test_typed_prefixes(self):
+        self.assertEqual(list(typed_prefixes(['abc', 'de'])), ['a', 'ab', 'abc', 'd', 'de'])
+        self.assertEqual(list(typed_prefixes(['abc'], min_length=2)), ['ab', 'abc'])
+
+    def test_sample_queries(self):
+        es = FakeElasticsearch()
+        queries = indexed_queries(es)
+        self.assertEqual(queries, [('security', 4), ('secure login', 3), ('second hand', 2), ('search', 1)])
+        self.assertEqual(es.bodies[0]['sort'], [{NUM_QUERIES_FIELD: 'desc'}])
+
+        self.assertEqual(list(sample_queries(queries, 10, seed=1)), list(sample_queries(queries, 10, seed=1)))
+        self.assertTrue(set(sample_queries(queries, 10)) <= set(VALUES))
+        # sampled by popularity
+        samples = list(sample_queries(queries, 1000, seed=1))
+        self.assertGreater(samples.count('security'), samples.count('search'))
+
+        # without counts, e.g. from a transform that did not collect query IDs
+        self.assertTrue(set(sample_queries([(x, 0) for x in VALUES], 10)) <= set(VALUES))
+
+    def test_server(self):
+        es = FakeElasticsearch()
+        server = CompletionServer(es, refresh_check_interval=0.01)
+
+        async def requests(host, port):
+            # concurrent requests for the same prefix share a request, then it is cached
+            stats = await load_test(['sec'] * 10, host, port, concurrency=5)
+            self.assertEqual(stats.num_requests, 10)
+            self.assertEqual(stats.num_errors, 0)
+            self.assertEqual(es.num_searches, 1)
+            self.assertEqual(stats.num_cached, 5)
+
+            # the cache is invalidated by an index refresh
+            es.indices.refreshes += 1
+            await asyncio.sleep(0.1)
+            stats = await load_test(typed_prefixes(['sec']), host, port, concurrency=1)
+            self.assertEqual(stats.num_cached, 0)
+            self.assertEqual(es.num_searches, 4)
+
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b'GET /complete?prefix=se&size=1 HTTP/1.1\r\n\r\nGET /other HTTP/1.1\r\n\r\n')
+            responses = []
+            for _ in range(2):
+                status = int((await reader.readline()).split()[1])
+                headers = await read_headers(reader)
+                responses.append((status, json.loads(await reader.readexactly(int(headers['content-length'])))))
+            writer.close()
+            return responses
+
+        responses = run_with_server(server, requests)
+        self.assertEqual(responses[0], (200, {'suggestions': ['security'], 'cached': False}))
+        self.assertEqual(responses[1][0], 404)
+
+        stats = server.stats()
+        self.assertEqual(stats['cache']['invalidations'], 1)
+        self.assertEqual(stats['latency']['miss']['count'], 9)
+        self.assertEqual(stats['latency']['hit']['count'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import random
+import unittest
+
+from metrics import simulate
+from metrics.clicks import CascadeClickModel
+from metrics.events import *
+from metrics.ndjson import encode_event
+
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(42)
+        self.records = simulate.user_records(range(1000), '7', 10, simulate.generate_static_queries(range(1000)),
+                                             CascadeClickModel())
+
+    def test_kinds(self):
+        kinds = {type(x) for x in self.records}
+        self.assertIn(QueryEvent, kinds)
+        self.assertIn(ClickEvent, kinds)
+        self.assertIsInstance(self.records[0], QueryEvent)
+
+    def test_slots(self):
+        for record in self.records:
+            self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_to_ndjson(self):
+        for record in self.records:
+            line = record.to_ndjson()
+            self.assertEqual(json.loads(line), record.to_dict())
+            self.assertEqual(encode_event(record), line)
+            self.assertEqual(encode_event(record.to_dict()), line)
+
+    def test_to_dict(self):
+        query = self.records[0].to_dict()
+        self.assertEqual(query['event']['action'], 'SearchMetrics.query')
+        self.assertEqual(query['ecs'], {'version': ECS_VERSION})
+        self.assertEqual(query['SearchMetrics']['results']['size'], len(query['SearchMetrics']['results']['ids']))
+        self.assertTrue(all(isinstance(x, str) for x in query['SearchMetrics']['results']['ids']))
+
+        # every event has fresh sub-dictionaries
+        self.assertIsNot(self.records[0].to_dict()['ecs'], query['ecs'])
+
+    def test_page(self):
+        page = PageEvent('2019-11-15T00:00:00.000Z', 'p', 12, 'q', 2, [10, 11])
+        self.assertEqual(page.to_dict()['SearchMetrics'], {
+            'query': {'id': 'q', 'page': 2},
+            'results': {'size': 2, 'ids': ['10', '11']},
+        })
+        self.assertEqual(json.loads(page.to_ndjson()), page.to_dict())
+
+    def test_clicks_of_query(self):
+        query_ids = {x.query_id for x in self.records if isinstance(x, QueryEvent)}
+        for click in (x for x in self.records if isinstance(x, ClickEvent)):
+            self.assertIn(click.query_id, query_ids)
+            self.assertEqual(click.to_dict()['SearchMetrics']['click']['result']['rank'], click.rank)
+
+    def test_same_events_as_dicts(self):
+        random.seed(1)
+        simulate.FAKE.seed_instance(1)
+        records = [x.to_dict() for x in simulate.iter_records(100, 3, 3)]
+        random.seed(1)
+        simulate.FAKE.seed_instance(1)
+        events = list(simulate.iter_events(100, 3, 3))
+
+        # event IDs are random UUIDs, everything else is the same
+        for x in records + events:
+            x['event'].pop('id')
+            x['SearchMetrics']['query'].pop('id')
+        self.assertEqual(records, events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import io
+import threading
+import time
+import unittest
+
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+from elasticsearch import TransportError
+from elasticsearch.serializer import JSONSerializer
+
+from metrics.ingest import *
+
+
+class FakeElasticsearch:
+    """Counts bulk requests, rejecting the given number of documents (or whole requests) first."""
+
+    def __init__(self, num_rejected=0, num_rejected_requests=0):
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+        self.num_rejected = num_rejected
+        self.num_rejected_requests = num_rejected_requests
+        self.num_indexed = 0
+        self.num_requests = 0
+        self.lock = threading.Lock()
+
+    def bulk(self, body, **kwargs):
+        with self.lock:
+            self.num_requests += 1
+            if self.num_rejected_requests:
+                self.num_rejected_requests -= 1
+                raise TransportError(429, 'es_rejected_execution_exception')
+
+            items = []
+            for _ in body.splitlines()[0::2]:
+                if self.num_rejected:
+                    self.num_rejected -= 1
+                    items.append({'index': {'status': 429}})
+                else:
+                    self.num_indexed += 1
+                    items.append({'index': {'status': 201}})
+        return {'errors': any(x['index']['status'] > 201 for x in items), 'items': items}
+
+
+def actions(n):
+    return ({'_index': 'test', '_source': {'a': i}} for i in range(n))
+
+
+class TestIngest(unittest.TestCase):
+
+    def test_iter_queued(self):
+        self.assertEqual(list(iter_queued(range(0, 100), queue_size=3)), list(range(0, 100)))
+        self.assertEqual(list(iter_queued([])), [])
+
+    def test_iter_queued_error(self):
+        def failing():
+            yield 1
+            raise ValueError("simulation failed")
+
+        with self.assertRaises(ValueError):
+            list(iter_queued(failing()))
+
+    def test_iter_queued_stop(self):
+        finished = threading.Event()
+
+        def endless():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                finished.set()
+
+        items = iter_queued(endless(), queue_size=2)
+        self.assertEqual([next(items) for _ in range(5)], list(range(5)))
+        # the producer stops, instead of blocking on the full queue forever
+        items.close()
+        self.assertTrue(finished.wait(timeout=5))
+
+    def test_parallel_bulk(self):
+        es = FakeElasticsearch()
+        results = list(parallel_bulk(es, actions(105), thread_count=3, chunk_size=10))
+        self.assertEqual(len(results), 105)
+        self.assertTrue(all(success for success, _ in results))
+        self.assertEqual(es.num_requests, 11)
+
+    def test_parallel_bulk_retries(self):
+        es = FakeElasticsearch(num_rejected=15, num_rejected_requests=1)
+        stats = BulkStats()
+        results = list(parallel_bulk(es, actions(10), thread_count=1, chunk_size=10, initial_backoff=0.001,
+                                     stats=stats))
+        self.assertTrue(all(success for success, _ in results))
+        self.assertEqual(es.num_indexed, 10)
+        # the rejected request, then 10 and 5 rejected documents
+        self.assertEqual((stats.num_requests, stats.num_retries, stats.num_rejected), (4, 3, 25))
+
+        es = FakeElasticsearch(num_rejected=100)
+        stats = BulkStats()
+        results = list(parallel_bulk(es, actions(10), thread_count=1, chunk_size=10, max_retries=2,
+                                     initial_backoff=0.001, stats=stats))
+        self.assertEqual([success for success, _ in results], [False] * 10)
+        self.assertEqual((stats.num_requests, stats.num_retries, stats.num_rejected), (3, 2, 30))
+
+    def test_parallel_bulk_stop(self):
+        es = FakeElasticsearch()
+        results = parallel_bulk(es, actions(1000), thread_count=2, chunk_size=1)
+        next(results)
+        results.close()
+        num_requests = es.num_requests
+        # no chunks are sent after closing, only the requests in flight (and queued) complete
+        self.assertLess(num_requests, 10)
+        time.sleep(0.2)
+        self.assertEqual(es.num_requests, num_requests)
+
+    def test_bulk_stats(self):
+        stats = BulkStats()
+        self.assertEqual(stats.docs_per_second, 0.0)
+
+        with redirect_stdout(io.StringIO()):
+            for success in [True] * 100 + [False] * 3:
+                stats.add(success, {'index': {'status': 400}})
+        self.assertEqual((stats.num_docs, stats.num_failures), (100, 3))
+
+        stats.interval = 2.0
+        self.assertEqual(stats.docs_per_second, 50.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from elasticsearch import TransportError
+
+from metrics import loader
+from metrics.loader import *
+
+
+def write_lines(filename, lines, compress=False):
+    with (gzip.open(filename, 'wb') if compress else open(filename, 'wb')) as f:
+        for line in lines:
+            f.write(line + b'\n')
+
+
+class FakeElasticsearch:
+    """
+    Indexes bulk requests by document ID, rejecting the given number of lines (or whole requests) first, and failing
+    after the given number of requests.
+    """
+
+    def __init__(self, num_rejected=0, num_rejected_requests=0, failed=(), max_requests=None):
+        self.num_rejected = num_rejected
+        self.num_rejected_requests = num_rejected_requests
+        self.failed = set(failed)
+        self.max_requests = max_requests
+        self.docs_by_id = {}
+        self.num_indexed = 0
+        self.num_requests = 0
+
+    @property
+    def docs(self):
+        return list(self.docs_by_id.values())
+
+    def bulk(self, body, index, pipeline, request_timeout):
+        if self.max_requests is not None and self.num_requests >= self.max_requests:
+            raise ConnectionError("crashed")
+        self.num_requests += 1
+        if self.num_rejected_requests:
+            self.num_rejected_requests -= 1
+            raise TransportError(429, 'es_rejected_execution_exception')
+
+        lines = body.splitlines()
+        items = []
+        for action, line in zip(lines[0::2], lines[1::2]):
+            if self.num_rejected:
+                self.num_rejected -= 1
+                status = 429
+            elif line in self.failed:
+                status = 400
+            else:
+                self.docs_by_id[json.loads(action)['index']['_id']] = json.loads(line)
+                self.num_indexed += 1
+                status = 201
+            items.append({'index': {'status': status}})
+        return {'errors': any(x['index']['status'] > 201 for x in items), 'items': items}
+
+
+def event_lines(ids):
+    return [b'{"event":{"action":"test","id":"%d"},"a":%d}' % (i, i) for i in ids]
+
+
+@mock.patch.object(loader, 'INITIAL_BACKOFF', 0.001)
+class TestLoader(unittest.TestCase):
+
+    def test_open_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for filename, compress in [('a.ndjson', False), ('a.ndjson.gz', True)]:
+                filename = os.path.join(directory, filename)
+                write_lines(filename, [b'{"a":1}', b'{"a":2}'], compress)
+                with open_file(filename) as f:
+                    self.assertEqual(list(f), [b'{"a":1}\n', b'{"a":2}\n'])
+                with open_file(filename, offset=8) as f:
+                    self.assertEqual(list(f), [b'{"a":2}\n'])
+
+    def test_partition_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = []
+            for i, size in enumerate([100, 60, 50, 40, 10]):
+                filenames.append(os.path.join(directory, f'{i}.ndjson'))
+                with open(filenames[-1], 'wb') as f:
+                    f.write(b'x' * size)
+
+            partitions = partition_files(filenames, 2)
+            self.assertEqual(sorted(x for p in partitions for x in p), sorted(filenames))
+            self.assertEqual(sorted(sum(os.path.getsize(x) for x in p) for p in partitions), [120, 140])
+            self.assertEqual(len(partition_files(filenames[:1], 4)), 1)
+
+    def test_iter_chunks(self):
+        def chunk_lines(chunks):
+            return [([line for _, line in docs], offset) for docs, offset in chunks]
+
+        lines = [b'{"a":1}\n', b'\n', b'{"a":22}\n', b'{"a":333}']
+        self.assertEqual(chunk_lines(iter_chunks(lines)), [([b'{"a":1}\n', b'{"a":22}\n', b'{"a":333}\n'], 27)])
+        self.assertEqual(chunk_lines(iter_chunks(lines, max_docs=2, offset=100)),
+                         [([b'{"a":1}\n', b'{"a":22}\n'], 118), ([b'{"a":333}\n'], 127)])
+
+        # every line comes with its action line, built once for the size and the request body
+        (docs, _), = iter_chunks(lines)
+        self.assertEqual([action for action, _ in docs], [index_action(x) for x in lines if x.strip()])
+        self.assertEqual(bulk_body(docs), b''.join(action + line for action, line in docs))
+        self.assertEqual(bulk_body(docs).splitlines()[0::2], [x.strip() for x, _ in docs])
+
+        # capped by bytes, including action lines, and oversized lines on their own
+        action_size = len(index_action(b'{"a":1}\n'))
+        self.assertEqual([len(x) for x, _ in iter_chunks(lines, max_bytes=2 * action_size + 20)], [2, 1])
+        self.assertEqual([len(x) for x, _ in iter_chunks(lines, max_bytes=1)], [1, 1, 1])
+
+    def test_document_id(self):
+        line = b'{"@timestamp":"2019-11-15","event":{"action":"SearchMetrics.query","id":"a-1"},"id":"other"}'
+        self.assertEqual(document_id(line), b'a-1')
+        self.assertEqual(document_id(b'{"event":{"id":"a\\"1"}}'), b'a\\"1')
+        self.assertEqual(document_id(b'{"event":{"action":"{","id":"a-1"}}'), b'a-1')
+        self.assertEqual(document_id(b'{"event":{"action":"{","id":5}}'), b'5')
+
+        # without an event ID, the same line has the same ID
+        self.assertEqual(document_id(b'{"a":1}\n'), document_id(b'{"a":1}'))
+        self.assertNotEqual(document_id(b'{"a":1}'), document_id(b'{"a":2}'))
+        self.assertEqual(json.loads(index_action(line)), {'index': {'_id': 'a-1'}})
+
+    def test_backoff(self):
+        for attempt in range(1, 20):
+            delay = min(MAX_BACKOFF, loader.INITIAL_BACKOFF * 2 ** (attempt - 1))
+            self.assertTrue(delay / 2 <= backoff(attempt) <= delay)
+
+    def test_send_bulk_retries(self):
+        lines = [x + b'\n' for x in event_lines(range(10))]
+        docs = [(index_action(x), x) for x in lines]
+
+        es = FakeElasticsearch(num_rejected=15, failed=[lines[0].strip()])
+        num_retries, errors = send_bulk(es, docs)
+        self.assertEqual(num_retries, 2)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(sorted(x['a'] for x in es.docs), list(range(1, 10)))
+
+        es = FakeElasticsearch(num_rejected_requests=2)
+        self.assertEqual(send_bulk(es, docs), (2, []))
+        self.assertEqual(len(es.docs), 10)
+
+        es = FakeElasticsearch(num_rejected=100)
+        num_retries, errors = send_bulk(es, docs, max_retries=3)
+        self.assertEqual(num_retries, 3)
+        self.assertEqual(len(errors), 10)
+
+    def test_load_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'a.ndjson'), os.path.join(directory, 'b.ndjson.gz')]
+            write_lines(filenames[0], event_lines(range(0, 25)))
+            write_lines(filenames[1], event_lines(range(25, 50)), compress=True)
+
+            es = FakeElasticsearch(num_rejected=5)
+            reports = []
+            stats = load_files(es, filenames, max_docs=10, report=lambda *x: reports.append(x))
+
+        self.assertEqual(sorted(x['a'] for x in es.docs), list(range(0, 50)))
+        self.assertEqual(stats.num_docs, 50)
+        self.assertEqual(stats.num_failures, 0)
+        self.assertEqual(stats.num_retries, 1)
+        self.assertEqual(stats.num_requests, es.num_requests)
+        self.assertEqual(len(reports), 8)
+        self.assertEqual(sum(x[0][0] for x in reports), 50)
+        self.assertEqual([x[3] for x in reports], [False] * 3 + [True] + [False] * 3 + [True])
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'a.ndjson'), os.path.join(directory, 'b.ndjson.gz')]
+            write_lines(filenames[0], event_lines(range(0, 25)))
+            write_lines(filenames[1], event_lines(range(25, 50)), compress=True)
+
+            # crash during the second file, after 5 bulk requests
+            es = FakeElasticsearch(max_requests=5)
+            with OffsetJournal(os.path.join(directory, 'journal.ndjson')) as journal:
+                with self.assertRaises(ConnectionError):
+                    load_files(es, filenames, max_docs=10, report=lambda _, *x: journal.record(*x))
+            self.assertEqual(es.num_indexed, 45)
+
+            # a partially written line is ignored
+            with open(journal.filename, 'a') as f:
+                f.write('{"file": "')
+
+            with OffsetJournal(journal.filename) as journal:
+                self.assertEqual(journal.done, {filenames[0]})
+                self.assertEqual(journal.offsets[filenames[1]], 20 * len(event_lines([25])[0] + b'\n'))
+
+                es.max_requests = None
+                load_files(es, [x for x in filenames if x not in journal.done], max_docs=10, offsets=journal.offsets,
+                           report=lambda _, *x: journal.record(*x))
+
+        self.assertEqual(sorted(x['a'] for x in es.docs), list(range(0, 50)))
+        self.assertEqual(es.num_indexed, 50)
+
+    def test_offset_journal_truncated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'journal.ndjson')
+            with OffsetJournal(filename) as journal:
+                journal.record('a', 10)
+            with open(filename, 'a') as f:
+                f.write('{"file": "a", "off')
+
+            # the partially written line is truncated, not continued by the next line
+            with OffsetJournal(filename) as journal:
+                self.assertEqual(journal.offsets, {'a': 10})
+                journal.record('a', 20, done=True)
+            with OffsetJournal(filename) as journal:
+                self.assertEqual(journal.offsets, {'a': 20})
+                self.assertEqual(journal.done, {'a'})
+
+
+if __name__ == '__main__':
+    unittest.main()
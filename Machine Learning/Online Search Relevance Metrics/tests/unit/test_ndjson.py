@@ -0,0 +1,81 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from metrics.batch import Simulation
+from metrics.ndjson import *
+
+
+class TestNdjson(unittest.TestCase):
+
+    def setUp(self):
+        simulation = Simulation(1000, 5, 42)
+        self.batch = simulation.generate(np.random.default_rng(42), np.arange(0, 20))
+        self.events = list(self.batch.events())
+
+    def test_encode_event(self):
+        for event in self.events:
+            self.assertEqual(json.loads(encode_event(event)), event)
+
+    def test_encode_event_escaping(self):
+        event = json.loads(json.dumps(self.events[0]))
+        event['SearchMetrics']['query']['value'] = 'a "quoted" ünïcode\\'
+
+        line = encode_event(event)
+        self.assertEqual(json.loads(line), event)
+        self.assertTrue(line.isascii())
+
+    def test_encode_event_other(self):
+        event = {'event': {'action': 'other'}, 'x': [1, 2]}
+        self.assertEqual(json.loads(encode_event(event)), event)
+
+    def test_batch_lines(self):
+        self.assertEqual(list(self.batch.lines()), [encode_event(x) for x in self.events])
+
+    def test_writer_stream(self):
+        out = io.BytesIO()
+        with NdjsonWriter(out, buffer_size=100) as writer:
+            for event in self.events:
+                writer.write_event(event)
+
+        lines = out.getvalue().decode('utf-8').splitlines()
+        self.assertEqual([json.loads(x) for x in lines], self.events)
+        self.assertEqual(writer.num_lines, len(self.events))
+        self.assertEqual(writer.num_bytes, len(out.getvalue()))
+
+    def test_writer_non_ascii(self):
+        lines = ['{"value":"ünïcode ✓"}'] * 10
+        with tempfile.TemporaryDirectory() as directory:
+            with NdjsonWriter(os.path.join(directory, 'events.ndjson'), max_bytes=100, buffer_size=10) as writer:
+                for line in lines:
+                    writer.write(line)
+
+            # sizes are counted in bytes, so files are rotated at `max_bytes` bytes, not characters
+            sizes = [os.path.getsize(x) for x in writer.filenames]
+            self.assertEqual(writer.num_bytes, sum(sizes))
+            self.assertEqual(writer.num_bytes, len(''.join(x + '\n' for x in lines).encode('utf-8')))
+            self.assertTrue(all(x - len(lines[0].encode('utf-8')) - 1 < 100 for x in sizes))
+
+    def test_writer_rotation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with NdjsonWriter(os.path.join(directory, 'events.ndjson'), max_bytes=2000, compress=True) as writer:
+                for event in self.events:
+                    writer.write_event(event)
+
+            self.assertGreater(len(writer.filenames), 1)
+            self.assertEqual(os.path.basename(writer.filenames[0]), 'events-00000.ndjson.gz')
+
+            lines = []
+            for filename in writer.filenames:
+                with gzip.open(filename, 'rt') as f:
+                    lines.extend(f.read().splitlines())
+            self.assertEqual([json.loads(x) for x in lines], self.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
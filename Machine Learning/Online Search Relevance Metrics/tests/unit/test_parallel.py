@@ -0,0 +1,40 @@
+import io
+import os
+import tempfile
+import unittest
+
+from metrics.parallel import *
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_generate_to_stream(self):
+        def generate(workers):
+            out = io.StringIO()
+            generate_to_stream(100, 50, 5, out, workers=workers, seed=42, batch_size=5, shard_size=10)
+            return out.getvalue()
+
+        # the same seed gives the same events, regardless of the number of workers
+        single = generate(1)
+        self.assertTrue(single)
+        self.assertEqual(generate(2), single)
+
+    def test_generate_to_files(self):
+        out = io.StringIO()
+        generate_to_stream(100, 50, 5, out, workers=1, seed=42, batch_size=5, shard_size=10)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            filenames = generate_to_files(100, 50, 5, output_dir, workers=2, seed=42, batch_size=5, shard_size=10)
+
+            self.assertEqual(len(filenames), 5)
+            self.assertEqual(sorted(os.listdir(output_dir)), [os.path.basename(x) for x in filenames])
+
+            contents = ''
+            for filename in filenames:
+                with open(filename, 'r') as f:
+                    contents += f.read()
+            self.assertEqual(contents, out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
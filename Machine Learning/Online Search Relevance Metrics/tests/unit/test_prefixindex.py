@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+from metrics.prefixindex import *
+
+VALUES = ['Security', 'secure login', 'second hand', 'search', 'seat', 'zebra', 'sécurité']
+WEIGHTS = [10, 5, 3, 8, 1, 2, 4]
+
+
+class FakeElasticsearch:
+    """Returns completion index documents from a scroll."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def search(self, index, **kwargs):
+        hits = [{'_index': index, '_id': str(i), '_source': x} for i, x in enumerate(self.docs)]
+        return {'_scroll_id': '1', '_shards': {'successful': 1, 'total': 1, 'skipped': 0}, 'hits': {'hits': hits}}
+
+    def scroll(self, **kwargs):
+        return {'_scroll_id': '1', '_shards': {'successful': 1, 'total': 1, 'skipped': 0}, 'hits': {'hits': []}}
+
+    def clear_scroll(self, **kwargs):
+        pass
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex.build(VALUES, WEIGHTS, k=3, max_prefix_length=3)
+
+    def test_complete(self):
+        # precomputed
+        self.assertEqual(self.index.complete('se', size=3), ['Security', 'search', 'secure login'])
+        self.assertEqual(self.index.complete('SEC', size=2), ['Security', 'secure login'])
+        self.assertEqual(self.index.complete('x'), [])
+
+        # not precomputed, longer than the maximum prefix length or more than k
+        self.assertEqual(self.index.complete('secu'), ['Security', 'secure login'])
+        self.assertEqual(self.index.complete('se', size=10),
+                         ['Security', 'search', 'secure login', 'second hand', 'seat'])
+        self.assertEqual(self.index.complete('secux'), [])
+        self.assertEqual(self.index.complete('sé'), ['sécurité'])
+        self.assertEqual(self.index.complete(''), [])
+
+    def test_complete_fuzzy(self):
+        # exact matches first
+        self.assertEqual(self.index.complete('secu', fuzziness=1),
+                         ['Security', 'secure login', 'sécurité', 'second hand'])
+        self.assertEqual(self.index.complete('sxcu', fuzziness=1), ['Security', 'secure login', 'sécurité'])
+        self.assertEqual(self.index.complete('secuirty', fuzziness=2), ['Security'])
+
+        # the first character is not fuzzy, nor are short prefixes
+        self.assertEqual(self.index.complete('xecu', fuzziness=1), [])
+        self.assertEqual(self.index.complete('sx', fuzziness=1), [])
+
+    def test_fuzzy_matches_brute_force(self):
+        values = [f'{a}{b}{c}{d}' for a in 'ab' for b in 'abc' for c in 'abc' for d in ['', 'a', 'bc']]
+        index = PrefixIndex.build(values, range(len(values)))
+
+        def distance(a, b):
+            row = list(range(len(b) + 1))
+            for i, x in enumerate(a):
+                previous, row[0] = row[0], i + 1
+                for j, y in enumerate(b):
+                    previous, row[j + 1] = row[j + 1], min(row[j + 1] + 1, row[j] + 1, previous + (x != y))
+            return row[-1]
+
+        for prefix in ['abca', 'acba', 'bbbbb', 'aaa']:
+            expected = {x for x in values if x[0] == prefix[0] and
+                        min(distance(x[:i], prefix) for i in range(1, len(x) + 1)) <= 1}
+            self.assertEqual(set(index.complete(prefix, size=len(values), fuzziness=1)), expected, prefix)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'completion.idx')
+            self.index.save(filename)
+            loaded = PrefixIndex.load(filename)
+            self.assertEqual(len(loaded), len(VALUES))
+            self.assertIsInstance(loaded.top_k, np.memmap)
+            for prefix in ['s', 'se', 'secu', 'z']:
+                self.assertEqual(loaded.complete(prefix), self.index.complete(prefix))
+
+            PrefixIndex.build([], []).save(filename)
+            self.assertEqual(PrefixIndex.load(filename).complete('s'), [])
+
+            with open(filename, 'wb') as f:
+                f.write(b'not an index')
+            with self.assertRaises(ValueError):
+                PrefixIndex.load(filename)
+
+    def test_snapshot(self):
+        docs = [
+            {'SearchMetrics': {'query': {'value': 'search'}},
+             'metrics': {'num_queries': 10, 'mean_mean_reciprocal_rank': 0.5}},
+            {'SearchMetrics': {'query': {'value': 'seat'}}, 'metrics': {'num_queries': 4}},
+        ]
+        self.assertEqual(snapshot(FakeElasticsearch(docs)), (['search', 'seat'], [5.0, 0.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
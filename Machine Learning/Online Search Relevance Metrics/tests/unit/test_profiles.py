@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from metrics.batch import Simulation
+from metrics.profiles import *
+from metrics.simulate import random_ab_test
+
+
+class TestProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self.simulation = Simulation(100, 5, 42)
+
+    def test_build_profiles(self):
+        user_ids = range(0, 100)
+        self.simulation.prepare_profiles(len(user_ids))
+        profiles = self.simulation.profiles
+
+        self.assertEqual(len(profiles), len(user_ids))
+        for user_id in user_ids:
+            # consistent with the A/B test of the non-vectorized simulation
+            experiment, variant = random_ab_test(str(user_id))
+            self.assertEqual(EXPERIMENT_NAMES[profiles.experiments[user_id]], experiment)
+            self.assertEqual(VARIANT_NAMES[profiles.variants[user_id]], variant)
+
+            # the location is within the user's country
+            country = self.simulation.countries[profiles.countries[user_id]]
+            self.assertEqual(self.simulation.country_codes[profiles.coords[user_id]], country)
+
+    def test_user_profiles(self):
+        user_ids = np.array([3, 5, 8])
+        without_table = self.simulation.user_profiles(user_ids)
+        self.simulation.prepare_profiles(10)
+        with_table = self.simulation.user_profiles(user_ids)
+
+        # profiles are the same whether or not they come from the table
+        self.assertEqual(list(without_table.coords), list(with_table.coords))
+        self.assertEqual(list(without_table.variants), list(with_table.variants))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'profiles.npz')
+            self.simulation.prepare_profiles(10, filename)
+
+            loaded = UserProfiles.load(filename, self.simulation.profiles_key)
+            self.assertEqual(list(loaded.coords), list(self.simulation.profiles.coords))
+
+            # a different seed does not use the saved table
+            self.assertIsNone(UserProfiles.load(filename, Simulation(100, 5, 43).profiles_key))
+
+    def test_save_without_seed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'profiles.npz')
+            simulation = Simulation(100, 5)
+            simulation.prepare_profiles(10, filename)
+
+            # without a seed, no later run could load the table, so it is not saved
+            self.assertEqual(len(simulation.profiles), 10)
+            self.assertFalse(os.path.exists(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import argparse
+import io
+import threading
+import unittest
+
+from metrics.profiling import *
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_nested_spans(self):
+        registry = Registry()
+        with registry.span('run') as run:
+            for _ in range(2):
+                with registry.span('load') as path:
+                    self.assertEqual(path, 'run/load')
+                    registry.count(docs=10, bytes=1024)
+            self.assertEqual(registry.current(), run)
+        self.assertIsNone(registry.current())
+
+        load = registry.spans['run/load']
+        self.assertEqual(load.num_calls, 2)
+        self.assertEqual(load.counters, {'docs': 20, 'bytes': 2048})
+        self.assertGreaterEqual(registry.spans['run'].interval, load.interval)
+
+    def test_spans_in_threads(self):
+        registry = Registry()
+
+        def run(parent):
+            with registry.span('a', parent):
+                pass
+
+        with registry.span('transforms') as parent:
+            thread = threading.Thread(target=run, args=(parent,))
+            thread.start()
+            thread.join()
+            with registry.span('b'):
+                pass
+        self.assertEqual([x.path for x in registry.sorted_spans()], ['transforms', 'transforms/a', 'transforms/b'])
+
+    def test_count_without_span(self):
+        registry = Registry()
+        registry.count(docs=1)
+        self.assertEqual(registry.spans, {})
+
+    def test_profiled(self):
+        registry = Registry()
+        out = io.StringIO()
+        with profiled('run', profile=True, trace_memory=True, top=3, registry=registry, file=out):
+            with registry.span('generate'):
+                data = [str(x) for x in range(10000)]
+        self.assertEqual(len(data), 10000)
+
+        output = out.getvalue()
+        self.assertIn('Stage timings:', output)
+        self.assertIn('   - generate: ', output)
+        self.assertIn('Top 3 functions by cumulative time:', output)
+        self.assertIn('Top 3 allocators:', output)
+
+    def test_profiled_without_options(self):
+        registry = Registry()
+        out = io.StringIO()
+        with profiled('run', registry=registry, file=out):
+            pass
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn('run', registry.spans)
+
+    def test_add_arguments(self):
+        parser = argparse.ArgumentParser()
+        add_arguments(parser)
+        args = parser.parse_args(['--profile-output', 'run.prof'])
+        self.assertEqual((args.profile, args.profile_output, args.trace_memory), (False, 'run.prof', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from metrics.queries import *
+
+
+class TestQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def test_random_queries(self):
+        for q in random_queries(self.rng, 10):
+            terms = q.split()
+            self.assertGreaterEqual(len(terms), MIN_QUERY_WORDS)
+            self.assertLessEqual(len(terms), MAX_QUERY_WORDS)
+            self.assertTrue(terms[0][0].isupper())
+
+    def test_zipf_weights(self):
+        weights = zipf_weights(4, 1.0)
+
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertAlmostEqual(weights[0] / weights[1], 2.0)
+        self.assertAlmostEqual(weights[0] / weights[3], 4.0)
+
+    def test_build_query_pool(self):
+        exclude = list(random_queries(np.random.default_rng(42), 5))
+        pool = build_query_pool(self.rng, 100, exclude=exclude)
+
+        self.assertEqual(len(pool), 100)
+        self.assertEqual(len(set(pool.values)), 100)
+        self.assertFalse(set(pool.values) & set(exclude))
+
+    def test_sample(self):
+        pool = build_query_pool(self.rng, 1000, skew=1.0)
+        samples = pool.sample(self.rng, 100000)
+        counts = np.bincount(samples, minlength=len(pool))
+
+        self.assertTrue(((samples >= 0) & (samples < len(pool))).all())
+
+        # the head is much more popular than the tail
+        self.assertGreater(counts[0], counts[9] * 5)
+        self.assertGreater(counts[:10].sum(), counts[-100:].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
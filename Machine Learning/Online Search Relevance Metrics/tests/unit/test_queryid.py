@@ -0,0 +1,135 @@
+import numpy as np
+import unittest
+
+from unittest import mock
+
+from metrics import batch, queryid
+from metrics.ndjson import encode_event
+from metrics.queryid import *
+
+
+def query_event(query_id, timestamp='2019-11-15T00:00:00.000Z'):
+    return {
+        '@timestamp': timestamp,
+        'ecs': {'version': '1.6.0-dev'},
+        'event': {'action': 'SearchMetrics.query', 'id': query_id},
+        'SearchMetrics': {'query': {'id': query_id, 'page': 1}},
+    }
+
+
+def page_event(query_id, page):
+    return {
+        '@timestamp': '2019-11-15T00:00:01.000Z',
+        'event': {'action': 'SearchMetrics.page'},
+        'SearchMetrics': {'query': {'id': query_id, 'page': page}},
+    }
+
+
+def click_event(query_id, rank, timestamp):
+    return {
+        '@timestamp': timestamp,
+        'event': {'action': 'SearchMetrics.click'},
+        'SearchMetrics': {'query': {'id': query_id, 'page': (rank - 1) // 10 + 1}, 'click': {'result': {'rank': rank}}},
+    }
+
+
+class TestQueryId(unittest.TestCase):
+
+    def test_query_document(self):
+        events = [
+            query_event('a'),
+            click_event('a', 2, '2019-11-15T00:00:05.000Z'),
+            page_event('a', 2),
+            click_event('a', 12, '2019-11-15T00:00:20.500Z'),
+            query_event('b'),
+        ]
+        docs = list(query_documents(events))
+
+        self.assertEqual([x['SearchMetrics']['query']['id'] for x in docs], ['a', 'b'])
+        self.assertNotIn('ecs', docs[0]['query_event'])
+        self.assertEqual(docs[0]['metrics'], {
+            'pages': {'max_page_requested': 2},
+            'clicks': {
+                'count': 2,
+                'max_reciprocal_rank': 0.5,
+                'mean_reciprocal_rank': (1 / 2 + 1 / 12) / 2,
+                'max_page_clicked': 2,
+                'num_above_fold': 1,
+                'num_below_fold': 1,
+                'exist_at_3': True,
+                'exist_at_10': True,
+                'time_to_first_click': 5000,
+                'time_to_last_click': 20500,
+            },
+        })
+        self.assertEqual(docs[1]['metrics']['clicks'], {
+            'count': 0,
+            'num_above_fold': 0,
+            'num_below_fold': 0,
+            'exist_at_3': False,
+            'exist_at_10': False,
+        })
+
+    def test_without_query_event(self):
+        docs = list(query_documents([click_event('a', 1, '2019-11-15T00:00:05.000Z')]))
+
+        self.assertNotIn('query_event', docs[0])
+        self.assertNotIn('time_to_first_click', docs[0]['metrics']['clicks'])
+        self.assertEqual(docs[0]['metrics']['pages'], {})
+
+    def test_spill(self):
+        simulation = batch.Simulation(1000, 10, 42)
+        events = [encode_event(x) for x in simulation.generate(np.random.default_rng(1), np.arange(0, 20)).events()]
+
+        # lines of JSON, interleaved so that queries are split over runs
+        events = events[::2] + events[1::2]
+        in_memory = list(query_documents(events))
+        spilled = list(query_documents(events, max_queries=5))
+
+        # the same documents, up to floating point rounding of mean reciprocal ranks
+        self.assertEqual([x['SearchMetrics']['query']['id'] for x in spilled],
+                         [x['SearchMetrics']['query']['id'] for x in in_memory])
+        self.assertEqual(compare_documents(in_memory, spilled), (set(), set(), set()))
+        self.assertEqual(len(in_memory), simulation.generate(np.random.default_rng(1), np.arange(0, 20)).num_queries)
+
+    def test_merge_passes(self):
+        simulation = batch.Simulation(1000, 10, 42)
+        events = [encode_event(x) for x in simulation.generate(np.random.default_rng(1), np.arange(0, 20)).events()]
+        events = events[::2] + events[1::2]
+        in_memory = list(query_documents(events))
+
+        # far more runs than can be merged at once, in multiple passes of intermediate runs
+        read_run = queryid._read_run
+        runs = []
+        open_runs = []
+        max_open_runs = 0
+
+        def counting_read_run(filename):
+            nonlocal max_open_runs
+            runs.append(filename)
+            open_runs.append(filename)
+            max_open_runs = max(max_open_runs, len(open_runs))
+            try:
+                yield from read_run(filename)
+            finally:
+                open_runs.remove(filename)
+
+        with mock.patch.object(queryid, '_read_run', counting_read_run):
+            merged = list(query_documents(events, max_queries=2, max_fan_in=3))
+        self.assertGreater(len(set(runs)), 3 ** 2)
+        self.assertLessEqual(max_open_runs, 3)
+        self.assertEqual(compare_documents(in_memory, merged), (set(), set(), set()))
+
+    def test_compare_documents(self):
+        expected = list(query_documents([query_event('a'), query_event('b'), query_event('c')]))
+        actual = list(query_documents([query_event('a'), query_event('b', '2019-11-15T00:00:01.000Z'),
+                                       query_event('d')]))
+
+        # missing metrics are the same as null metrics
+        expected[0]['metrics']['clicks']['max_reciprocal_rank'] = None
+
+        self.assertEqual(compare_documents(expected, actual), ({'c'}, {'d'}, {'b'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
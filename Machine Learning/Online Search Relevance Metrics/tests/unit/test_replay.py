@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+
+from elasticsearch import TransportError
+
+from metrics.replay import *
+from metrics.simulate import iter_events
+from metrics.timeline import timestamp_to_millis
+
+
+class FakeElasticsearch:
+    """Acknowledges bulk requests, with the given status for every item."""
+
+    def __init__(self, status=201, error=None):
+        self.status = status
+        self.error = error
+        self.lines = []
+
+    def bulk(self, body, pipeline, request_timeout):
+        if self.error:
+            raise self.error
+        lines = body.splitlines()[1::2]
+        self.lines.extend(lines)
+        return {
+            'errors': self.status >= 300,
+            'items': [{'index': {'status': self.status}} for _ in lines],
+        }
+
+
+def replay(es, events, **kwargs):
+    return asyncio.run(replay_events(es, events, **kwargs))
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.events = list(iter_events(100, 5, 5))
+
+    def test_bulk_body(self):
+        self.assertEqual(bulk_body(['{"a":1}'], 'test'), '{"index": {"_index": "test"}}\n{"a":1}\n')
+
+    def test_send_bulk(self):
+        self.assertEqual(send_bulk(FakeElasticsearch(), ['{}', '{}']), (0, 0))
+        self.assertEqual(send_bulk(FakeElasticsearch(429), ['{}', '{}']), (0, 2))
+        self.assertEqual(send_bulk(FakeElasticsearch(400), ['{}', '{}']), (2, 0))
+        self.assertEqual(send_bulk(FakeElasticsearch(error=TransportError(429, 'rejected')), ['{}']), (0, 1))
+        self.assertEqual(send_bulk(FakeElasticsearch(error=TransportError(500, 'error')), ['{}']), (1, 0))
+
+    def test_rate(self):
+        es = FakeElasticsearch()
+        stats = replay(es, self.events, rate=1000, chunk_size=10)
+
+        self.assertEqual(stats.num_events, len(self.events))
+        self.assertEqual(len(es.lines), len(self.events))
+        self.assertEqual(len(stats.latencies), len(self.events))
+        self.assertEqual(stats.num_requests, -(-len(self.events) // 10))
+        self.assertEqual((stats.num_failures, stats.num_rejected), (0, 0))
+
+        # events are paced, and their times are shifted by a constant offset, keeping the time to clicks
+        self.assertGreaterEqual(stats.interval, (len(self.events) - 1) / 1000 - MIN_SLEEP)
+        original = {x['event']['id']: timestamp_to_millis(x['@timestamp']) for x in self.events}
+        offsets = {timestamp_to_millis(x['@timestamp']) - original[x['event']['id']]
+                   for x in map(json.loads, es.lines)}
+        self.assertEqual(len(offsets), 1)
+
+    def test_speedup(self):
+        es = FakeElasticsearch()
+        events = sorted_events(self.events)
+        stats = replay(es, events, speedup=1000000, duration=60)
+
+        # event times keep their (compressed) order and relative offsets, starting now
+        self.assertEqual(stats.num_events, len(events))
+        millis = [timestamp_to_millis(json.loads(x)['@timestamp']) for x in es.lines]
+        self.assertEqual(millis, sorted(millis))
+        span = timestamp_to_millis(events[-1]['@timestamp']) - timestamp_to_millis(events[0]['@timestamp'])
+        self.assertLessEqual(millis[-1] - millis[0], span / 1000000 + 1)
+
+    def test_duration(self):
+        stats = replay(FakeElasticsearch(), self.events, rate=1000, duration=0.01)
+        self.assertEqual(stats.num_events, 10)
+
+    def test_rejected(self):
+        stats = replay(FakeElasticsearch(429), self.events, rate=10000)
+        self.assertEqual(stats.num_rejected, len(self.events))
+        self.assertEqual(stats.num_failures, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
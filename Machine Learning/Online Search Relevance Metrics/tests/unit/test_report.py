@@ -0,0 +1,114 @@
+import io
+import os
+import tempfile
+import unittest
+
+from contextlib import redirect_stdout
+
+from metrics.report import *
+
+
+def aggs(num_with_results, num_with_clicks, num_paged, reciprocal_rank, time_to_first_click):
+    return {
+        'with_results': {'doc_count': num_with_results},
+        'with_results_and_clicks': {'doc_count': num_with_clicks},
+        'with_clicks_at_3': {'doc_count': num_with_clicks // 2},
+        'paged': {'doc_count': num_paged},
+        'max_reciprocal_rank': {'value': reciprocal_rank},
+        'mean_reciprocal_rank': {'value': reciprocal_rank and reciprocal_rank / 2},
+        'time_to_first_click': {'avg': time_to_first_click, 'min': time_to_first_click, 'max': time_to_first_click},
+        'time_to_first_click_percentiles': {'values': {f'{float(p)}': time_to_first_click for p in PERCENTS}},
+    }
+
+
+BUCKETS = [
+    dict(key={'page_name': 'home_page_onebox', 'day': '2019-11-15'}, doc_count=10, **aggs(8, 4, 2, 0.5, 3000)),
+    dict(key={'page_name': 'user_search_page', 'day': '2019-11-15'}, doc_count=5, **aggs(0, 0, 0, None, None)),
+    dict(key={'page_name': None, 'day': '2019-11-16'}, doc_count=5, **aggs(5, 5, 5, 1.0, 1000)),
+]
+
+
+class FakeElasticsearch:
+    """Returns pages of composite aggregation buckets, recording request bodies."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.bodies = []
+
+    def search(self, index, body):
+        self.bodies.append(body)
+        composite = body['aggs']['buckets']['composite']
+        start = next((i + 1 for i, x in enumerate(self.buckets) if x['key'] == composite.get('after')), 0)
+        page = self.buckets[start:start + composite['size']]
+        response = {
+            'hits': {'total': {'value': 20}},
+            'aggregations': {'buckets': {'buckets': page, 'after_key': page[-1]['key'] if page else None}},
+        }
+        if 'with_results' in body['aggs']:
+            response['aggregations'].update(aggs(13, 9, 7, 0.7, 2000))
+        return response
+
+
+class TestReport(unittest.TestCase):
+
+    def test_report_body(self):
+        body = report_body(start='2019-11-15', time_zone='Europe/Berlin')
+        self.assertEqual(body['query']['range'][TIMESTAMP_FIELD], {'time_zone': 'Europe/Berlin', 'gte': '2019-11-15'})
+        self.assertIn('with_results', body['aggs'])
+
+        # metrics over all queries are only on the first page
+        body = report_body(after={'page_name': 'a', 'day': '2019-11-15'})
+        self.assertNotIn('query', body)
+        self.assertNotIn('with_results', body['aggs'])
+        self.assertEqual(body['aggs']['buckets']['composite']['after'], {'page_name': 'a', 'day': '2019-11-15'})
+
+    def test_report(self):
+        es = FakeElasticsearch()
+        result = report(es, page_size=2)
+
+        self.assertEqual(result['num_requests'], 2)
+        self.assertEqual(len(result['buckets']), 3)
+        self.assertEqual(result['total']['num_queries'], 20)
+        self.assertAlmostEqual(result['total']['click_through_rate'], 9 / 13)
+        self.assertAlmostEqual(result['total']['abandonment_rate'], 4 / 20)
+        self.assertAlmostEqual(result['total']['zero_result_rate'], 7 / 20)
+
+        bucket = result['buckets'][0]
+        self.assertEqual((bucket['page_name'], bucket['day']), ('home_page_onebox', '2019-11-15'))
+        self.assertEqual(bucket['click_through_rate'], 0.5)
+        self.assertEqual(bucket['click_through_rate_at_3'], 0.5)
+        self.assertEqual(bucket['abandonment_rate'], 0.4)
+        self.assertEqual(bucket['paging_rate'], 0.2)
+        self.assertEqual(bucket['max_reciprocal_rank'], 0.5)
+        self.assertEqual(bucket['mean_reciprocal_rank'], 0.25)
+        self.assertEqual(bucket['time_to_first_click']['p90'], 3000)
+
+        # no results
+        self.assertIsNone(result['buckets'][1]['click_through_rate'])
+        self.assertEqual(result['buckets'][1]['zero_result_rate'], 1.0)
+        self.assertEqual(result['buckets'][1]['abandonment_rate'], 0.0)
+
+        with redirect_stdout(io.StringIO()) as out:
+            print_report(result)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+    def test_cached_report(self):
+        es = FakeElasticsearch()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'report.json')
+            self.assertFalse(cached_report(es, filename)['cached'])
+            self.assertTrue(cached_report(es, filename)['cached'])
+            self.assertEqual(len(es.bodies), 1)
+
+            # other parameters, or too old
+            self.assertFalse(cached_report(es, filename, start='2019-11-16')['cached'])
+            self.assertFalse(cached_report(es, filename, max_age=-1)['cached'])
+            self.assertEqual(len(es.bodies), 3)
+
+            cached = load_cached(filename, QUERYID_TRANSFORM, report_params())
+            self.assertEqual(cached['buckets'], report(es)['buckets'])
+            self.assertIsNone(load_cached(os.path.join(directory, 'missing.json'), QUERYID_TRANSFORM, report_params()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,279 @@
+import inspect
+import json
+import re
+import threading
+import unittest
+
+from unittest import mock
+
+from metrics import ab, report, resources
+from metrics.resources import *
+
+MANIFEST = {
+    'a': {'depends_on': []},
+    'b': {'depends_on': ['a']},
+    'c': {'depends_on': []},
+    'd': {'depends_on': ['b', 'c']},
+}
+
+
+def transform_stats(state, checkpoint=0, next_checkpoint=None, processed=0, operations_behind=None):
+    checkpointing = {'last': {'checkpoint': checkpoint}}
+    if next_checkpoint:
+        checkpointing['next'] = {'checkpoint': next_checkpoint}
+    if operations_behind:
+        checkpointing['operations_behind'] = operations_behind
+    return {
+        'state': state,
+        'checkpointing': checkpointing,
+        'stats': {'documents_processed': processed, 'documents_indexed': processed // 2},
+    }
+
+
+class FakeTransforms:
+    """Returns the given transform stats, one after the other."""
+
+    def __init__(self, stats):
+        self.stats = list(stats)
+        self.calls = 0
+
+    def get_transform_stats(self, name):
+        stats = self.stats[min(self.calls, len(self.stats) - 1)]
+        self.calls += 1
+        return {'count': 1, 'transforms': [stats]}
+
+
+class FakeElasticsearch:
+    def __init__(self, stats):
+        self.transform = FakeTransforms(stats)
+
+
+class FakeApi:
+    """Stores resources by name, like the index, pipeline and transform APIs."""
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.num_puts = 0
+
+    def get(self, name):
+        return self.resources.get(name)
+
+    def put(self, name, body):
+        self.num_puts += 1
+        self.resources[name] = body
+
+    def delete(self, name):
+        self.resources.pop(name, None)
+
+
+class FakeIndices(FakeApi):
+    def get_mapping(self, index, ignore):
+        return {index: {'mappings': self.get(index)['mappings']}} if self.get(index) else {}
+
+    def create(self, name, body):
+        self.put(name, body)
+
+    def delete(self, name, ignore):
+        super().delete(name)
+
+
+class FakeIngest(FakeApi):
+    def get_pipeline(self, id, ignore):
+        return {id: self.get(id)} if self.get(id) else {}
+
+    def put_pipeline(self, name, body):
+        self.put(name, body)
+
+
+class FakeTransformApi(FakeApi):
+    def get_transform(self, transform_id, ignore):
+        return {'count': 1, 'transforms': [self.get(transform_id)]} if self.get(transform_id) else {}
+
+    def put_transform(self, name, body):
+        self.put(name, body)
+
+    def delete_transform(self, name, force, ignore):
+        self.delete(name)
+
+
+class FakeProvisioningElasticsearch:
+    def __init__(self):
+        self.indices = FakeIndices({})
+        self.ingest = FakeIngest({})
+        self.transform = FakeTransformApi({})
+
+
+class TestResources(unittest.TestCase):
+
+    def test_transform_config(self):
+        name = TRANSFORM_NAMES[0]
+        self.assertNotIn('sync', transform_config(name))
+
+        transform = transform_config(name, continuous=True, frequency='10s')
+        self.assertEqual(transform['frequency'], '10s')
+        self.assertEqual(transform['sync']['time']['field'], '@timestamp')
+        self.assertEqual(transform_config(TRANSFORM_NAMES[1], continuous=True)['sync']['time']['field'],
+                         'query_event.@timestamp')
+
+    def test_transform_variants(self):
+        scripted = transform_config(QUERYID_TRANSFORM)
+        native = transform_config(QUERYID_TRANSFORM, variant='native')
+        self.assertIn('scripted_metric', scripted['pivot']['aggregations']['query_event'])
+        self.assertNotIn('scripted_metric', json.dumps(native))
+
+        # same destination and metrics, only the pipeline flattens the query event
+        self.assertEqual(native['dest']['index'], scripted['dest']['index'])
+        self.assertIn(native['dest']['pipeline'], PIPELINE_NAMES)
+        self.assertEqual({k: v for k, v in native['pivot']['aggregations'].items() if k != 'query_event'},
+                         {k: v for k, v in scripted['pivot']['aggregations'].items() if k != 'query_event'})
+
+        # the native variant collects the fields of the query event that have doc values, including the simulation
+        # fields used by A/B comparisons, which the pipeline nests under `query_event`
+        fields = [x['field'] for x in native['pivot']['aggregations']['query_event']['aggregations']['fields']
+                  ['top_metrics']['metrics']]
+        self.assertIn('SearchMetricsSimulation.ab.experiment', fields)
+        self.assertIn('SearchMetricsSimulation.ab.variant', fields)
+        self.assertIn('SearchMetricsSimulation.page_name', fields)
+        self.assertNotIn('source.geo.location', fields)
+
+        # transforms without variants have only one config
+        self.assertEqual(transform_config_name(TRANSFORM_NAMES[1], 'native'), TRANSFORM_NAMES[1])
+        with self.assertRaises(ValueError):
+            transform_config(QUERYID_TRANSFORM, variant='unknown')
+
+    def test_native_query_event_fields(self):
+        # every field of the query event read downstream is collected by the native variant too
+        native = transform_config(QUERYID_TRANSFORM, variant='native')
+        aggregations = native['pivot']['aggregations']['query_event']['aggregations']
+        collected = {x['field'] for x in aggregations['fields']['top_metrics']['metrics']} | {'@timestamp'}
+
+        configs = [inspect.getsource(ab), inspect.getsource(report)]
+        for name, x in load_manifest().items():
+            if QUERYID_TRANSFORM in x['depends_on']:
+                transform = transform_config(name)
+                configs.append(json.dumps(transform))
+                configs.append(json.dumps(load_config('pipelines', transform['dest']['pipeline'])))
+        read = {x.replace('.keyword', '') for x in re.findall(r'query_event\.([\w@.]+\w)', ' '.join(configs))}
+
+        self.assertIn('SearchMetrics.query.id', read)
+        self.assertEqual(read - collected, set())
+
+    def test_is_transform_done(self):
+        self.assertFalse(is_transform_done(transform_stats('indexing'), False))
+        self.assertFalse(is_transform_done(transform_stats('stopped'), False))
+        self.assertTrue(is_transform_done(transform_stats('stopped', 1), False))
+
+        self.assertFalse(is_transform_done(transform_stats('started'), True))
+        self.assertFalse(is_transform_done(transform_stats('indexing', 1, next_checkpoint=2), True))
+        self.assertFalse(is_transform_done(transform_stats('started', 1, operations_behind=10), True))
+        self.assertTrue(is_transform_done(transform_stats('started', 2), True))
+
+    def test_wait_for_transform(self):
+        es = FakeElasticsearch([
+            transform_stats('started'),
+            transform_stats('indexing', processed=100),
+            transform_stats('indexing', processed=200),
+            transform_stats('stopped', 1, processed=300),
+        ])
+
+        stats = wait_for_transform(es, 'test')
+        self.assertEqual(stats['stats']['documents_processed'], 300)
+        self.assertEqual(es.transform.calls, 4)
+
+    def test_wait_for_transform_failed(self):
+        es = FakeElasticsearch([dict(transform_stats('failed'), reason='test')])
+        with self.assertRaises(RuntimeError):
+            wait_for_transform(es, 'test')
+
+    def test_wait_for_transform_timeout(self):
+        es = FakeElasticsearch([transform_stats('started')])
+        with self.assertRaises(TimeoutError):
+            wait_for_transform(es, 'test', timeout=0.2)
+
+    def test_config_hash(self):
+        self.assertEqual(config_hash({'a': 1, 'b': [1, 2]}), config_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(config_hash({'a': 1}), config_hash({'a': 2}))
+        self.assertEqual(index_config(INDEX)['mappings']['_meta']['config_hash'],
+                         config_hash(load_config('indices', INDEX)))
+
+    def test_create_without_hash(self):
+        # `prepare` works on clusters before 7.16, which reject `_meta` on pipelines and transforms
+        es = FakeProvisioningElasticsearch()
+        create_pipeline(es, PIPELINE_NAMES[0])
+        create_transform(es, QUERYID_TRANSFORM)
+        self.assertEqual(es.ingest.resources[PIPELINE_NAMES[0]], load_config('pipelines', PIPELINE_NAMES[0]))
+        self.assertNotIn('_meta', es.transform.resources[QUERYID_TRANSFORM])
+
+    def test_provision(self):
+        es = FakeProvisioningElasticsearch()
+        num_resources = len(INDEX_NAMES) + len(PIPELINE_NAMES) + len(TRANSFORM_NAMES)
+        self.assertEqual(len(provision(es)), num_resources)
+
+        # nothing changed
+        self.assertEqual(provision(es), [])
+        self.assertEqual(es.indices.num_puts, len(INDEX_NAMES))
+
+        # transforms changed
+        self.assertEqual(provision(es, continuous=True), TRANSFORM_NAMES)
+        self.assertIn('sync', es.transform.resources[TRANSFORM_NAMES[0]])
+
+        # changed indices recreate the transforms that use them
+        es.indices.resources[TRANSFORM_NAMES[1]]['mappings']['_meta']['config_hash'] = 'changed'
+        self.assertEqual(provision(es, continuous=True), [TRANSFORM_NAMES[1], TRANSFORM_NAMES[1]])
+
+        # switching variants only changes that transform
+        self.assertEqual(provision(es, continuous=True, variant='native'), [QUERYID_TRANSFORM])
+        self.assertEqual(provision(es, continuous=True, variant='native'), [])
+
+    def test_manifest(self):
+        manifest = load_manifest()
+        self.assertEqual(transform_levels(TRANSFORM_NAMES, manifest), [[x] for x in TRANSFORM_NAMES])
+
+    def test_transform_levels(self):
+        self.assertEqual(transform_levels(['a', 'b', 'c', 'd'], MANIFEST), [['a', 'c'], ['b'], ['d']])
+
+        # dependencies that are not run are assumed to be done
+        self.assertEqual(transform_levels(['b', 'd'], MANIFEST), [['b'], ['d']])
+
+        with self.assertRaises(ValueError):
+            transform_levels(['a', 'b'], {'a': {'depends_on': ['b']}, 'b': {'depends_on': ['a']}})
+
+    def test_run_transforms(self):
+        lock = threading.Lock()
+        running = set()
+        concurrent = []
+
+        def start_transform(es, name, with_progress=True):
+            with lock:
+                for x in MANIFEST[name]['depends_on']:
+                    self.assertNotIn(x, running)
+                running.add(name)
+                concurrent.append(set(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(name)
+
+        with mock.patch.object(resources, 'start_transform', start_transform):
+            timings = run_transforms(None, ['a', 'b', 'c', 'd'], MANIFEST)
+
+        # independent transforms run at the same time, dependents after what they depend on
+        self.assertIn({'a', 'c'}, concurrent)
+        self.assertGreaterEqual(timings['b'][0], timings['a'][1])
+        self.assertGreaterEqual(timings['d'][0], max(timings['b'][1], timings['c'][1]))
+
+    def test_run_transforms_failed(self):
+        started = []
+
+        def start_transform(es, name, with_progress=True):
+            started.append(name)
+            if name == 'a':
+                raise RuntimeError("failed")
+
+        with mock.patch.object(resources, 'start_transform', start_transform):
+            with self.assertRaises(RuntimeError):
+                run_transforms(None, ['a', 'b'], MANIFEST)
+        self.assertEqual(started, ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,17 @@
 import unittest
 
+from unittest import mock
+
+from metrics.clicks import CascadeClickModel
 from metrics.simulate import *
 
 
 class TestSimulate(unittest.TestCase):
 
+    def test_stable_hash(self):
+        self.assertEqual(stable_hash('42'), stable_hash(42))
+        self.assertEqual(stable_hash('42'), 841265288)
+
     def test_time_to_timestamp(self):
         self.assertEqual(time_to_timestamp(datetime.datetime(2019, 11, 15)), '2019-11-15T00:00:00.000Z')
         self.assertEqual(time_to_timestamp(datetime.datetime(2019, 11, 10, 19, 24, 45)), '2019-11-10T19:24:45.000Z')
@@ -59,17 +66,17 @@ class TestSimulate(unittest.TestCase):
         self.assertEqual(sorted(uuids_deduplicated), sorted(uuids))
 
     def test_random_results(self):
-        doc_ids = string_ids(set(range(0, 100)))
+        doc_ids = range(0, 100)
 
         results = random_results(doc_ids, maximize_num_results=True)
         result_set = set(results)
 
         self.assertEqual(len(results), MAX_NUM_RESULTS)
-        self.assertTrue(len(result_set), len(results))
+        self.assertEqual(len(result_set), len(results))
         self.assertTrue(result_set.issubset(doc_ids))
 
     def test_generate_static_queries(self):
-        doc_ids = set(string_ids(range(0, 100)))
+        doc_ids = range(0, 100)
 
         static_queries = generate_static_queries(doc_ids, maximize_num_results=True)
 
@@ -84,7 +91,7 @@ class TestSimulate(unittest.TestCase):
             self.assertFalse(r)
 
     def test_query(self):
-        doc_ids = set(string_ids(range(0, 100)))
+        doc_ids = range(0, 100)
         user_id = 3
 
         static_queries = generate_static_queries(doc_ids, maximize_num_results=True)
@@ -96,10 +103,10 @@ class TestSimulate(unittest.TestCase):
         self.assertEqual(event['event']['action'], 'SearchMetrics.query')
         self.assertEqual(event['source']['user']['id'], user_id)
         self.assertEqual(len(event['SearchMetrics']['results']['ids']), event['SearchMetrics']['results']['size'])
-        self.assertTrue(set(event['SearchMetrics']['results']['ids']).issubset(doc_ids))
+        self.assertTrue(set(event['SearchMetrics']['results']['ids']).issubset(string_ids(doc_ids)))
 
     def test_result_clicks(self):
-        doc_ids = set(string_ids(range(0, 1000)))
+        doc_ids = range(0, 1000)
         user_id = 1
 
         static_queries = generate_static_queries(doc_ids, maximize_num_results=True)
@@ -115,7 +122,7 @@ class TestSimulate(unittest.TestCase):
         for click in clicks:
             self.assertEqual(click['event']['action'], 'SearchMetrics.click')
             self.assertEqual(click['SearchMetrics']['query']['id'], query_event['SearchMetrics']['query']['id'])
-            self.assertTrue(click['SearchMetrics']['click']['result']['id'] in doc_ids)
+            self.assertTrue(click['SearchMetrics']['click']['result']['id'] in string_ids(doc_ids))
 
         click_times = [timestamp_to_time(click['@timestamp']) for click in clicks]
 
@@ -127,6 +134,28 @@ class TestSimulate(unittest.TestCase):
         for click_time in click_times:
             self.assertLessEqual(last_click_time, click_time)
 
+    def test_result_clicks_click_model(self):
+        doc_ids = range(0, 1000)
+        static_queries = generate_static_queries(doc_ids, maximize_num_results=True)
+        (query_time, query_event, _) = query(doc_ids, 1, static_queries, maximize_num_results=True)
+
+        clicks = result_clicks(query_time, query_event, maximize_num_clicks=True, click_model=CascadeClickModel())
+
+        # the top results are clicked, in rank order
+        ranks = [x['SearchMetrics']['click']['result']['rank'] for x in clicks]
+        self.assertEqual(ranks, list(range(1, MAX_CLICKS_PER_QUERY + 1)))
+
+        click_times = [timestamp_to_time(x['@timestamp']) for x in clicks]
+        self.assertGreater(click_times[0], query_time)
+        self.assertEqual(click_times, sorted(click_times))
+
+    def test_iter_records_click_model(self):
+        # one generator for the click model per run, not per page of results
+        with mock.patch('metrics.simulate.click_model_rng', wraps=click_model_rng) as rng:
+            records = list(iter_records(100, 5, 5, click_model=CascadeClickModel()))
+        self.assertTrue(any(isinstance(x, ClickEvent) for x in records))
+        self.assertEqual(rng.call_count, 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from elasticsearch import Elasticsearch, TransportError
+
+from metrics import ingest, loader
+from metrics.standin import *
+
+
+def bulk_body(*actions):
+    return b''.join(json.dumps(x).encode('utf-8') + b'\n' for x in actions)
+
+
+class TestStandin(unittest.TestCase):
+
+    def test_bulk(self):
+        standin = Standin()
+        body = bulk_body({'index': {'_id': '1'}}, {'a': 1}, {'create': {'_index': 'other'}}, {'a': 2},
+                         {'delete': {'_id': '2'}}, {'index': {'_id': '1'}}, {'a': 3})
+        status, response = standin.handle('POST', '/events/_bulk', body)
+
+        self.assertEqual(status, 200)
+        self.assertFalse(response['errors'])
+        self.assertEqual([x[next(iter(x))]['status'] for x in response['items']], [201, 201, 404, 200])
+        self.assertEqual(standin.count('events')[1]['count'], 1)
+        self.assertEqual(standin.count('oth*,events')[1]['count'], 2)
+        self.assertEqual(standin.count(None)[1]['count'], 2)
+        self.assertEqual(standin.count('missing')[0], 404)
+        self.assertEqual(standin.stats.num_docs, 3)
+        self.assertEqual(standin.stats.num_bytes, len(body))
+
+    def test_rejections(self):
+        standin = Standin(reject_rate=1.0)
+        self.assertEqual(standin.handle('POST', '/_bulk', bulk_body({'index': {}}, {}))[0], 429)
+        self.assertEqual(standin.handle('PUT', '/events/_doc/1', b'{}')[0], 429)
+        self.assertEqual(standin.stats.num_rejected_requests, 2)
+
+        standin = Standin(item_reject_rate=0.2, failure_rate=0.1, seed=0)
+        status, response = standin.handle('POST', '/events/_bulk', bulk_body(*[{'index': {}}, {}] * 1000))
+        statuses = [x['index']['status'] for x in response['items']]
+        self.assertTrue(response['errors'])
+        self.assertEqual(statuses.count(429), standin.stats.num_rejected_items)
+        self.assertEqual(statuses.count(400), standin.stats.num_failed_items)
+        self.assertAlmostEqual(standin.stats.num_rejected_items / 1000, 0.2, delta=0.05)
+        self.assertAlmostEqual(standin.stats.num_failed_items / 1000, 0.1, delta=0.05)
+        self.assertEqual(standin.stats.num_docs, statuses.count(201))
+
+    def test_client(self):
+        standin = Standin(item_reject_rate=0.1, seed=0)
+        with running(standin) as url:
+            es = Elasticsearch(url)
+            es.index(index='events', id='a', body={'a': 1})
+            stats = ingest.bulk_index(es, [{'a': x} for x in range(100)], index='events', chunk_size=10,
+                                      initial_backoff=0.01)
+            es.indices.refresh(index='events')
+            self.assertEqual(es.count(index='events')['count'], 1 + stats.num_docs)
+            # rejected documents are retried
+            self.assertEqual((stats.num_docs, stats.num_failures), (100, 0))
+            self.assertGreater(standin.stats.num_rejected_items, 0)
+
+            with self.assertRaises(TransportError):
+                es.search(index='events')
+
+    def test_bulk_index_rejected_requests(self):
+        standin = Standin(reject_rate=0.3, seed=0)
+        with running(standin) as url:
+            stats = ingest.bulk_index(Elasticsearch(url), [{'a': x} for x in range(200)], index='events',
+                                      chunk_size=10, initial_backoff=0.01)
+
+        self.assertEqual((stats.num_docs, stats.num_failures), (200, 0))
+        self.assertGreater(standin.stats.num_rejected_requests, 0)
+        self.assertEqual(standin.count('events')[1]['count'], 200)
+
+    def test_load_events(self):
+        standin = Standin(item_reject_rate=0.2, seed=0)
+        lines = [json.dumps({'event': {'id': str(i)}}).encode('utf-8') for i in range(300)]
+        with tempfile.TemporaryDirectory() as directory, running(standin) as url:
+            filenames = []
+            for i in range(3):
+                filenames.append(os.path.join(directory, f'events-{i}.ndjson'))
+                with open(filenames[-1], 'wb') as f:
+                    f.write(b'\n'.join(lines[i * 100:(i + 1) * 100]) + b'\n')
+
+            with mock.patch.object(loader, 'backoff', return_value=0):
+                stats = loader.load_events(url, filenames, index='events', workers=2, max_docs=30,
+                                           report_interval=0.1)
+
+        self.assertEqual(stats.num_docs, 300)
+        self.assertEqual(stats.num_failures, 0)
+        self.assertGreater(stats.num_retries, 0)
+        self.assertEqual(standin.count('events')[1]['count'], 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
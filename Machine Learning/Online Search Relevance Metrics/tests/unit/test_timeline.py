@@ -0,0 +1,65 @@
+import datetime
+import unittest
+
+from metrics.timeline import *
+
+
+class TestTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+
+    def test_date_to_millis(self):
+        self.assertEqual(date_to_millis(datetime.date(1970, 1, 2)), MS_PER_DAY)
+        self.assertEqual(date_to_millis(datetime.date(2019, 11, 15)), 1573776000000)
+
+    def test_millis_to_time(self):
+        millis = date_to_millis(datetime.date(2019, 11, 15)) + MS_PER_HOUR + 1001
+        self.assertEqual(millis_to_time(millis), datetime.datetime(2019, 11, 15, 1, 0, 1, 1000))
+
+    def test_timestamp_to_millis(self):
+        self.assertEqual(timestamp_to_millis('1970-01-01T00:00:01.001Z'), 1001)
+        self.assertEqual(millis_to_timestamp(1573776000000 + 1001), '2019-11-15T00:00:01.001Z')
+
+    def test_millis_to_timestamps(self):
+        millis = np.array([date_to_millis(datetime.date(2019, 11, 15)) + 1001])
+        self.assertEqual(list(millis_to_timestamps(millis)), ['2019-11-15T00:00:01.001Z'])
+
+    def test_hourly_weights(self):
+        # 2019-11-15 is a Friday
+        date = datetime.date(2019, 11, 15)
+
+        self.assertTrue((hourly_weights(date, 2, 'flat') == 1.0).all())
+        self.assertEqual(list(hourly_weights(date, 2, 'diurnal')), list(DIURNAL_WEIGHTS) * 2)
+
+        weekly = hourly_weights(date, 3, 'weekly').reshape(3, 24)
+        self.assertEqual(list(weekly[:, 10]), list(WEEKLY_WEIGHTS[4:7]))
+
+        with self.assertRaises(ValueError):
+            hourly_weights(date, 1, 'unknown')
+
+    def test_sample_range(self):
+        model = TimeModel(datetime.date(2019, 11, 15), num_days=3)
+        millis = model.sample(self.rng, 10000)
+
+        self.assertEqual(model.end_millis - model.start_millis, 3 * MS_PER_DAY)
+        self.assertTrue((millis >= model.start_millis).all())
+        self.assertTrue((millis < model.end_millis).all())
+        self.assertEqual(len(np.unique((millis - model.start_millis) // MS_PER_DAY)), 3)
+
+    def test_sample_diurnal(self):
+        model = TimeModel(datetime.date(2019, 11, 15), curve='diurnal')
+        hours = (model.sample(self.rng, 100000) - model.start_millis) // MS_PER_HOUR
+        counts = np.bincount(hours, minlength=24)
+
+        # more traffic in the evening than at night
+        self.assertGreater(counts[20], 5 * counts[3])
+
+    def test_sample_seed(self):
+        model = TimeModel(datetime.date(2019, 11, 15), num_days=7, curve='weekly')
+        self.assertEqual(list(model.sample(np.random.default_rng(1), 100)),
+                         list(model.sample(np.random.default_rng(1), 100)))
+
+
+if __name__ == '__main__':
+    unittest.main()